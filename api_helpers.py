@@ -1,11 +1,20 @@
 import os
-import requests
-import mimetypes
-import random
+import shlex
+import tempfile
 import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-import subprocess
-import json
+import atexit
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from utils.preview_resolver import PreviewResolverPool
+from utils.search_cache import SearchCache, CachedSpotify
+from utils.preview_cache import cache_enabled, preview_cache_key, get_cached_previews, cache_previews
+from utils.image_analyses import url_hash, file_hash, get_cached_keywords, cache_keywords
+from utils.everypixel import EverypixelClient
+from utils.image_prep import prepare_image, fetch_image
+from utils.resilience import get_breaker, CircuitOpen
+from utils.keyword_index import normalize_keyword, lookup_keyword_songs, mark_keywords_refreshed
+from utils.song_ranking import rank_songs
+from utils.spotify_token import SharedTokenCache, SharedClientCredentials
 
 # Load credentials from environment variables
 EPIX_CLIENT_ID = os.getenv("EPIX_CLIENT_ID")
@@ -13,112 +22,487 @@ EPIX_API_KEY = os.getenv("EPIX_API_KEY")
 SPOT_CLIENT_ID = os.getenv("SPOT_CLIENT_ID")
 SPOT_API_KEY = os.getenv("SPOT_API_KEY")
 
+# Everypixel client settings, EPIX_BASE_URL can point at a local stub (stubs/everypixel.py)
+EPIX_BASE_URL = os.getenv("EPIX_BASE_URL", EverypixelClient.BASE_URL)
+EPIX_CONNECT_TIMEOUT = float(os.getenv("EPIX_CONNECT_TIMEOUT", 3.05))
+EPIX_READ_TIMEOUT = float(os.getenv("EPIX_READ_TIMEOUT", 20))
+EPIX_MAX_RETRIES = int(os.getenv("EPIX_MAX_RETRIES", 3))
 
-# setup spotipy credentials
-sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(client_id=SPOT_CLIENT_ID, client_secret=SPOT_API_KEY))
+# shrink images before they go to Everypixel (utils/image_prep.py)
+# URLs are left for Everypixel to fetch unless IMAGE_PREP_URLS is on, then we download + shrink them
+IMAGE_PREP = os.getenv("IMAGE_PREP", "1") == "1"
+IMAGE_PREP_URLS = os.getenv("IMAGE_PREP_URLS", "0") == "1"
 
-def get_preview_url_from_node(query):
-    try:
-        # call node script using subprocess and pass in the song query
-        result = subprocess.run(
-            ['node', 'get_preview.js', query], # run : node get_preview.js 'song name'
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            check=True
-        )
-
-        # grab json output from node script
-        output = result.stdout.strip()
-        data = json.loads(output)
-
-        # return the first preview URL if it exists
-        if data.get("previewUrls"):
-            return data["previewUrls"][0]
+# Node preview resolver settings
+PREVIEW_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'get_preview.js')
+# command for one preview worker, PREVIEW_WORKER_CMD swaps in a stand-in (stubs/preview_worker.py)
+PREVIEW_WORKER_CMD = shlex.split(os.getenv("PREVIEW_WORKER_CMD", "")) or ['node', PREVIEW_SCRIPT, '--server']
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", 2))
+PREVIEW_TIMEOUT = float(os.getenv("PREVIEW_TIMEOUT", 10))
+# save a post's songs without waiting on Node, previews are resolved on first play (/songs/<id>/preview)
+LAZY_PREVIEWS = os.getenv("LAZY_PREVIEWS", "1") == "1"
+
+# max Spotify searches in flight per process, keeps us under Spotify rate limits
+SPOTIFY_MAX_CONCURRENCY = int(os.getenv("SPOTIFY_MAX_CONCURRENCY", 4))
+SPOTIFY_TIMEOUT = float(os.getenv("SPOTIFY_TIMEOUT", 5))
+
+# Spotify API + token endpoints, point them at a local stand-in (stubs/spotify.py) for offline runs
+SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL")
+SPOTIFY_TOKEN_URL = os.getenv("SPOTIFY_TOKEN_URL")
+# access token file shared by every worker on the host, so only one of them fetches / refreshes it
+SPOTIFY_TOKEN_CACHE = os.getenv("SPOTIFY_TOKEN_CACHE", os.path.join(tempfile.gettempdir(), 'imagime-spotify-token.json'))
+MAX_SONGS = 10
+
+# end-to-end time budget for image -> keywords -> songs -> previews (seconds)
+# keywords + searches each get a share of it, previews get whatever is left
+PIPELINE_BUDGET = float(os.getenv("PIPELINE_BUDGET", 45))
+KEYWORDS_SHARE = 0.4
+SEARCH_SHARE = 0.3
+
+# the local keyword -> song index answers when it knows at least this share of the keywords
+INDEX_COVERAGE = float(os.getenv("INDEX_COVERAGE", 0.7))
+# seconds a keyword's indexed songs answer it before it goes to Spotify again, so its songs keep
+# being refreshed (a keyword's first few songs would otherwise answer it forever)
+INDEX_REFRESH_TTL = float(os.getenv("INDEX_REFRESH_TTL", 7 * 24 * 3600))
+
+# one circuit breaker per upstream : consecutive failures before it opens, seconds before a trial call
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", 5))
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", 30))
+
+everypixel_breaker = get_breaker('everypixel', BREAKER_THRESHOLD, BREAKER_RESET)
+spotify_breaker = get_breaker('spotify_search', BREAKER_THRESHOLD, BREAKER_RESET)
+preview_breaker = get_breaker('node_preview', BREAKER_THRESHOLD, BREAKER_RESET)
+
+
+# search result cache : in-process LRU + optional redis layer shared across gunicorn workers
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 512))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 6 * 3600))
+REDIS_URL = os.getenv("REDIS_URL")
+
+# one keep-alive session per process for every Everypixel call
+everypixel = EverypixelClient(
+    EPIX_CLIENT_ID, EPIX_API_KEY,
+    base_url=EPIX_BASE_URL,
+    connect_timeout=EPIX_CONNECT_TIMEOUT,
+    read_timeout=EPIX_READ_TIMEOUT,
+    max_retries=EPIX_MAX_RETRIES
+)
+
+search_cache = SearchCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL, redis_url=REDIS_URL)
+
+def spotify_client(api_url=SPOTIFY_API_URL, token_url=SPOTIFY_TOKEN_URL, cache_handler=None,
+                   client_id=None, client_secret=None):
+    """
+    spotipy client with our credentials (or the given ones), talking to Spotify or to the given stand-in URLs
+    cache_handler is where the access token is kept, by default the file shared across workers
+
+    """
+
+    auth_manager = SharedClientCredentials(client_id=client_id or SPOT_CLIENT_ID,
+                                           client_secret=client_secret or SPOT_API_KEY,
+                                           cache_handler=cache_handler or SharedTokenCache(SPOTIFY_TOKEN_CACHE))
+    if token_url:
+        auth_manager.OAUTH_TOKEN_URL = token_url
+
+    client = spotipy.Spotify(auth_manager=auth_manager, requests_timeout=SPOTIFY_TIMEOUT)
+    if api_url:
+        client.prefix = api_url
+
+    return client
+
+# setup spotipy credentials, track searches go through the search cache + the spotify breaker
+# the client is built on the first search, so the app starts even without Spotify credentials
+sp = CachedSpotify(None, search_cache, breaker=spotify_breaker, client_factory=spotify_client)
+
+_preview_pool = None
+_preview_pool_lock = threading.Lock()
+_search_executor = None
+_search_executor_lock = threading.Lock()
+
+def get_preview_pool():
+    """Lazily start the pool of long-running Node preview workers (one pool per process)"""
+
+    global _preview_pool
+
+    with _preview_pool_lock:
+        if _preview_pool is None:
+            _preview_pool = PreviewResolverPool(
+                command=PREVIEW_WORKER_CMD, # run : node get_preview.js --server
+                size=PREVIEW_WORKERS,
+                timeout=PREVIEW_TIMEOUT
+            )
+            atexit.register(_preview_pool.close)
+
+    return _preview_pool
+
+def record_preview_outcome(future):
+    """Report a Node lookup's outcome to the preview breaker"""
+
+    if future.cancelled():
+        preview_breaker.release()
+    elif future.exception() is not None:
+        preview_breaker.record_failure()
+    else:
+        preview_breaker.record_success()
 
+def start_preview_lookups(queries):
+    """
+    Start preview lookups for many "title artist" queries
+    Answers come from the preview cache when possible, the rest go to the Node worker pool
+    While the preview breaker is open the Node stage is skipped (the lookups fail with CircuitOpen)
+    Returns ({query: Future}, set of queries sent to Node)
+
+    """
+
+    cached = {}
+    if cache_enabled():
+        cached = get_cached_previews(preview_cache_key(query) for query in queries)
+
+    lookups = {}
+    fresh = set()
+
+    for query in queries:
+        key = preview_cache_key(query)
+        if key in cached:
+            lookups[query] = Future()
+            lookups[query].set_result(cached[key])
+        elif not preview_breaker.allow():
+            lookups[query] = Future()
+            lookups[query].set_exception(CircuitOpen(f'Circuit {preview_breaker.name} is open'))
+        else:
+            lookups[query] = get_preview_pool().submit(query)
+            lookups[query].add_done_callback(record_preview_outcome)
+            fresh.add(query)
+
+    return lookups, fresh
+
+def cache_preview_results(lookups, fresh):
+    """Save the answers Node gave for fresh lookups (lookups that failed are not cached)"""
+
+    if not cache_enabled():
+        return
+
+    results = {}
+    for query in fresh:
+        future = lookups[query]
+        if future.done() and not future.cancelled() and future.exception() is None:
+            results[preview_cache_key(query)] = future.result()
+
+    try:
+        cache_previews(results)
     except Exception as e:
-        print("Error getting preview from Node:", e)
+        print("Error caching previews:", e)
+
+def get_preview_urls_from_node(queries):
+    """Resolve preview URLs for many song queries at once (cache first, then the Node worker pool)"""
+
+    if not queries:
+        return []
+
+    lookups, fresh = start_preview_lookups(queries)
 
-    return None  # fallback if nothing found
+    urls = []
+    for query in queries:
+        try:
+            urls.append(lookups[query].result())
+        except Exception as e:
+            print(f"Error getting preview for {query}:", e)
+            urls.append(None)
 
+    cache_preview_results(lookups, fresh)
 
-def extract_keywords_only(response):
-    """Extract keyword text values from JSON repsonse"""
+    return urls
+
+def get_preview_url_from_node(query):
+    """Resolve the preview URL for a single song query"""
+
+    return get_preview_urls_from_node([query])[0]
+
+def find_preview_url(query):
+    """
+    Preview URL for a single song query (cache first, then Node), None when the song has none
+    Raises when it couldn't be looked up (Node failed or timed out, its circuit is open) instead
+    of answering None like get_preview_url_from_node
+
+    """
+
+    lookups, fresh = start_preview_lookups([query])
+
+    try:
+        return lookups[query].result()
+    finally:
+        cache_preview_results(lookups, fresh)
+
+
+def extract_keyword_scores(response):
+    """Keywords with Everypixel's confidence scores ([{'keyword', 'score'}]) from a JSON response"""
 
     if response.get('status') == 'ok':
         # get list of keywords from response, or empty list if 'keywords' key is not found
         keywords = response.get('keywords', [])
-        # create new list by getting value of 'keyword' for each item in the keywords list
-        return [k.get('keyword') for k in keywords]
+        return [{'keyword': k.get('keyword'), 'score': k.get('score')} for k in keywords]
     return None
 
-def image_to_keywords(image_url=None, local_image_file=None, num_keywords=10):
-    """Analyze image URL or image file to extract keywords"""
+def prepare_for_tagging(image_url=None, local_image_file=None, deadline=None):
+    """
+    Downscaled, metadata-free copy of the image to send to Everypixel
+    None means send the original (prep turned off, a URL left for Everypixel, or the image couldn't be read)
 
-    BASE_URL = 'https://api.everypixel.com/v1/keywords'
-    AUTH = (EPIX_CLIENT_ID, EPIX_API_KEY) # auth should be tuple
-    params = {'num_keywords': num_keywords} # specify # keywords to extract
+    """
 
-    if image_url:
-        # add image URL to the params dict
-        params['url'] = image_url
-        # make get request to API with image URL and auth
-        response = requests.get(BASE_URL, params=params, auth=AUTH)
-
-    elif local_image_file:
-        mime_type = mimetypes.guess_type(local_image_file)[0] # determine type of file
-        with open(local_image_file, 'rb') as file:
-            # prepare file for uploading
-            files = {'data': ('image', file, mime_type)}
-            # make post request to API with file and auth
-            response = requests.post(BASE_URL, files=files, auth=AUTH)
-    else:
-        raise ValueError('You must provide a valid image URL or image file.')
+    if not IMAGE_PREP or (image_url and not IMAGE_PREP_URLS):
+        return None
+
+    try:
+        if image_url:
+            timeout = EPIX_READ_TIMEOUT if deadline is None else min(EPIX_READ_TIMEOUT, deadline.remaining())
+            image = prepare_image(fetch_image(image_url, timeout=timeout))
+        else:
+            image = prepare_image(local_image_file)
+    except Exception as e:
+        print("Error preparing image, sending the original:", e)
+        return None
+
+    print(f"🖼️ Shrunk image {image.original_bytes // 1024}KB -> {len(image.data) // 1024}KB "
+          f"in {image.seconds * 1000:.0f}ms")
+
+    return image
+
+def fetch_image_keywords(image_url=None, local_image_file=None, num_keywords=10, deadline=None):
+    """Call Everypixel to extract keywords (with their scores) from an image URL or image file"""
+
+    image = prepare_for_tagging(image_url, local_image_file, deadline)
+
+    # errors, timeouts + 429 / 5xx left after retries count against the breaker, 4xx do not
+    with everypixel_breaker:
+        # GET with the image URL, or a multipart POST of the shrunk image / the streamed file, retried on 429 / 5xx
+        if image is not None:
+            response = everypixel.keywords(image_data=image.data, mime_type=image.content_type,
+                                           num_keywords=num_keywords, deadline=deadline)
+        else:
+            response = everypixel.keywords(image_url=image_url, image_file=local_image_file,
+                                           num_keywords=num_keywords, deadline=deadline)
+        if response.status_code in EverypixelClient.RETRY_STATUSES:
+            response.raise_for_status()
 
     if response.status_code == 200:
-        return extract_keywords_only(response.json()) # extract keywords from response
+        return extract_keyword_scores(response.json()) # extract keywords + scores from response
     else:
         response.raise_for_status()
 
-def keywords_to_songs(keywords, limit=3):
-    """Map keywords to songs"""
+def image_to_keywords(image_url=None, local_image_file=None, num_keywords=10, deadline=None, with_scores=False):
+    """
+    Analyze image URL or image file to extract keywords
+    Images analyzed before (same bytes or same canonical URL) are answered from image_analyses
+    deadline is the whole pipeline's, Everypixel gets KEYWORDS_SHARE of it
+    with_scores=True returns [{'keyword', 'score'}] instead of plain keywords
+
+    """
+
+    if not image_url and not local_image_file:
+        raise ValueError('You must provide a valid image URL or image file.')
+
+    if deadline is not None:
+        deadline = deadline.stage(KEYWORDS_SHARE)
+
+    if not cache_enabled():
+        keywords = fetch_image_keywords(image_url, local_image_file, num_keywords, deadline)
+        return keywords_or_scores(keywords, with_scores)
+
+    if image_url:
+        content_hash, source = url_hash(image_url), 'url'
+    else:
+        content_hash, source = file_hash(local_image_file), 'file'
+
+    keywords = get_cached_keywords(content_hash, num_keywords)
+    if keywords is not None:
+        return keywords_or_scores(keywords, with_scores)
+
+    keywords = fetch_image_keywords(image_url, local_image_file, num_keywords, deadline)
+
+    if keywords is not None:
+        cache_keywords(content_hash, source, num_keywords, keywords)
+
+    return keywords_or_scores(keywords, with_scores)
+
+def keywords_or_scores(keywords, with_scores):
+    """Plain keywords or [{'keyword', 'score'}] (analyses stored before scores were kept have score None)"""
+
+    if keywords is None:
+        return None
+
+    scored = [k if isinstance(k, dict) else {'keyword': k, 'score': None} for k in keywords]
+
+    return scored if with_scores else [k['keyword'] for k in scored]
+
+def get_search_executor():
+    """Lazily create the bounded thread pool shared by all Spotify searches in this process"""
+
+    global _search_executor
 
-    songs = []
-    seen_combos = set() # to store unique (title, artist) combos
+    with _search_executor_lock:
+        if _search_executor is None:
+            _search_executor = ThreadPoolExecutor(max_workers=SPOTIFY_MAX_CONCURRENCY,
+                                                  thread_name_prefix='spotify-search')
 
+    return _search_executor
+
+def track_to_song(track):
+    """Song details we keep from a Spotify track"""
+
+    return {
+        'title': track['name'],
+        'artist': track['artists'][0]['name'], # grab first artist
+        'album': track['album']['name'],
+        'image_url': track['album']['images'][0]['url'],
+        'spotify_url': track['external_urls']['spotify'],
+        'spotify_id': track['id'],
+        'popularity': track.get('popularity'),
+        'preview_url': None # filled in below by the node workers
+    }
+
+def indexed_songs(keywords, limit=3):
+    """
+    Songs the local keyword index knows for these keywords ({normalized keyword: songs})
+    Empty unless the index covers at least INDEX_COVERAGE of the keywords
+    Keywords not searched on Spotify for INDEX_REFRESH_TTL aren't covered (their songs are added
+    to the index when saved)
+
+    """
+
+    if not cache_enabled() or not keywords:
+        return {}
+
+    try:
+        found = lookup_keyword_songs(keywords, limit=limit, max_age=INDEX_REFRESH_TTL)
+    except Exception as e:
+        print("Error reading keyword index:", e)
+        return {}
+
+    covered = sum(1 for keyword in keywords if normalize_keyword(keyword) in found)
+    if covered < INDEX_COVERAGE * len(keywords):
+        return {}
+
+    return found
+
+def iter_keywords_to_songs(keywords, limit=3, deadline=None, scores=None, resolve_previews=True):
+    """
+    Map keywords to songs, yielding the best songs (best first) as their preview URLs resolve
+    Keywords the local index covers are answered from it, the rest are searched on Spotify concurrently
+    Every song found is a candidate, they are ranked on the keywords' scores (Everypixel confidence, in
+    keyword order, rank based when missing), Spotify popularity + cross-keyword hits (utils/song_ranking.py)
+    Preview lookups only run for the top MAX_SONGS
+    resolve_previews=False skips Node altogether, songs come right away with the previews already
+    known (keyword index or preview cache) and None for the rest
+
+    With a deadline, searches still running after SEARCH_SHARE of it are skipped and
+    songs whose preview isn't ready when it ends go out without one
+    A failed search only skips its keyword, unless every search failed
+
+    """
+
+    indexed = indexed_songs(keywords, limit=limit)
+
+    searches = []
     for keyword in keywords:
-        if(len(songs) >= 10): # cap at 10 to reduce load time
-            break
+        if normalize_keyword(keyword) in indexed:
+            search = Future() # answered by the index, no Spotify call
+            search.set_result({'songs': indexed[normalize_keyword(keyword)]})
+        else:
+            search = get_search_executor().submit(sp.search, q=keyword, type='track', limit=limit)
+        searches.append(search)
+
+    def songs_of(search):
+        result = search.result()
+        if 'songs' in result:
+            return [dict(song) for song in result['songs']] # from the keyword index
+        return [track_to_song(track) for track in result['tracks']['items']]
+
+    # every candidate is needed to rank them, wait for all the searches (up to the search budget)
+    search_deadline = deadline.stage(SEARCH_SHARE) if deadline is not None else None
+    wait(searches, timeout=search_deadline.remaining() if search_deadline is not None else None)
+
+    results = [] # songs found per keyword, in keyword order
+    errors = []
+
+    for keyword, search in zip(keywords, searches):
+        if not search.done(): # search budget ran out
+            print(f"Skipping Spotify search for {keyword!r}, out of time")
+            search.cancel()
+            results.append([])
+        elif search.exception() is not None:
+            print("Error searching Spotify:", search.exception())
+            errors.append(search.exception())
+            results.append([])
+        else:
+            results.append(songs_of(search))
+
+    if errors and len(errors) == len(searches):
+        raise errors[0] # nothing to recommend, let the caller retry
 
-        # search for tracks related to each q keyword with limit
-        result = sp.search(q=keyword, type='track', limit=limit)
+    refreshed = [keyword for keyword, found in zip(keywords, results)
+                 if found and normalize_keyword(keyword) not in indexed]
+    if refreshed and cache_enabled():
+        try:
+            mark_keywords_refreshed(refreshed)
+        except Exception as e:
+            print("Error updating keyword index:", e)
+
+    songs = rank_songs(results, scores if scores is not None else [None] * len(keywords), MAX_SONGS)
+
+    if not resolve_previews:
+        yield from with_known_previews(songs)
+        return
+
+    # previews only for the winners, indexed songs usually know theirs already
+    previews = {} # "title artist" query -> preview URL future
+    for song in songs:
+        if song['preview_url']:
+            previews[f"{song['title']} {song['artist']}"] = Future()
+            previews[f"{song['title']} {song['artist']}"].set_result(song['preview_url'])
+
+    queries = {f"{song['title']} {song['artist']}" for song in songs}
+    lookups, fresh_previews = start_preview_lookups(sorted(queries - previews.keys()))
+    previews.update(lookups)
+
+    try:
+        # hand out songs best first, each as soon as its preview is ready (or out of time)
+        for song in songs:
+            preview = previews[f"{song['title']} {song['artist']}"]
+            wait([preview], timeout=deadline.remaining() if deadline is not None else None)
 
-        for track in result['tracks']['items']:
-            if(len(songs) >= 10):
-                break
+            song['preview_url'] = None
+            if not preview.done():
+                preview.cancel() # out of time, the song goes out without a preview
+            else:
+                try:
+                    song['preview_url'] = preview.result()
+                except Exception as e:
+                    print("Error getting preview from Node:", e)
+            print(f"🔊 Preview URL for {song['title']} by {song['artist']}: {song['preview_url']}")  # DEBUG
 
-            title = track['name']
-            artist = track['artists'][0]['name'] # grab first artist
-            combos = (title, artist) # create tuple of title and artist
+            yield song
+    finally:
+        for preview in previews.values():
+            preview.cancel() # the caller stopped early, drop lookups still running
+        cache_preview_results(previews, fresh_previews)
 
-            # only add songs with unique title-artist combos to avoid dupes
-            if combos not in seen_combos:
-                preview = get_preview_url_from_node(f"{title} {artist}") # get prev from node script
-                print(f"🔊 Preview URL for {title} by {artist}: {preview}")  # DEBUG
+def with_known_previews(songs):
+    """Songs with the previews the preview cache already has, nothing is sent to Node"""
 
-                song_details = {
-                    'title': title,
-                    'artist': artist,
-                    'album': track['album']['name'],
-                    'image_url': track['album']['images'][0]['url'],
-                    'spotify_url': track['external_urls']['spotify'],
-                    'preview_url': preview # use the node fetched previw url
-                }
+    known = {}
+    if cache_enabled():
+        try:
+            known = get_cached_previews(preview_cache_key(f"{song['title']} {song['artist']}") for song in songs)
+        except Exception as e:
+            print("Error reading preview cache:", e)
 
-                songs.append(song_details)
-                seen_combos.add(combos) # mark this combo as seen
+    for song in songs:
+        if not song['preview_url']:
+            song['preview_url'] = known.get(preview_cache_key(f"{song['title']} {song['artist']}"))
+        yield song
 
-    # shuffle songs
-    random.shuffle(songs)
+def keywords_to_songs(keywords, limit=3, deadline=None, scores=None):
+    """Map keywords to songs (all at once, best first)"""
 
-    return songs
+    return list(iter_keywords_to_songs(keywords, limit=limit, deadline=deadline, scores=scores))
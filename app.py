@@ -4,6 +4,7 @@ from flask_debugtoolbar import DebugToolbarExtension
 from models import db, connect_db, User
 from blueprints.users.routes import users_bp
 from blueprints.posts.routes import posts_bp
+from commands import register_commands
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -39,8 +40,14 @@ connect_db(app)
 app.register_blueprint(users_bp, url_prefix='')
 app.register_blueprint(posts_bp, url_prefix='')
 
+# register CLI commands (flask preview-cache ...)
+register_commands(app)
+
 @app.before_request
 def add_user_to_g():
+    # User.follow_ids cache, one per request (a test's app context outlives its requests)
+    g.follow_ids = {}
+
     if CURR_USER_KEY in session:
         g.user = User.query.get(session[CURR_USER_KEY])
     else:
@@ -0,0 +1,72 @@
+"""
+Benchmark the post-creation pipeline against the local stand-ins
+
+Run (from the repo root) :
+    python -m bench --out baseline.json
+    python -m bench --latency lognormal:200:0.5 --compare baseline.json --out after.json
+
+The database is emptied before every level, it defaults to postgresql:///imagime_bench_db
+
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+
+parser = argparse.ArgumentParser(description='Benchmark image -> keywords -> songs and /posts/new')
+parser.add_argument('--scenarios', default='keywords,songs,route', help='Comma separated, from keywords,songs,route')
+parser.add_argument('--concurrency', default='1,4,16', help='Comma separated concurrent upload levels')
+parser.add_argument('--uploads', type=int, default=32, help='Uploads per level')
+parser.add_argument('--seed', type=int, default=0, help='Seed for the stand-ins catalog, latencies + errors')
+parser.add_argument('--latency', default='lognormal:80:0.5', help='Stand-in latency spec, see stubs/common.py')
+parser.add_argument('--error-rate', type=float, default=0.0)
+parser.add_argument('--database', default=os.getenv('BENCH_DATABASE_URL', 'postgresql:///imagime_bench_db'))
+parser.add_argument('--out', help='Write the results as JSON to this file')
+parser.add_argument('--compare', metavar='BASELINE', help='Compare with results saved by an earlier --out')
+parser.add_argument('--verbose', action='store_true', help="Show the pipeline's own output")
+parser.add_argument('--threshold', type=float, default=0.1, help='Change that counts as a regression (0.1 = 10%%)')
+args = parser.parse_args()
+
+# the app reads it on import (the stand-ins' Spotify client gets their own credentials)
+os.environ['DATABASE_URL'] = args.database
+
+from bench.harness import compare, format_results, format_comparison
+from bench.scenarios import run_benchmark, SCENARIOS
+
+scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+unknown = set(scenarios) - set(SCENARIOS)
+if unknown:
+    parser.error(f'Unknown scenario(s) : {", ".join(sorted(unknown))}')
+
+# progress goes to stderr, the pipeline's prints are dropped unless --verbose
+output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+with output:
+    results = run_benchmark(scenarios=scenarios,
+                            levels=[int(level) for level in args.concurrency.split(',')],
+                            uploads=args.uploads,
+                            seed=args.seed,
+                            latency=args.latency,
+                            error_rate=args.error_rate,
+                            report=lambda line: print(line, file=sys.stderr))
+
+print()
+print(format_results(results))
+
+if args.out:
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'\nResults written to {args.out}')
+
+if args.compare:
+    with open(args.compare) as f:
+        baseline = json.load(f)
+
+    rows = compare(results, baseline, args.threshold)
+    print()
+    print(format_comparison(rows, args.threshold))
+
+    # non-zero exit so CI can fail on a regression
+    sys.exit(1 if any(row[-1] for row in rows) else 0)
@@ -0,0 +1,151 @@
+"""
+Timing, counting + comparing pieces of the benchmark suite (no app imports here)
+
+"""
+
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event
+
+# metrics where a bigger number is a regression (everything else, throughput, is the other way round)
+LOWER_IS_BETTER = ('p50_ms', 'p95_ms', 'p99_ms', 'db_queries', 'upstream_calls', 'upload_kb')
+
+
+def percentile(values, pct):
+    """Linear interpolation between the closest ranks, None for no values"""
+
+    if not values:
+        return None
+
+    values = sorted(values)
+    rank = (len(values) - 1) * pct / 100
+    low, high = math.floor(rank), math.ceil(rank)
+
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+class QueryCounter:
+    """Counts every SQL statement sent on an engine while it is attached"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def _count(self, *args):
+        with self.lock:
+            self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+
+def run_level(upload, uploads, concurrency):
+    """
+    Call upload(n) for n in range(uploads), `concurrency` at a time
+    Returns (latencies in seconds of the uploads that worked, errors, wall seconds)
+
+    """
+
+    latencies = []
+    errors = []
+
+    def timed(n):
+        start = time.perf_counter()
+        try:
+            upload(n)
+        except Exception as e:
+            errors.append(f'{type(e).__name__}: {e}')
+            return
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(uploads)))
+
+    return latencies, errors, time.perf_counter() - start
+
+def summarize(scenario, concurrency, latencies, errors, wall, upstream, db_queries, upload_bytes=0):
+    """One result row, counts are per upload"""
+
+    uploads = len(latencies) + len(errors)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'uploads': uploads,
+        'errors': len(errors),
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'throughput': round(len(latencies) / wall, 3) if wall else None, # finished uploads / second
+        'upstream': {name: round(calls / uploads, 2) for name, calls in upstream.items()},
+        'upstream_calls': round(sum(upstream.values()) / uploads, 2),
+        'db_queries': round(db_queries / uploads, 2),
+        'upload_kb': round(upload_bytes / uploads / 1024, 1), # sent to Everypixel
+        'sample_errors': sorted(set(errors))[:3],
+    }
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Compare result rows with a saved baseline's, matched on (scenario, concurrency)
+    Returns rows of (scenario, concurrency, metric, before, after, change, regressed)
+
+    """
+
+    before = {(row['scenario'], row['concurrency']): row for row in baseline['results']}
+    rows = []
+
+    for row in results['results']:
+        old = before.get((row['scenario'], row['concurrency']))
+        if old is None:
+            continue
+
+        for metric in LOWER_IS_BETTER + ('throughput',):
+            if old.get(metric) is None or row.get(metric) is None:
+                continue
+
+            change = (row[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+            worse = change if metric in LOWER_IS_BETTER else -change
+            rows.append((row['scenario'], row['concurrency'], metric, old[metric], row[metric],
+                         change, worse > threshold))
+
+    return rows
+
+def format_results(results):
+    """Plain text table of result rows"""
+
+    lines = [f'{"scenario":<10}{"conc":>5}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}'
+             f'{"up/s":>8}{"calls":>7}{"queries":>9}{"KB sent":>9}{"errors":>7}']
+
+    for row in results['results']:
+        lines.append(f'{row["scenario"]:<10}{row["concurrency"]:>5}{row["p50_ms"] or 0:>10.1f}'
+                     f'{row["p95_ms"] or 0:>10.1f}{row["p99_ms"] or 0:>10.1f}{row["throughput"] or 0:>8.2f}'
+                     f'{row["upstream_calls"]:>7.1f}{row["db_queries"]:>9.1f}{row.get("upload_kb", 0):>9.1f}'
+                     f'{row["errors"]:>7}')
+
+    return '\n'.join(lines)
+
+def format_comparison(rows, threshold):
+    """Plain text table of a comparison, regressions flagged"""
+
+    lines = [f'{"scenario":<10}{"conc":>5}  {"metric":<16}{"before":>10}{"after":>10}{"change":>9}']
+
+    for scenario, concurrency, metric, old, new, change, regressed in rows:
+        flag = '  REGRESSION' if regressed else ''
+        lines.append(f'{scenario:<10}{concurrency:>5}  {metric:<16}{old:>10.1f}{new:>10.1f}{change:>+9.1%}{flag}')
+
+    regressions = sum(row[-1] for row in rows)
+    lines.append(f'\n{regressions} regression(s) beyond {threshold:.0%}')
+
+    return '\n'.join(lines)
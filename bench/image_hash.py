@@ -0,0 +1,128 @@
+"""
+Benchmark near-duplicate lookups (utils/image_hash.py) on a large set of image hashes
+
+Run (from the repo root) :
+    python -m bench.image_hash
+    python -m bench.image_hash --images 100000 --queries 1000 --distance 6
+
+No database or stand-ins needed : hashes are generated, so the numbers are the index's alone
+Hashes are random 64 bit values with small clusters of near duplicates (re-uploads), real
+dHashes are less uniform, so expect fuller buckets (more candidates checked) in production
+The NumPy scan (XOR + popcount over every hash) is the baseline the index has to beat
+
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import numpy as np
+from bench.harness import percentile
+from utils.image_hash import MultiIndexHash, DUPLICATE_MAX_DISTANCE
+
+# bits set in every byte value, a popcount for NumPy versions without bitwise_count
+BYTE_POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
+def flip_bits(image_hash, bits, rng):
+    for bit in rng.sample(range(64), bits):
+        image_hash ^= 1 << bit
+    return image_hash
+
+def generate_hashes(count, seed=0, duplicate_share=0.1, max_flips=4):
+    """count hashes, duplicate_share of them near copies (up to max_flips bits off) of earlier ones"""
+
+    rng = random.Random(seed)
+    hashes = []
+
+    for _ in range(count):
+        if hashes and rng.random() < duplicate_share:
+            hashes.append(flip_bits(rng.choice(hashes), rng.randint(0, max_flips), rng))
+        else:
+            hashes.append(rng.getrandbits(64))
+
+    return hashes
+
+def linear_scan(hashes, query, max_distance):
+    """Baseline : XOR the query with every hash at once + count the bits"""
+
+    distances = BYTE_POPCOUNT[(hashes ^ np.uint64(query)).view(np.uint8)].reshape(-1, 8).sum(axis=1)
+    return np.nonzero(distances <= max_distance)[0]
+
+def time_lookups(lookup, queries):
+    """(per query ms, matches found in total)"""
+
+    timings = []
+    found = 0
+
+    for query in queries:
+        start = time.perf_counter()
+        found += len(lookup(query))
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return timings, found
+
+def summarize(name, timings, found):
+    return {'lookup': name, 'queries': len(timings),
+            'p50_ms': percentile(timings, 50), 'p95_ms': percentile(timings, 95),
+            'p99_ms': percentile(timings, 99), 'matches': found}
+
+def run(images=100000, queries=500, distance=DUPLICATE_MAX_DISTANCE, seed=0):
+    """Index `images` hashes, then time near-duplicate + unrelated lookups"""
+
+    rng = random.Random(seed + 1)
+    hashes = generate_hashes(images, seed=seed)
+
+    start = time.perf_counter()
+    index = MultiIndexHash()
+    for item, image_hash in enumerate(hashes):
+        index.add(image_hash, item)
+    build_seconds = time.perf_counter() - start
+
+    # half re-uploads of stored images, half photos never seen before
+    near = [flip_bits(rng.choice(hashes), rng.randint(0, distance), rng) for _ in range(queries // 2)]
+    unseen = [rng.getrandbits(64) for _ in range(queries - len(near))]
+
+    array = np.array(hashes, dtype=np.uint64)
+    results = []
+
+    for kind, batch in (('near', near), ('unseen', unseen)):
+        timings, found = time_lookups(lambda query: index.search(query, distance), batch)
+        results.append(summarize(f'index {kind}', timings, found))
+
+        timings, found = time_lookups(lambda query: linear_scan(array, query, distance), batch)
+        results.append(summarize(f'numpy scan {kind}', timings, found))
+
+    return {'images': images, 'distance': distance, 'seed': seed,
+            'build_seconds': build_seconds, 'results': results}
+
+def format_results(results):
+    lines = [f'{results["images"]} hashes, max distance {results["distance"]}, '
+             f'index built in {results["build_seconds"]:.1f}s',
+             f'{"lookup":<20}{"queries":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"matches":>9}']
+
+    for row in results['results']:
+        lines.append(f'{row["lookup"]:<20}{row["queries"]:>8}{row["p50_ms"]:>10.3f}{row["p95_ms"]:>10.3f}'
+                     f'{row["p99_ms"]:>10.3f}{row["matches"]:>9}')
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark near-duplicate image hash lookups')
+    parser.add_argument('--images', type=int, default=100000, help='Hashes in the index')
+    parser.add_argument('--queries', type=int, default=500, help='Lookups timed (half near duplicates)')
+    parser.add_argument('--distance', type=int, default=DUPLICATE_MAX_DISTANCE, help='Max Hamming distance of a match')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    print(f'Indexing {args.images} hashes...', file=sys.stderr)
+    results = run(images=args.images, queries=args.queries, distance=args.distance, seed=args.seed)
+    print(format_results(results))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nResults written to {args.out}')
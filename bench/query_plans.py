@@ -0,0 +1,140 @@
+"""
+Check the query plans of every statement the routes send in their tests for sequential scans on large tables
+
+Run (from the repo root) :
+    python -m bench.query_plans
+    python -m bench.query_plans tests.test_post_views --tables posts,postsongs
+
+Each distinct statement is EXPLAINed right after it runs (same connection + transaction, so the
+test's data is there) with enable_seqscan off : the planner then uses an index whenever one can
+serve the query, so a Seq Scan left in the plan means no index can, whatever the table's size
+Exits non-zero when a statement scans one of the large tables
+
+"""
+
+import argparse
+import sys
+import unittest
+from flask import has_request_context
+from sqlalchemy import event
+
+# tables that grow with users + posts, a scan of any of them gets slower every day
+LARGE_TABLES = ('users', 'posts', 'follows', 'songs', 'postsongs', 'favorited_songs', 'timeline_entries',
+                'jobs', 'post_keywords', 'keyword_songs', 'preview_cache', 'image_analyses')
+
+# the tests of the routes (+ the feed + pagination they page through)
+ROUTE_TESTS = ('tests.test_post_views', 'tests.test_user_views', 'tests.test_feed', 'tests.test_pagination')
+
+EXPLAINED = ('SELECT', 'WITH', 'UPDATE', 'DELETE')
+
+
+def seq_scans(plan, tables=LARGE_TABLES):
+    """Tables of `tables` a JSON plan (node) reads with a Seq Scan, in plan order"""
+
+    found = []
+
+    if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name') in tables:
+        found.append(plan['Relation Name'])
+
+    for child in plan.get('Plans', []):
+        found += seq_scans(child, tables)
+
+    return found
+
+
+class PlanChecker:
+    """
+    EXPLAINs every distinct statement sent on an engine during a request while attached
+    flagged : [(statement, tables scanned, test that sent it first)]
+
+    """
+
+    def __init__(self, engine, tables=LARGE_TABLES):
+        self.engine = engine
+        self.tables = tables
+        self.test = None
+        self.plans = {}
+        self.flagged = []
+
+    def _explain(self, conn, cursor, statement, parameters, context, executemany):
+        # only what the app sends while handling a request, not the tests' own setup + checks
+        if not has_request_context() or executemany or statement in self.plans:
+            return
+
+        if not statement.lstrip().upper().startswith(EXPLAINED):
+            return
+
+        raw = cursor.connection
+        if raw.autocommit:
+            return
+
+        check = raw.cursor()
+        # a savepoint keeps a plan that can't be explained from failing the test's transaction
+        check.execute('SAVEPOINT explain_check')
+        try:
+            check.execute('SET LOCAL enable_seqscan = off')
+            check.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+            plan = check.fetchone()[0][0]['Plan']
+        except Exception:
+            check.execute('ROLLBACK TO SAVEPOINT explain_check')
+            return
+        finally:
+            check.execute('RESET enable_seqscan')
+
+        check.execute('RELEASE SAVEPOINT explain_check')
+
+        self.plans[statement] = plan
+        scanned = seq_scans(plan, self.tables)
+        if scanned:
+            self.flagged.append((statement, scanned, self.test))
+
+    def __enter__(self):
+        event.listen(self.engine, 'after_cursor_execute', self._explain)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'after_cursor_execute', self._explain)
+
+
+def run(names=ROUTE_TESTS, tables=LARGE_TABLES, stream=sys.stderr):
+    """Run the test modules `names` with a PlanChecker attached, returns (checker, unittest result)"""
+
+    suite = unittest.defaultTestLoader.loadTestsFromNames(names)
+
+    # the test modules point DATABASE_URL at the test database before the app is imported
+    from app import app
+    from models import db
+
+    checker = PlanChecker(db.get_engine(app), tables)
+
+    class Result(unittest.TextTestResult):
+        def startTest(self, test):
+            checker.test = test.id()
+            super().startTest(test)
+
+    with checker:
+        result = unittest.TextTestRunner(stream=stream, resultclass=Result).run(suite)
+
+    return checker, result
+
+def format_report(checker):
+    lines = [f'{len(checker.plans)} distinct statement(s) explained, {len(checker.flagged)} scan a large table']
+
+    for statement, scanned, test in checker.flagged:
+        lines.append(f'\nSeq Scan on {", ".join(sorted(set(scanned)))} (first from {test})')
+        lines.append('    ' + ' '.join(statement.split()))
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Flag sequential scans on large tables in the route tests')
+    parser.add_argument('tests', nargs='*', default=list(ROUTE_TESTS), help='Test modules (or cases) to run')
+    parser.add_argument('--tables', default=','.join(LARGE_TABLES), help='Comma separated tables to flag scans of')
+    args = parser.parse_args()
+
+    checker, result = run(args.tests, tuple(args.tables.split(',')))
+    print(format_report(checker))
+
+    if checker.flagged or not result.wasSuccessful():
+        sys.exit(1)
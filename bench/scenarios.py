@@ -0,0 +1,240 @@
+"""
+The benchmarked scenarios, all run against the local stand-ins (stubs/)
+    keywords : image_to_keywords for an uploaded image file
+    songs    : keywords_to_songs for an image's keywords
+    route    : POST /posts/new + the recommend_songs job it queues (upload -> post ready)
+
+Every (scenario, concurrency) level starts from an empty database + a cold search cache
+
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime
+from io import BytesIO
+from spotipy.cache_handler import MemoryCacheHandler
+import api_helpers
+from app import app, CURR_USER_KEY
+from models import db, User, Post, Job
+from api_helpers import (image_to_keywords, keywords_to_songs, spotify_client, spotify_breaker,
+                         PREVIEW_WORKERS, PREVIEW_TIMEOUT, SEARCH_CACHE_SIZE)
+from utils.everypixel import EverypixelClient
+from utils.jobs import run_job
+from utils.preview_resolver import PreviewResolverPool
+from utils.search_cache import SearchCache, CachedSpotify
+from stubs.common import StubBehavior
+from stubs.catalog import Catalog
+from stubs.everypixel import EverypixelStub
+from stubs.spotify import SpotifyStub
+from bench.harness import QueryCounter, run_level, summarize
+
+SCENARIOS = ('keywords', 'songs', 'route')
+
+SAMPLE_IMAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'test_image.jpg')
+
+
+class Upstreams:
+    """
+    The Everypixel, Spotify + preview finder stand-ins
+    While entered, the app's clients (api_helpers.everypixel, .sp, the preview pool) point at them
+
+    """
+
+    def __init__(self, seed=0, latency='fixed:0', error_rate=0.0, catalog_size=500):
+        self.catalog = Catalog(seed=seed, size=catalog_size)
+        self.everypixel = EverypixelStub(behavior=StubBehavior(latency, error_rate, seed), catalog=self.catalog)
+        self.spotify = SpotifyStub(behavior=StubBehavior(latency, error_rate, seed), catalog=self.catalog)
+        self.preview_cmd = [sys.executable, '-m', 'stubs.preview_worker', '--seed', str(seed),
+                            '--catalog-size', str(catalog_size), '--latency', latency, '--error-rate', str(error_rate)]
+
+        self.preview_calls = 0
+        self.lock = threading.Lock()
+        self.saved = {}
+
+    def __enter__(self):
+        self.everypixel.start()
+        self.spotify.start()
+
+        self.pool = PreviewResolverPool(self.preview_cmd, size=PREVIEW_WORKERS, timeout=PREVIEW_TIMEOUT)
+        submit = self.pool.submit
+
+        def counted_submit(query):
+            with self.lock:
+                self.preview_calls += 1
+            return submit(query)
+
+        self.pool.submit = counted_submit
+
+        self.saved = {name: getattr(api_helpers, name) for name in ('everypixel', 'sp', '_preview_pool')}
+        api_helpers.everypixel = EverypixelClient('bench', 'bench', base_url=self.everypixel.url)
+        api_helpers._preview_pool = self.pool
+        self.reset()
+
+        return self
+
+    def __exit__(self, *exc):
+        api_helpers.everypixel.close()
+        for name, value in self.saved.items():
+            setattr(api_helpers, name, value)
+
+        self.pool.close()
+        self.everypixel.stop()
+        self.spotify.stop()
+
+    def reset(self):
+        """Fresh spotify client + empty search cache"""
+
+        client = spotify_client(self.spotify.api_url, self.spotify.token_url, cache_handler=MemoryCacheHandler(),
+                                client_id=self.spotify.client_id, client_secret=self.spotify.client_secret)
+        api_helpers.sp = CachedSpotify(client, SearchCache(maxsize=SEARCH_CACHE_SIZE), breaker=spotify_breaker)
+
+    def calls(self):
+        """Calls made to each stand-in so far"""
+
+        return {
+            'everypixel': self.everypixel.stats['requests'],
+            'spotify_token': self.spotify.stats['tokens'],
+            'spotify_search': self.spotify.stats['searches'],
+            'preview': self.preview_calls,
+        }
+
+    def uploaded(self):
+        """Bytes sent to the Everypixel stand-in so far"""
+
+        return self.everypixel.stats['bytes_received']
+
+
+def image_bytes(n):
+    """The sample image with a marker after its end, so every upload has its own hash (+ keywords)"""
+
+    with open(SAMPLE_IMAGE, 'rb') as f:
+        return f.read() + f'imagime-bench:{n}'.encode()
+
+def reset_db():
+    """Empty tables + one user to upload as, returns the user's id"""
+
+    db.drop_all()
+    db.create_all()
+
+    user = User.signup(username='bench', email='bench@test.com', password='password', profile_img=None)
+    db.session.commit()
+
+    return user.id
+
+def run_post_job(post_id):
+    """Claim + run the job queued for one post (what `flask worker` does, for this post only)"""
+
+    job = Job.query.filter_by(post_id=post_id, status='queued').with_for_update().one()
+    job.status = 'running'
+    job.attempts += 1
+    db.session.commit()
+
+    run_job(job)
+
+def keywords_upload(upstreams, workdir, user_id):
+    def upload(n):
+        path = os.path.join(workdir, f'bench-{n}.jpg')
+        with open(path, 'wb') as f:
+            f.write(image_bytes(n))
+
+        with app.app_context():
+            if not image_to_keywords(local_image_file=path):
+                raise ValueError('No keywords')
+
+    return upload
+
+def songs_upload(upstreams, workdir, user_id):
+    def upload(n):
+        keywords = [k['keyword'] for k in upstreams.catalog.image_keywords(f'bench:{n}', 10)]
+
+        with app.app_context():
+            if not keywords_to_songs(keywords):
+                raise ValueError('No songs')
+
+    return upload
+
+def route_upload(upstreams, workdir, user_id):
+    def upload(n):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        resp = client.post('/posts/new', data={'image_file': (BytesIO(image_bytes(n)), f'bench-{n}.jpg'),
+                                               'description': f'Bench upload {n}'})
+
+        # a saved post redirects to /posts/<id>, anything else is a failure
+        post_id = resp.location.rstrip('/').rsplit('/', 1)[-1] if resp.status_code == 302 else ''
+        if not post_id.isdigit():
+            raise ValueError(f'Upload failed ({resp.status_code})')
+
+        with app.app_context():
+            run_post_job(int(post_id))
+
+            status = Post.query.get(int(post_id)).status
+            if status != 'ready':
+                raise ValueError(f'Post {post_id} ended up {status}')
+
+    return upload
+
+UPLOADS = {'keywords': keywords_upload, 'songs': songs_upload, 'route': route_upload}
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(SAMPLE_IMAGE)).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_benchmark(scenarios=SCENARIOS, levels=(1, 4, 16), uploads=32, seed=0, latency='fixed:0',
+                  error_rate=0.0, report=print):
+    """Run every scenario at every concurrency level, returns the results document"""
+
+    results = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'uploads': uploads,
+            'seed': seed,
+            'latency': latency,
+            'error_rate': error_rate,
+        },
+        'results': [],
+    }
+
+    workdir = tempfile.mkdtemp(prefix='imagime-bench-')
+    saved_config = {name: app.config.get(name) for name in ('UPLOAD_FOLDER', 'WTF_CSRF_ENABLED')}
+    app.config.update(UPLOAD_FOLDER=workdir, WTF_CSRF_ENABLED=False)
+
+    try:
+        with Upstreams(seed=seed, latency=latency, error_rate=error_rate) as upstreams:
+            for scenario in scenarios:
+                for concurrency in levels:
+                    with app.app_context():
+                        user_id = reset_db()
+                        engine = db.engine
+                    upstreams.reset()
+
+                    upload = UPLOADS[scenario](upstreams, workdir, user_id)
+                    before, uploaded = upstreams.calls(), upstreams.uploaded()
+
+                    with QueryCounter(engine) as queries:
+                        latencies, errors, wall = run_level(upload, uploads, concurrency)
+
+                    after = upstreams.calls()
+                    calls = {name: after[name] - before[name] for name in after}
+
+                    row = summarize(scenario, concurrency, latencies, errors, wall, calls, queries.count,
+                                    upstreams.uploaded() - uploaded)
+                    results['results'].append(row)
+                    report(f'{scenario:<10} x{concurrency:<3} p50 {row["p50_ms"]}ms  p95 {row["p95_ms"]}ms  '
+                           f'{row["throughput"]} uploads/s  {row["errors"]} errors')
+    finally:
+        app.config.update(saved_config)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
@@ -0,0 +1,198 @@
+"""
+Benchmark home feed reads : the timeline (fan-out on write) against the query time feed
+
+Run (from the repo root) :
+    python -m bench.timeline
+    python -m bench.timeline --users 2000 --following 500 --posts 20 --readers 50 --depth 10
+
+Fills its database (BENCH_DATABASE_URL, default postgresql:///imagime_bench_db, emptied first) with
+users who each follow the next `--following` users and `--posts` posts each, then times the first
+page + the page `--depth` pages down for `--readers` users, both ways, and on the write side the
+cost of a new post + of the background job that fans it out to the author's followers
+
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+if __name__ == '__main__':
+    # the app reads DATABASE_URL on import
+    os.environ['DATABASE_URL'] = os.getenv('BENCH_DATABASE_URL', 'postgresql:///imagime_bench_db')
+
+from sqlalchemy import text
+from app import app
+from models import db, User, TIMELINE_LENGTH
+from bench.harness import percentile
+from utils.feed import home_feed, live_feed, FEED_SIZE
+from utils.timeline import rebuild_timelines
+from utils.jobs import work
+from utils.user_counters import reconcile_counters
+
+
+def load_graph(users, following, posts, seed=0):
+    """
+    Empty the database, then bulk insert the users, follows + posts with the triggers off
+    (one statement each), recount the counters + build every timeline (`seed` seeds the post times)
+
+    """
+
+    db.drop_all()
+    db.create_all()
+
+    for table in ('posts', 'follows'):
+        db.session.execute(text(f'ALTER TABLE {table} DISABLE TRIGGER USER'))
+
+    db.session.execute(text('''
+        INSERT INTO users (id, username, email, password)
+        SELECT i, 'user' || i, 'user' || i || '@bench.com', 'password' FROM generate_series(1, :users) i
+    '''), {'users': users})
+    db.session.execute(text("SELECT setval('users_id_seq', :users)"), {'users': users})
+
+    # user i follows the next `following` users (wrapping round)
+    db.session.execute(text('''
+        INSERT INTO follows (follower_id, followed_id, timestamp)
+        SELECT i, (i + k - 1) % :users + 1, now() FROM generate_series(1, :users) i, generate_series(1, :following) k
+    '''), {'users': users, 'following': min(following, users - 1)})
+
+    # posts spread over a year, in random order
+    db.session.execute(text('SELECT setseed(:seed)'), {'seed': random.Random(seed).random()})
+    db.session.execute(text('''
+        INSERT INTO posts (user_id, image, description, timestamp)
+        SELECT i, '/static/bench.png', 'post', now() - random() * interval '365 days'
+        FROM generate_series(1, :users) i, generate_series(1, :posts) n
+    '''), {'users': users, 'posts': posts})
+
+    for table in ('posts', 'follows'):
+        db.session.execute(text(f'ALTER TABLE {table} ENABLE TRIGGER USER'))
+    db.session.commit()
+
+    # fresh planner stats first, or the rebuild plans for empty tables
+    analyze()
+    reconcile_counters()
+    rebuild_timelines()
+    analyze()
+
+def analyze():
+    db.session.execute(text('ANALYZE'))
+    db.session.commit()
+
+def time_page(feed, user, cursor):
+    """ms to read one page (statements included, the identity map cleared first)"""
+
+    db.session.expire_all()
+    start = time.perf_counter()
+    page = feed(user, cursor=cursor)
+    return (time.perf_counter() - start) * 1000, page
+
+def cursor_at(user, depth):
+    """Cursor of the page `depth` pages down the feed (None if it is shorter)"""
+
+    cursor = None
+    for _ in range(depth):
+        cursor = live_feed(user, cursor=cursor).next_cursor
+        if cursor is None:
+            return None
+    return cursor
+
+def summarize(name, timings):
+    return {'read': name, 'pages': len(timings), 'p50_ms': percentile(timings, 50),
+            'p95_ms': percentile(timings, 95), 'p99_ms': percentile(timings, 99)}
+
+def run(users=2000, following=500, posts=20, readers=50, depth=10, writes=20, seed=0):
+    """Load the graph, then time feed pages both ways + new posts"""
+
+    rng = random.Random(seed)
+
+    with app.app_context():
+        start = time.perf_counter()
+        load_graph(users, following, posts, seed=seed)
+        load_seconds = time.perf_counter() - start
+
+        sample = [User.query.get(user_id) for user_id in rng.sample(range(1, users + 1), min(readers, users))]
+        results = []
+        mismatches = 0
+
+        for name, page_depth in (('first page', 0), (f'page {depth + 1}', depth)):
+            timings = {'query time': [], 'timeline': []}
+
+            for user in sample:
+                cursor = cursor_at(user, page_depth) if page_depth else None
+                if page_depth and cursor is None:
+                    continue
+
+                pages = {}
+                for feed, key in ((live_feed, 'query time'), (home_feed, 'timeline')):
+                    ms, page = time_page(feed, user, cursor)
+                    timings[key].append(ms)
+                    pages[key] = [post.id for post in page.items]
+
+                # both ways have to show the same posts
+                if pages['query time'] != pages['timeline']:
+                    mismatches += 1
+
+            for key, values in timings.items():
+                results.append(summarize(f'{key} {name}', values))
+
+        # a new post (its author's timeline + a queued job), then the job fanning it out to the
+        # author's `following` followers
+        write_timings, fan_out_timings = [], []
+        for user_id in rng.sample(range(1, users + 1), min(writes, users)):
+            start = time.perf_counter()
+            db.session.execute(text("INSERT INTO posts (user_id, image) VALUES (:user_id, '/static/bench.png')"),
+                               {'user_id': user_id})
+            db.session.commit()
+            write_timings.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            work(burst=True)
+            fan_out_timings.append((time.perf_counter() - start) * 1000)
+
+        entries = db.session.execute(text('SELECT count(*) FROM timeline_entries')).scalar()
+
+    return {'users': users, 'following': following, 'posts': posts, 'feed_size': FEED_SIZE,
+            'timeline_length': TIMELINE_LENGTH, 'entries': entries, 'load_seconds': load_seconds,
+            'results': results, 'write': summarize('new post', write_timings),
+            'fan_out': summarize('fan-out job', fan_out_timings), 'mismatches': mismatches}
+
+def format_results(results):
+    lines = [f'{results["users"]} users following {results["following"]} each, {results["posts"]} posts each, '
+             f'{results["entries"]} timeline entries (max {results["timeline_length"]} per user), '
+             f'loaded in {results["load_seconds"]:.1f}s',
+             f'{"read":<28}{"pages":>7}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}']
+
+    for row in results['results'] + [results['write'], results['fan_out']]:
+        if row['pages']:
+            lines.append(f'{row["read"]:<28}{row["pages"]:>7}{row["p50_ms"]:>10.2f}{row["p95_ms"]:>10.2f}'
+                         f'{row["p99_ms"]:>10.2f}')
+
+    if results['mismatches']:
+        lines.append(f'{results["mismatches"]} page(s) differed between the timeline + query time feeds')
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark home feed reads, timeline vs query time')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--following', type=int, default=500, help='Users each user follows')
+    parser.add_argument('--posts', type=int, default=20, help='Posts per user')
+    parser.add_argument('--readers', type=int, default=50, help='Users whose feeds are timed')
+    parser.add_argument('--depth', type=int, default=10, help='Also time the page this many pages down')
+    parser.add_argument('--writes', type=int, default=20, help='New posts timed')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    print(f'Loading {args.users} users...', file=sys.stderr)
+    results = run(users=args.users, following=args.following, posts=args.posts, readers=args.readers,
+                  depth=args.depth, writes=args.writes, seed=args.seed)
+    print(format_results(results))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nResults written to {args.out}')
@@ -1,17 +1,37 @@
 import os
-from flask import Blueprint, render_template, redirect, request, flash, session, g, url_for, jsonify, current_app
-from models import db, User, Post, Song, FavoritedSong, PostSong
+import json
+import time
+from flask import (Blueprint, render_template, redirect, request, flash, session, g, url_for, jsonify,
+                   current_app, Response, stream_with_context)
+from models import db, User, Post, Song, FavoritedSong, PostSong, Job
 from forms import AddImageForm
 from utils.helpers import do_login, do_logout, do_authorize
-from api_helpers import image_to_keywords, keywords_to_songs
+from utils.recommendations import queue_recommendations, reuse_recommendations, resolve_song_preview
+from utils.keyword_index import unindex_post
+from utils.image_hash import hash_post_image, find_similar_post, to_signed
+from utils.feed import home_feed
+from utils.pagination import paginate, next_page_url
 from werkzeug.utils import secure_filename
 from datetime import datetime
 
 
 CURR_USER_KEY = 'curr_user'
+# an upload waiting on the user's answer to "reuse the songs of this similar post?"
+SIMILAR_UPLOAD_KEY = 'similar_upload'
 
 posts_bp = Blueprint('posts', __name__)
 
+# posts per page of a user's posts + songs per page of a post
+POSTS_PER_PAGE = 15
+SONGS_PER_PAGE = 5
+
+# how often the song stream checks for new songs + how long one stream stays open (seconds)
+# an open stream holds a (sync) gunicorn worker, so streams are short + the browser reconnects
+SSE_POLL_INTERVAL = float(os.getenv('SSE_POLL_INTERVAL', 0.5))
+SSE_MAX_DURATION = float(os.getenv('SSE_MAX_DURATION', 10))
+# how long the browser waits before reconnecting once a stream ends (ms)
+SSE_RETRY_MS = int(os.getenv('SSE_RETRY_MS', 2000))
+
 @posts_bp.route('/')
 def home():
     """
@@ -20,25 +40,75 @@ def home():
     """
 
     if g.user:
-        # get list of user Id's that curr user is following + current users own posts
-        following_ids = [user.id for user in g.user.following]
-        following_ids.append(g.user.id)
-
-        # retrieve 15 most recent posts from followed users and current
-        posts = (Post
-                 .query
-                 .filter(Post.user_id.in_(following_ids))
-                 .order_by(Post.timestamp.desc())
-                 .limit(15)
-                 .all())
-
-        return render_template('home.html', posts=posts)
+        # a page of the most recent posts from followed users and current, with their authors (one query)
+        page = home_feed(g.user, cursor=request.args.get('cursor'))
+
+        if request.args.get('json'):
+            return posts_page_json(page)
+
+        return render_template('home.html', posts=page.items, next_url=next_page_url(page))
     else:
         return render_template('home-anon.html')
 
+def post_json(post):
+    """Post fields of a page of posts in JSON"""
+
+    return {
+        'id': post.id,
+        'user_id': post.user_id,
+        'username': post.user.username,
+        'image': post.image,
+        'description': post.description,
+        'timestamp': post.timestamp.isoformat(),
+    }
+
+def posts_page_json(page):
+    """
+    A page of posts as JSON : the posts, the cursor + URL of the next page,
+    and the rendered list items infinite scroll appends (static/js/app.js)
+
+    """
+
+    return jsonify({
+        'posts': [post_json(post) for post in page.items],
+        'next_cursor': page.next_cursor,
+        'next_url': next_page_url(page, json=1),
+        'html': render_template('partials/_post_items.html', posts=page.items),
+    })
+
+def create_post(upload, similar_post=None):
+    """
+    Save a new post from an upload
+    Pending with a queued recommendations job, or ready right away with similar_post's songs
+
+    """
+
+    new_post = Post(
+        user_id=g.user.id,
+        image=upload['image'],
+        description=upload['description'],
+        image_hash=to_signed(upload['image_hash']) if upload['image_hash'] is not None else None,
+        status='pending'
+    )
+    db.session.add(new_post)
+    db.session.flush()  # make sure new_post.id exists
+
+    if similar_post:
+        reuse_recommendations(new_post, similar_post)
+    else:
+        # keywords + songs are found in the background (flask worker)
+        queue_recommendations(new_post, image_url=upload['image_url'], image_file=upload['image_file'])
+
+    return new_post
+
 @posts_bp.route('/posts/new', methods=['GET', 'POST'])
 def add_post():
-    """Adding a new poste"""
+    """
+    Adding a new post
+    The post is saved right away as pending, songs are found by a background job
+    A re-upload of a photo that already has songs is offered those songs first
+
+    """
 
     if g.user is None:
         flash('You must be logged in to create a post', 'danger')
@@ -46,64 +116,36 @@ def add_post():
 
     form = AddImageForm()
 
-    keywords = None
-    songs = None
-    image_path = None
-
     if form.validate_on_submit():
         image_url = form.image_url.data
         image_file = form.image_file.data
         description = form.description.data
 
         try:
+            image_save_path = None
+            image_hash = None
+
             if image_url:
-                keywords = image_to_keywords(image_url=image_url)
                 image_path = image_url
 
             elif image_file:
-                # save the uploaded image file
+                # save the uploaded image file, the worker analyzes it from disk
                 filename = secure_filename(image_file.filename)
                 image_save_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
                 image_file.save(image_save_path)
-
-                # open the saved image file and pass it to 'image_to_keywords'
-                keywords = image_to_keywords(local_image_file=image_save_path)
                 image_path = url_for('static', filename=f'images/uploads/{filename}')
+                image_hash = hash_post_image(image_save_path)
 
-            if keywords:
-                songs = keywords_to_songs(keywords)
-            else:
-                flash('No keywords found', 'warning')
-                songs = []
-
-            # proceed to add new image post to DB
-            new_post = Post(
-                user_id=g.user.id,
-                image=image_path,
-                description=description
-            )
-            db.session.add(new_post)
-            db.session.flush()  # make sure new_post.id exists
-
-            for song in songs:
-                # Always add or get the song by preview_url
-                song_obj = Song.query.filter_by(preview_url=song['preview_url']).first()
-
-                if not song_obj:
-                    song_obj = Song(
-                        title=song['title'],
-                        artist=song['artist'],
-                        spotify_url=song.get('spotify_url'),
-                        image_url=song.get('image_url'),
-                        preview_url=song.get('preview_url')
-                    )
-                    db.session.add(song_obj)
-                    db.session.flush()  # assign song_obj.id
-
-                # Now link the post and song
-                post_song = PostSong(post_id=new_post.id, song_id=song_obj.id)
-                db.session.add(post_song)
+            upload = {'image': image_path, 'description': description, 'image_url': image_url or None,
+                      'image_file': image_save_path, 'image_hash': image_hash}
 
+            if image_hash is not None:
+                similar, _ = find_similar_post(image_hash)
+                if similar:
+                    session[SIMILAR_UPLOAD_KEY] = dict(upload, similar_post_id=similar.id)
+                    return redirect(url_for('posts.similar_post'))
+
+            new_post = create_post(upload)
             db.session.commit()
             flash('Post successfully added!', 'success')
             return redirect(url_for('posts.show_post', post_id=new_post.id))
@@ -113,11 +155,56 @@ def add_post():
             db.session.rollback()
             return redirect(url_for('posts.home'))
 
-    return render_template('posts/new.html', form=form, keywords=keywords, songs=songs)
+    return render_template('posts/new.html', form=form)
+
+@posts_bp.route('/posts/new/similar', methods=['GET', 'POST'])
+def similar_post():
+    """
+    Offer the songs of an earlier post of the same photo instead of analyzing the upload again
+    'reuse' copies its keywords + songs, anything else queues the upload like a new photo
+
+    """
+
+    if g.user is None:
+        flash('You must be logged in to create a post', 'danger')
+        return redirect(url_for('users.login'))
+
+    upload = session.get(SIMILAR_UPLOAD_KEY)
+
+    if upload is None:
+        return redirect(url_for('posts.add_post'))
+
+    similar = Post.query.filter_by(id=upload['similar_post_id'], status='ready').first()
+
+    # answered, or the similar post was deleted in the meantime
+    if request.method == 'POST' or similar is None:
+        session.pop(SIMILAR_UPLOAD_KEY)
+        reuse = similar is not None and request.form.get('choice') == 'reuse'
+
+        try:
+            new_post = create_post(upload, similar if reuse else None)
+            db.session.commit()
+            flash('Post successfully added!', 'success')
+            return redirect(url_for('posts.show_post', post_id=new_post.id))
+
+        except Exception as e:
+            flash(f'An error occured: {e}', 'error')
+            db.session.rollback()
+            return redirect(url_for('posts.home'))
+
+    songs = (Song
+             .query
+             .join(PostSong)
+             .filter(PostSong.post_id == similar.id)
+             .order_by(PostSong.id)
+             .limit(5)
+             .all())
+
+    return render_template('posts/similar.html', upload=upload, similar=similar, songs=songs)
 
 @posts_bp.route('/users/<int:user_id>/posts', methods=['GET'])
 def user_posts(user_id):
-    """Display all posts made my a specific user"""
+    """Display the posts made by a specific user, newest first, a page at a time"""
 
     if g.user is None:
         flash('Please log in to view this page', 'danger')
@@ -125,13 +212,45 @@ def user_posts(user_id):
 
     user = User.query.get_or_404(user_id)
 
-    posts = (Post
-             .query
-             .filter(Post.user_id == user_id)
-             .order_by(Post.timestamp.desc())
-             .all())
+    page = paginate(Post.query.filter(Post.user_id == user_id), (Post.timestamp, Post.id),
+                    cursor=request.args.get('cursor'), per_page=POSTS_PER_PAGE)
+
+    if request.args.get('json'):
+        return posts_page_json(page)
+
+    return render_template('users/posts.html', user=user, posts=page.items, next_url=next_page_url(page))
+
+def job_progress(post):
+    """Stage + percentage of the background job still working on a pending post"""
+
+    if not post.is_pending:
+        return None
+
+    job = Job.query.filter_by(post_id=post.id).order_by(Job.id.desc()).first()
+
+    if job is None:
+        return None
+
+    return {'stage': job.stage or 'Queued', 'percent': job.progress}
 
-    return render_template('users/posts.html', user=user, posts=posts)
+def song_json(song, favorited_song_ids):
+    """Song fields the front end needs to render a song list item"""
+
+    return {
+        'title': song.title,
+        'artist': song.artist,
+        'preview_url': song.preview_url,
+        'image_url': song.image_url,
+        'id': song.id,
+        'spotify_url': song.spotify_url,
+        'is_favorited': song.id in favorited_song_ids,
+    }
+
+def sse_event(event, data, event_id=None):
+    """Format one Server-Sent Event"""
+
+    message = f'id: {event_id}\n' if event_id is not None else ''
+    return message + f'event: {event}\ndata: {json.dumps(data)}\n\n'
 
 @posts_bp.route('/posts/<int:post_id>', methods=['GET'])
 def show_post(post_id):
@@ -140,17 +259,12 @@ def show_post(post_id):
     post = Post.query.get_or_404(post_id)
     user = User.query.get_or_404(post.user_id)
 
-    # get offset from request or default to 0
-    offset = request.args.get('offset', 0, type=int)
-    limit = 5 # num songs to load per batch
-
-    songs = (Song
-             .query
-             .join(PostSong)
-             .filter(PostSong.post_id == post_id)
-             .offset(offset)
-             .limit(limit)
-             .all())
+    # songs in the order they were found, a page at a time after the cursor's link id (no OFFSET)
+    page = paginate(db.session.query(PostSong.id, Song).join(Song, Song.id == PostSong.song_id)
+                    .filter(PostSong.post_id == post_id),
+                    (PostSong.id,), cursor=request.args.get('cursor'), per_page=SONGS_PER_PAGE,
+                    descending=False, key=lambda row: [row[0]])
+    songs = [song for link_id, song in page.items]
 
     # check if the user is logged in and gather favorited songs
     favorited_song_ids = []
@@ -160,19 +274,18 @@ def show_post(post_id):
     # return JSON if `json` query parameter is present
     if request.args.get('json'):
         return jsonify({
-            'songs': [
-                {
-                    'title': song.title,
-                    'artist': song.artist,
-                    'preview_url': song.preview_url,
-                    'image_url': song.image_url,
-                    'id': song.id,
-                    'spotify_url': song.spotify_url,
-                    'is_favorited': song.id in favorited_song_ids,
-                } for song in songs
-            ]
+            'status': post.status,
+            'progress': job_progress(post),
+            'songs': [song_json(song, favorited_song_ids) for song in songs],
+            'next_cursor': page.next_cursor,
+            'next_url': next_page_url(page, json=1),
         })
 
+    # songs of a pending post are pushed by /posts/<id>/stream instead
+    next_url = next_page_url(page)
+    if post.is_pending:
+        songs = []
+        next_url = None
 
     # return the full template for the initial load
     return render_template(
@@ -181,10 +294,92 @@ def show_post(post_id):
         user=user,
         songs=songs,
         favorited_song_ids=favorited_song_ids,
-        offset=offset + limit,
+        next_url=next_url,
+        progress=job_progress(post),
 
     )
 
+@posts_bp.route('/posts/<int:post_id>/stream', methods=['GET'])
+def stream_post_songs(post_id):
+    """
+    Server-Sent Events stream of a post's songs
+    Pushes each song as soon as the background job saves it, then a final 'done' event
+
+    """
+
+    Post.query.get_or_404(post_id)
+
+    favorited_song_ids = []
+    if g.user:
+        favorited_song_ids = [fav.song_id for fav in g.user.favorited_songs]
+
+    # a reconnecting browser resumes after the last song it received
+    last_link_id = request.headers.get('Last-Event-ID', 0, type=int)
+
+    def events():
+        nonlocal last_link_id
+        last_stage = None
+        stop_at = time.monotonic() + SSE_MAX_DURATION
+
+        yield f'retry: {SSE_RETRY_MS}\n\n'
+
+        while True:
+            links = (db.session
+                     .query(PostSong.id, Song)
+                     .join(Song, Song.id == PostSong.song_id)
+                     .filter(PostSong.post_id == post_id, PostSong.id > last_link_id)
+                     .order_by(PostSong.id)
+                     .all())
+
+            for link_id, song in links:
+                last_link_id = link_id
+                yield sse_event('song', song_json(song, favorited_song_ids), event_id=link_id)
+
+            status = db.session.query(Post.status).filter(Post.id == post_id).scalar()
+
+            if status != 'pending':
+                yield sse_event('done', {'status': status or 'deleted'})
+                return
+
+            stage = (db.session
+                     .query(Job.stage)
+                     .filter(Job.post_id == post_id)
+                     .order_by(Job.id.desc())
+                     .limit(1)
+                     .scalar())
+
+            if stage and stage != last_stage:
+                last_stage = stage
+                yield sse_event('progress', {'stage': stage})
+
+            # end the read transaction so each poll sees the worker's latest commits
+            # (+ hand the connection back to the pool while sleeping)
+            db.session.rollback()
+
+            if time.monotonic() > stop_at:
+                return # the browser reconnects with Last-Event-ID after SSE_RETRY_MS
+
+            time.sleep(SSE_POLL_INTERVAL)
+
+    return Response(stream_with_context(events()),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@posts_bp.route('/songs/<int:song_id>/preview', methods=['GET'])
+def song_preview(song_id):
+    """
+    Preview URL of a song, resolved on first play (songs are saved without one)
+    The player calls this when its data-audio is empty
+
+    """
+
+    song, preview_url = resolve_song_preview(song_id)
+
+    if song is None:
+        return jsonify({'error': 'Song not found'}), 404
+
+    return jsonify({'id': song.id, 'preview_url': preview_url})
+
 @posts_bp.route('/posts/<int:post_id>/songs/<int:song_id>/favorite', methods=['POST'])
 def add_favorite(post_id, song_id):
     """Add song(s) to user's favorites"""
@@ -246,6 +441,9 @@ def delete_post(post_id):
         flash('Access unauthorized', 'danger')
         return redirect(url_for('posts.home'))
 
+    # take the post's keyword -> song links out of the index while they still exist
+    unindex_post(post_id)
+
     # set post_id to null for other users who have saved songs from this post
     FavoritedSong.query.filter_by(post_id=post_id).update({'post_id': None})
 
@@ -1,15 +1,22 @@
 import os
-from flask import Blueprint, render_template, redirect, request, flash, session, g, url_for, current_app
+from flask import Blueprint, render_template, redirect, request, flash, session, g, url_for, current_app, jsonify
+from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import IntegrityError
 from werkzeug.utils import secure_filename
 from models import db, User, Post, FavoritedSong
 from forms import SignUpForm, LoginForm, EditProfileForm
 from utils.helpers import do_login, do_logout, do_authorize
+from utils.keyword_index import unindex_post
+from utils.pagination import paginate, next_page_url
 
 CURR_USER_KEY = 'curr_user'
 
 users_bp = Blueprint('users', __name__)
 
+# users per page of the directory + favorites per page of a user's favorites
+USERS_PER_PAGE = 24
+FAVORITES_PER_PAGE = 20
+
 @users_bp.route('/signup', methods=['GET', 'POST'])
 def signup():
     """Show signup form + handle form submission"""
@@ -90,16 +97,31 @@ def logout():
 
 @users_bp.route('/users')
 def list_users():
-    """Page displaying a list of all users"""
+    """Page displaying a list of all users, oldest accounts first, a page at a time"""
 
     search = request.args.get('q','')
 
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.ilike(f'%{search}%')).all()
+    query = User.query
+    if search:
+        query = query.filter(User.username.ilike(f'%{search}%'))
+
+    page = paginate(query, (User.id,), cursor=request.args.get('cursor'), per_page=USERS_PER_PAGE, descending=False)
+    # the search carries over to the next pages
+    params = {'q': search} if search else {}
+    # follow buttons for the whole page in one query
+    followed_ids = g.user.following_among(page.items) if g.user else set()
+
+    if request.args.get('json'):
+        return jsonify({
+            'users': [{'id': user.id, 'username': user.username, 'profile_img': user.profile_img, 'bio': user.bio,
+                       'post_count': user.post_count, 'favorite_count': user.favorite_count} for user in page.items],
+            'next_cursor': page.next_cursor,
+            'next_url': next_page_url(page, json=1, **params),
+            'html': render_template('partials/_user_cards.html', users=page.items, followed_ids=followed_ids),
+        })
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html', users=page.items, followed_ids=followed_ids,
+                           next_url=next_page_url(page, **params))
 
 @users_bp.route('/users/<int:user_id>', methods=['GET'])
 def user_profile(user_id):
@@ -177,6 +199,10 @@ def delete_user(user_id):
 
         do_logout()
 
+        # the user's posts go with them, so take them out of the keyword index
+        for post in g.user.posts:
+            unindex_post(post.id)
+
         db.session.delete(g.user)
         db.session.commit()
 
@@ -197,13 +223,22 @@ def show_favorited_songs(user_id):
     if not user.favorites_public and g.user.id != user.id:
         return redirect(url_for('posts.home'))
 
-    favorited_songs = (FavoritedSong
-                       .query
-                       .filter(FavoritedSong.user_id == user.id)
-                       .order_by(FavoritedSong.timestamp.desc())
-                       .all())
-
-    return render_template('users/favorited.html', user=user, favorited_songs=favorited_songs)
+    # newest first, with their songs (one query per page)
+    page = paginate(FavoritedSong.query.options(joinedload(FavoritedSong.song)).filter(FavoritedSong.user_id == user.id),
+                    (FavoritedSong.timestamp, FavoritedSong.id),
+                    cursor=request.args.get('cursor'), per_page=FAVORITES_PER_PAGE)
+
+    if request.args.get('json'):
+        return jsonify({
+            'favorites': [{'song_id': fave.song_id, 'post_id': fave.post_id, 'title': fave.song.title,
+                           'artist': fave.song.artist, 'timestamp': fave.timestamp.isoformat()} for fave in page.items],
+            'next_cursor': page.next_cursor,
+            'next_url': next_page_url(page, json=1),
+            'html': render_template('partials/_favorite_items.html', favorited_songs=page.items),
+        })
+
+    return render_template('users/favorited.html', user=user, favorited_songs=page.items,
+                           next_url=next_page_url(page))
 
 @users_bp.route('/toggle_favorites_public', methods=['POST'])
 def toggle_favorites_public():
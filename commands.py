@@ -0,0 +1,200 @@
+import os
+import click
+from flask import current_app
+from sqlalchemy import func
+from flask.cli import AppGroup, with_appcontext
+from utils.jobs import work
+from utils.resilience import breaker_states
+from utils.image_prep import prep_stats
+from utils.preview_cache import seed_preview_cache, purge_expired_previews, preview_cache_stats
+from utils.bulk_import import load_sources, import_images
+from utils.keyword_index import rebuild_index
+from utils.image_hash import backfill_hashes
+from utils.user_counters import install_counter_triggers, drifted_counters, reconcile_counters
+from utils.timeline import install_timeline_triggers, sync_timeline_settings, rebuild_timelines, timeline_stats
+from utils.migrations import pending_migrations, apply_migrations
+from models import db, CachedPreview, User, KeywordSong, PostKeyword
+import utils.recommendations  # registers the recommendation job handler
+
+preview_cache_cli = AppGroup('preview-cache', help='Manage the preview URL cache')
+
+@preview_cache_cli.command('seed')
+def seed_preview_cache_command():
+    """Seed the preview cache from songs.preview_url"""
+
+    added = seed_preview_cache()
+    click.echo(f'Seeded {added} preview(s) from saved songs')
+
+@preview_cache_cli.command('purge')
+def purge_preview_cache_command():
+    """Delete expired preview cache entries"""
+
+    deleted = purge_expired_previews()
+    click.echo(f'Purged {deleted} expired preview(s)')
+
+@preview_cache_cli.command('stats')
+def preview_cache_stats_command():
+    """Show preview cache size + this process's hit / miss counters"""
+
+    total = CachedPreview.query.count()
+    negative = CachedPreview.query.filter(CachedPreview.preview_url.is_(None)).count()
+
+    click.echo(f'entries: {total} ({negative} negative)')
+    for name, value in preview_cache_stats().items():
+        click.echo(f'{name}: {value}')
+
+keyword_index_cli = AppGroup('keyword-index', help='Manage the keyword -> song index')
+
+@keyword_index_cli.command('rebuild')
+def rebuild_keyword_index_command():
+    """Recount the keyword -> song index from saved posts"""
+
+    entries = rebuild_index()
+    click.echo(f'Rebuilt keyword index with {entries} entries')
+
+@keyword_index_cli.command('stats')
+def keyword_index_stats_command():
+    """Show how many keywords + keyword -> song links are indexed"""
+
+    keywords = db.session.query(func.count(PostKeyword.keyword.distinct())).scalar()
+    click.echo(f'keywords: {keywords}')
+    click.echo(f'keyword -> song links: {KeywordSong.query.count()}')
+
+image_hash_cli = AppGroup('image-hash', help='Manage the perceptual hashes of post images')
+
+@image_hash_cli.command('backfill')
+def backfill_image_hashes_command():
+    """Hash uploaded images of posts that don't have a hash yet"""
+
+    hashed, skipped = backfill_hashes(current_app.config['UPLOAD_FOLDER'])
+    click.echo(f'Hashed {hashed} post image(s), skipped {skipped} (URLs or missing files)')
+
+timeline_cli = AppGroup('timeline', help="Manage users' home timelines (fan-out on write)")
+
+@timeline_cli.command('rebuild')
+def rebuild_timelines_command():
+    """Reinstall the fan-out triggers + refill every timeline from posts and follows"""
+
+    install_timeline_triggers()
+    sync_timeline_settings()
+    rebuilt = rebuild_timelines()
+    click.echo(f'Rebuilt {rebuilt} timeline(s)')
+
+@timeline_cli.command('sync')
+def sync_timeline_settings_command():
+    """Apply TIMELINE_LENGTH + FANOUT_MAX_FOLLOWERS to the triggers + the feed"""
+
+    for name, (saved, value) in sync_timeline_settings().items():
+        click.echo(f'{name}: {saved} -> {value}')
+    click.echo('Timeline settings in step')
+
+@timeline_cli.command('stats')
+def timeline_stats_command():
+    """Show how many timeline entries are stored"""
+
+    for name, value in timeline_stats().items():
+        click.echo(f'{name}: {value}')
+
+@click.command('reconcile-counters')
+@click.option('--dry-run', is_flag=True, help='Only report users whose counters drifted')
+@with_appcontext
+def reconcile_counters_command(dry_run):
+    """Recount users' post, favorite + follow counters (and reinstall the triggers keeping them)"""
+
+    if dry_run:
+        drift = drifted_counters()
+    else:
+        install_counter_triggers()
+        drift = reconcile_counters()
+
+    for user_id, counters in sorted(drift.items()):
+        changes = ', '.join(f'{counter} {stored} -> {actual}' for counter, (stored, actual) in counters.items())
+        click.echo(f'user {user_id}: {changes}')
+
+    verb = 'need' if dry_run else 'were'
+    click.echo(f'{len(drift)} user(s) {verb} recounting')
+
+@click.command('migrate')
+@click.option('--dry-run', is_flag=True, help='Only list the migrations not applied yet')
+@with_appcontext
+def migrate_command(dry_run):
+    """Apply the SQL migrations in migrations/ this database hasn't had yet"""
+
+    if dry_run:
+        pending = pending_migrations()
+        for name in pending:
+            click.echo(f'pending: {name}')
+        click.echo(f'{len(pending)} migration(s) pending')
+        return
+
+    applied = apply_migrations(report=click.echo)
+    click.echo(f'Applied {len(applied)} migration(s)')
+
+@click.command('worker')
+@click.option('--burst', is_flag=True, help='Exit once the job queue is empty')
+@click.option('--interval', default=1.0, help='Seconds to wait between polls when the queue is empty')
+@with_appcontext
+def worker_command(burst, interval):
+    """Process background jobs (song recommendations for new posts, timeline fan-outs)"""
+
+    # the env this worker runs with decides the timeline settings, for the web processes too
+    sync_timeline_settings()
+
+    try:
+        processed = work(burst=burst, interval=interval)
+        click.echo(f'Processed {processed} job(s)')
+    finally:
+        # upstream health as this worker saw it
+        for name, state in breaker_states().items():
+            click.echo(f"circuit {name}: {state['state']} (trips: {state['trips']}, "
+                       f"rejected: {state['rejected']}, failures in a row: {state['failures']})")
+
+        prep = prep_stats()
+        if prep['images']:
+            click.echo(f"image prep: {prep['images']} image(s), {prep['bytes_saved'] / 1e6:.1f}MB saved, "
+                       f"{prep['seconds']:.1f}s spent")
+
+@click.command('import-images')
+@click.argument('username')
+@click.option('--dir', 'directory', type=click.Path(exists=True, file_okay=False), help='Directory of image files')
+@click.option('--manifest', type=click.Path(exists=True, dir_okay=False), help='File with one image URL (+ optional description) per line')
+@click.option('--processes', default=4, help='Pool processes analyzing images (0 = no pool)')
+@click.option('--rate', default=2.0, help='Max images sent to the APIs per second, across all processes')
+@click.option('--batch-size', default=20, help='Posts written per transaction')
+@click.option('--state-file', type=click.Path(dir_okay=False), help='Where finished images are recorded for resuming')
+@with_appcontext
+def import_images_command(username, directory, manifest, processes, rate, batch_size, state_file):
+    """Bulk import images as posts for USERNAME (resumable)"""
+
+    if not directory and not manifest:
+        raise click.UsageError('Pass --dir and/or --manifest')
+
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.BadParameter(f'No user named {username}', param_hint='USERNAME')
+
+    if state_file is None:
+        state_file = os.path.join(directory, '.imagime-import.jsonl') if directory else manifest + '.state'
+
+    sources = load_sources(directory=directory, manifest=manifest)
+    click.echo(f'Importing {len(sources)} image(s) for {username} (state: {state_file})')
+
+    stats = import_images(user.id, sources, current_app.config['UPLOAD_FOLDER'], state_file=state_file,
+                          processes=processes, rate=rate, batch_size=batch_size, report=click.echo)
+
+    click.echo(f"Imported {stats['imported']} post(s) with {stats['songs']} song(s), "
+               f"{stats['failed']} failed, {stats['skipped']} skipped")
+    click.echo(f"{stats['seconds']:.1f}s · {stats['throughput']:.2f} images/s")
+
+
+def register_commands(app):
+    """Attach the `flask ...` CLI commands to the app"""
+
+    app.cli.add_command(preview_cache_cli)
+    app.cli.add_command(keyword_index_cli)
+    app.cli.add_command(image_hash_cli)
+    app.cli.add_command(timeline_cli)
+    app.cli.add_command(worker_command)
+    app.cli.add_command(reconcile_counters_command)
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(import_images_command)
@@ -1,31 +1,78 @@
 require('dotenv').config();
 
+const readline = require('readline');
 const spotifyPreviewFinder = require('spotify-preview-finder');
 
-const query = process.argv[2];
+// max queries a single server-mode worker resolves at the same time
+const MAX_IN_FLIGHT = parseInt(process.env.PREVIEW_WORKER_CONCURRENCY || '4');
 
-// run search + print out the results as JSON for python to read
-async function run() {
+// search spotify using provided query + build the JSON response python reads
+async function findPreview(query) {
     try {
-        // search spotify using provided query
         const result = await spotifyPreviewFinder(query, 1);
 
         // if songs are found with preview_url, send back first result
         if (result.success && result.results.length > 0) {
             const song = result.results[0];
-            const response = {
+            return {
                 name: song.name,
                 spotifyUrl: song.spotifyUrl,
                 previewUrls: song.previewUrls
             }
-            console.log(JSON.stringify(response));  // what python will parse
-        } else {
-            console.log(JSON.stringify({ previewUrls: [] }))
         }
+        return { previewUrls: [] };
     } catch (err) {
         // if error
-        console.log(JSON.stringify({ error: err.message }));
+        return { error: err.message };
     }
 }
 
-run()
\ No newline at end of file
+// one-shot mode : node get_preview.js 'song name'
+async function run(query) {
+    const response = await findPreview(query);
+    console.log(JSON.stringify(response));  // what python will parse
+}
+
+// server mode : node get_preview.js --server
+// reads one JSON request per line on stdin ({"id": 1, "query": "song name"})
+// and writes one JSON answer per line on stdout ({"id": 1, "previewUrls": [...]})
+function serve() {
+    const queue = [];
+    let inFlight = 0;
+
+    function next() {
+        while (inFlight < MAX_IN_FLIGHT && queue.length > 0) {
+            const request = queue.shift();
+            inFlight++;
+
+            findPreview(request.query).then(response => {
+                process.stdout.write(JSON.stringify({ id: request.id, ...response }) + '\n');
+                inFlight--;
+                next();
+            });
+        }
+    }
+
+    const lines = readline.createInterface({ input: process.stdin });
+
+    lines.on('line', line => {
+        if (!line.trim()) return;
+
+        try {
+            queue.push(JSON.parse(line));
+        } catch (err) {
+            process.stdout.write(JSON.stringify({ id: null, error: 'Invalid request' }) + '\n');
+            return;
+        }
+        next();
+    });
+
+    // python closed our stdin, nothing more to do
+    lines.on('close', () => process.exit(0));
+}
+
+if (process.argv[2] === '--server') {
+    serve();
+} else {
+    run(process.argv[2]);
+}
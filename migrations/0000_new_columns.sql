@@ -0,0 +1,31 @@
+-- Columns added to the first release's tables (users, posts) : db.create_all() only creates
+-- missing tables (+ the triggers), never columns of tables that already exist
+-- `flask migrate` runs db.create_all() before the migrations, so the new tables are there already
+-- No-op on databases made by db.create_all()
+
+-- pending posts (background jobs), existing posts are done : 'ready'
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS status VARCHAR(10) NOT NULL DEFAULT 'ready';
+
+-- perceptual hash of uploads (`flask image-hash backfill` fills it in for older posts)
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS image_hash BIGINT;
+
+-- posts are paged by (timestamp, id) : posts saved without a time go to the end of the feeds
+UPDATE posts SET timestamp = coalesce((SELECT min(timestamp) FROM posts), now()) WHERE timestamp IS NULL;
+ALTER TABLE posts ALTER COLUMN timestamp SET DEFAULT now();
+ALTER TABLE posts ALTER COLUMN timestamp SET NOT NULL;
+
+-- counters kept up by the triggers in models.py
+ALTER TABLE users ADD COLUMN IF NOT EXISTS post_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS favorite_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS following_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS follower_count INTEGER NOT NULL DEFAULT 0;
+
+-- newest post trimmed off a user's home timeline
+ALTER TABLE users ADD COLUMN IF NOT EXISTS timeline_horizon TIMESTAMP;
+
+-- count what is already there (as `flask reconcile-counters` does)
+UPDATE users u SET
+    post_count = (SELECT count(*) FROM posts p WHERE p.user_id = u.id),
+    favorite_count = (SELECT count(*) FROM favorited_songs fs WHERE fs.user_id = u.id),
+    following_count = (SELECT count(*) FROM follows f WHERE f.follower_id = u.id),
+    follower_count = (SELECT count(*) FROM follows f WHERE f.followed_id = u.id);
@@ -0,0 +1,35 @@
+-- Secondary indexes for the app's access patterns (declared on the models in models.py too,
+-- so databases made by db.create_all() already have them + this is a no-op there)
+-- CONCURRENTLY : builds without blocking writes, one statement at a time outside a transaction
+-- A build that fails part way leaves an INVALID index : drop it + run `flask migrate` again
+
+-- who follows X : fanning a post out, counting followers
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_follows_followed_id ON follows (followed_id);
+
+-- authors over the fan-out cap, read at query time by the home feed
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_follower_count ON users (follower_count);
+
+-- a user's posts newest first, page by page (profiles, user posts, the query time feed)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_posts_user_id_timestamp ON posts (user_id, timestamp DESC, id DESC);
+
+-- matching a recommended song to a saved one
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_songs_spotify_url ON songs (spotify_url);
+
+-- a post's songs in order, page by page + the posts a song was given to
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_postsongs_post_id_id ON postsongs (post_id, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_postsongs_song_id ON postsongs (song_id);
+
+-- a user's favorites page by page, toggling one favorite, unlinking a deleted post's favorites
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_favorited_songs_user_id_timestamp ON favorited_songs (user_id, timestamp DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_favorited_songs_user_id_song_id ON favorited_songs (user_id, song_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_favorited_songs_post_id ON favorited_songs (post_id);
+
+-- claiming queued jobs + a pending post's job
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_jobs_status ON jobs (status);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_jobs_post_id ON jobs (post_id);
+
+-- a user's home timeline page by page
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_timeline_entries_user_id_timestamp ON timeline_entries (user_id, post_timestamp DESC, post_id DESC);
+
+-- keyword index entries no post links any more (unindex_post deletes them)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_keyword_songs_emptied ON keyword_songs (post_count) WHERE post_count <= 0;
@@ -0,0 +1,57 @@
+-- Songs keyed on their Spotify track id (songs.spotify_id), so a post's songs are saved with one upsert
+-- Older databases can hold the same track more than once (songs used to be matched on preview_url) :
+-- the copies are merged into the oldest row, their post links, favorites + keyword counts with it
+-- Everything up to the index runs in one transaction (a failure rolls the merge back), the index is built after it
+-- No-op on databases made by db.create_all()
+
+ALTER TABLE songs ADD COLUMN IF NOT EXISTS spotify_id TEXT;
+
+-- the track id at the end of the URL, same as models.spotify_track_id
+UPDATE songs
+SET spotify_id = regexp_replace(rtrim(split_part(split_part(spotify_url, '?', 1), '#', 1), '/'), '^.*/', '')
+WHERE spotify_id IS NULL;
+
+-- song id -> the song it is merged into (per connection, gone once the migration is done)
+CREATE TEMP TABLE song_merges AS
+SELECT id AS song_id, keep_id
+FROM (SELECT id, min(id) OVER (PARTITION BY spotify_id) AS keep_id FROM songs) copies
+WHERE id <> keep_id;
+
+-- a post (or user) linked to several copies keeps its first link (favorite)
+DELETE FROM postsongs ps
+WHERE ps.song_id IN (SELECT song_id FROM song_merges UNION SELECT keep_id FROM song_merges)
+  AND EXISTS (SELECT 1 FROM postsongs other LEFT JOIN song_merges om ON om.song_id = other.song_id
+              WHERE other.post_id = ps.post_id AND other.id < ps.id
+                AND coalesce(om.keep_id, other.song_id) =
+                    coalesce((SELECT keep_id FROM song_merges WHERE song_id = ps.song_id), ps.song_id));
+
+UPDATE postsongs ps SET song_id = m.keep_id FROM song_merges m WHERE ps.song_id = m.song_id;
+
+DELETE FROM favorited_songs fs
+WHERE fs.song_id IN (SELECT song_id FROM song_merges UNION SELECT keep_id FROM song_merges)
+  AND EXISTS (SELECT 1 FROM favorited_songs other LEFT JOIN song_merges om ON om.song_id = other.song_id
+              WHERE other.user_id = fs.user_id AND other.id < fs.id
+                AND coalesce(om.keep_id, other.song_id) =
+                    coalesce((SELECT keep_id FROM song_merges WHERE song_id = fs.song_id), fs.song_id));
+
+UPDATE favorited_songs fs SET song_id = m.keep_id FROM song_merges m WHERE fs.song_id = m.song_id;
+
+-- recount the merged songs in the keyword index
+DELETE FROM keyword_songs
+WHERE song_id IN (SELECT song_id FROM song_merges UNION SELECT keep_id FROM song_merges);
+
+INSERT INTO keyword_songs (keyword, song_id, post_count)
+SELECT pk.keyword, ps.song_id, count(*)
+FROM post_keywords pk
+JOIN postsongs ps ON ps.post_id = pk.post_id
+WHERE ps.song_id IN (SELECT keep_id FROM song_merges)
+GROUP BY pk.keyword, ps.song_id;
+
+DELETE FROM songs WHERE id IN (SELECT song_id FROM song_merges);
+
+DROP TABLE song_merges;
+
+ALTER TABLE songs ALTER COLUMN spotify_id SET NOT NULL;
+
+-- the upsert's conflict target
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_songs_spotify_id ON songs (spotify_id);
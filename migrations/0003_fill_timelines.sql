@@ -0,0 +1,7 @@
+-- Fill the home timelines of databases from before timelines existed (after 0001's indexes, which
+-- the rebuild needs to stay fast), same as `flask timeline rebuild` for users without any entry yet
+-- No-op on databases made by db.create_all() (every post since then was fanned out)
+
+SELECT rebuild_timeline(u.id)
+FROM users u
+WHERE NOT EXISTS (SELECT 1 FROM timeline_entries e WHERE e.user_id = u.id);
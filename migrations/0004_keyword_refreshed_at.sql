@@ -0,0 +1,6 @@
+-- When each keyword of the index was last searched on Spotify : entries older than INDEX_REFRESH_TTL
+-- stop answering lookups, so the keyword goes to Spotify again + its songs get refreshed
+-- Existing entries count as just refreshed
+-- No-op on databases made by db.create_all()
+
+ALTER TABLE keyword_songs ADD COLUMN IF NOT EXISTS refreshed_at TIMESTAMP NOT NULL DEFAULT now();
@@ -0,0 +1,4 @@
+-- Favorites of a song : keyword index lookups count them for the candidate songs only
+-- No-op on databases made by db.create_all()
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_favorited_songs_song_id ON favorited_songs (song_id);
@@ -0,0 +1,5 @@
+-- When a preview lookup claimed a song : concurrent plays wait for its answer without a row lock
+-- held during the lookup (songs.preview_url '' now marks songs Node found no preview for)
+-- No-op on databases made by db.create_all()
+
+ALTER TABLE songs ADD COLUMN IF NOT EXISTS preview_claimed_at TIMESTAMP;
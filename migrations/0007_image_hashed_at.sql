@@ -0,0 +1,10 @@
+-- When each post's image hash was set : the hash index reads the hashes set since its last refresh
+-- (posts hashed out of id order, or backfilled, were missed by an id watermark)
+-- `flask migrate` installs the trigger stamping it (db.create_all()), hashes already there count as set now
+-- No-op on databases made by db.create_all()
+
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS image_hashed_at TIMESTAMP;
+
+UPDATE posts SET image_hashed_at = now() WHERE image_hash IS NOT NULL AND image_hashed_at IS NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_posts_image_hashed_at ON posts (image_hashed_at);
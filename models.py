@@ -1,10 +1,25 @@
+import os
+from flask import g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
+from sqlalchemy import event, or_, DDL
 from datetime import datetime
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
 
+# newest posts kept on each user's home timeline, older pages are read from posts at query time
+TIMELINE_LENGTH = int(os.getenv('TIMELINE_LENGTH', 300))
+# authors with more followers than this aren't fanned out, followers read their posts at query time
+FANOUT_MAX_FOLLOWERS = int(os.getenv('FANOUT_MAX_FOLLOWERS', 2000))
+# songs.preview_url of a song Node found no preview for (NULL : not looked up yet)
+NO_PREVIEW = ''
+# job kind that puts a new post on its author's followers' timelines (queued by the posts trigger)
+FAN_OUT_JOB = 'fan_out_post'
+# job kind that puts an author's latest posts on their followers' timelines once the author is back
+# under the fan-out cap (queued by the follows trigger + sync_timeline_settings)
+BACKFILL_AUTHOR_JOB = 'backfill_author'
+
 class Follow(db.Model):
     """Association table for followers and followed users"""
 
@@ -15,8 +30,11 @@ class Follow(db.Model):
     followed_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.now, nullable=False)
 
+    # its index also serves "who does X follow" lookups (follower_id is the leading column)
+    # "who follows X" (fanning a post out, counting followers) needs its own
     __table_args__ = (
         db.UniqueConstraint('follower_id', 'followed_id', name='unique_follow'),
+        db.Index('ix_follows_followed_id', 'followed_id'),
     )
 
 class User(db.Model):
@@ -32,6 +50,17 @@ class User(db.Model):
     password = db.Column(db.String, nullable=False)
     favorites_public = db.Column(db.Boolean, default=False)
 
+    # counts shown on profiles + user lists, kept up by the COUNTER_TRIGGERS below
+    # (`flask reconcile-counters` recounts them if they ever drift)
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    follower_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+
+    # timestamp of the newest post trimmed off this user's timeline (None = nothing trimmed yet)
+    # the feed reads the timeline for posts after it + posts at query time for anything older
+    timeline_horizon = db.Column(db.DateTime)
+
     # 1:M relationship from user --< posts (user.posts)(post.user)
     posts = db.relationship('Post', backref='user', cascade='all, delete-orphan')
 
@@ -46,19 +75,52 @@ class User(db.Model):
         backref='followers'
     )
 
+    def follow_ids(self):
+        """
+        (ids of the users this user follows, ids of its followers) as sets, in one query
+        Kept on flask.g for the rest of the request (outside one it's loaded on every call),
+        so the templates' follow checks share it
+        (follows changed later in the same request aren't seen, the follow routes redirect)
+
+        """
+
+        cache = g.setdefault('follow_ids', {}) if has_request_context() else {}
+
+        if self.id not in cache:
+            following, followers = set(), set()
+            for follower_id, followed_id in (db.session.query(Follow.follower_id, Follow.followed_id)
+                                             .filter(or_(Follow.follower_id == self.id,
+                                                         Follow.followed_id == self.id))):
+                if follower_id == self.id:
+                    following.add(followed_id)
+                if followed_id == self.id:
+                    followers.add(follower_id)
+            cache[self.id] = (following, followers)
+
+        return cache[self.id]
+
+    def following_among(self, users):
+        """Ids of the given users this user follows (one query at most, none once follow_ids is loaded)"""
+
+        ids = {user.id for user in users}
+
+        if has_request_context() and self.id in g.get('follow_ids', {}):
+            return ids & self.follow_ids()[0]
+
+        if not ids:
+            return set()
+
+        return {followed_id for followed_id, in (db.session.query(Follow.followed_id)
+                                                 .filter(Follow.follower_id == self.id,
+                                                         Follow.followed_id.in_(ids)))}
+
     def is_following(self, user):
         """Check if the current user is following the given user."""
-        return Follow.query.filter(
-            Follow.follower_id == self.id,
-            Follow.followed_id == user.id
-        ).count() > 0
+        return user.id in self.follow_ids()[0]
 
     def is_followed_by(self, user):
         """Check if the current user is followed by the given user."""
-        return Follow.query.filter(
-            Follow.follower_id == user.id,
-            Follow.followed_id == self.id
-        ).count() > 0
+        return user.id in self.follow_ids()[1]
 
 
     def __repr__(self):
@@ -110,7 +172,16 @@ class Post(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     image = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text)
-    timestamp = db.Column(db.DateTime, default=datetime.now)
+    # part of the (timestamp, id) keyset lists page on, so never NULL (server default for raw SQL inserts)
+    timestamp = db.Column(db.DateTime, default=datetime.now, nullable=False, server_default=db.func.now())
+
+    # 'pending' while the background job finds songs, then 'ready' (or 'failed')
+    status = db.Column(db.String(10), nullable=False, default='ready', server_default='ready')
+
+    # perceptual hash (dHash) of uploaded images, finds re-uploads of the same photo (utils/image_hash.py)
+    image_hash = db.Column(db.BigInteger)
+    # when image_hash was set (IMAGE_HASH_TRIGGERS), the hash index reads the hashes set since its last refresh
+    image_hashed_at = db.Column(db.DateTime)
 
     # M:M relationship between posts and songs via PostSong (post.songs)(song.posts)
     # when post is deleted -> all PostSong entries are deleted
@@ -119,6 +190,24 @@ class Post(db.Model):
     def __repr__(self):
         return f"<Post id={self.id} user_id={self.user_id} image={self.image}>"
 
+    # newest posts of a set of users (home feed, profiles) straight from the index, page by page
+    # + the hashes set since the hash index's last refresh
+    __table_args__ = (
+        db.Index('ix_posts_user_id_timestamp', 'user_id', db.text('timestamp DESC'), db.text('id DESC')),
+        db.Index('ix_posts_image_hashed_at', 'image_hashed_at'),
+    )
+
+    @property
+    def is_pending(self):
+        return self.status == 'pending'
+
+def spotify_track_id(spotify_url):
+    """Track id at the end of a Spotify URL (https://open.spotify.com/track/<id>?si=...)"""
+
+    path = spotify_url.split('?')[0].split('#')[0].rstrip('/')
+
+    return path.rsplit('/', 1)[-1]
+
 class Song(db.Model):
     """Song model instance"""
 
@@ -128,8 +217,15 @@ class Song(db.Model):
     title = db.Column(db.String(255), nullable=False)
     artist = db.Column(db.String(255), nullable=False)
     image_url = db.Column(db.Text)
-    spotify_url = db.Column(db.Text, nullable=False)
+    spotify_url = db.Column(db.Text, nullable=False, index=True)
+    # songs are matched on their Spotify track id when a post's recommendations are saved
+    # (upserted in one statement, see utils/song_catalog.py), taken from the URL if not given
+    spotify_id = db.Column(db.Text, nullable=False, unique=True, index=True,
+                           default=lambda context: spotify_track_id(context.get_current_parameters()['spotify_url']))
+    # NULL until looked up (see utils/recommendations.resolve_song_preview), NO_PREVIEW when there is none
     preview_url = db.Column(db.Text)
+    # when a preview lookup claimed the song, so concurrent plays wait for it instead of asking Node again
+    preview_claimed_at = db.Column(db.DateTime)
 
     def __repr__(self):
         return f"<Song id={self.id} title={self.title} artist={self.artist}>"
@@ -151,6 +247,10 @@ class PostSong(db.Model):
     # unique constraint to ensure same song cnanot be associated with same post 1+
     __table_args__ = (
         db.UniqueConstraint('post_id', 'song_id', name='unique_post_song'),
+        # a post's songs in the order they were found, page by page (show_post)
+        db.Index('ix_postsongs_post_id_id', 'post_id', 'id'),
+        # the posts a song was given to (song.posts)
+        db.Index('ix_postsongs_song_id', 'song_id'),
     )
 
     def __repr__(self):
@@ -172,6 +272,404 @@ class FavoritedSong(db.Model):
     song = db.relationship('Song', backref='favorited_songs')
     post = db.relationship('Post', backref='favorited_songs')
 
+    # a user's newest favorites first, page by page + toggling one favorite
+    # post_id : unlinking the favorites of a deleted post
+    # song_id : counting the favorites of a keyword's candidate songs (keyword index lookups)
+    __table_args__ = (
+        db.Index('ix_favorited_songs_user_id_timestamp', 'user_id', db.text('timestamp DESC'), db.text('id DESC')),
+        db.Index('ix_favorited_songs_user_id_song_id', 'user_id', 'song_id'),
+        db.Index('ix_favorited_songs_post_id', 'post_id'),
+        db.Index('ix_favorited_songs_song_id', 'song_id'),
+    )
+
+class CachedPreview(db.Model):
+    """
+    Preview URL cache keyed by normalized "title artist"
+    preview_url is NULL for negative results (no preview found)
+
+    """
+
+    __tablename__ = "preview_cache"
+
+    key = db.Column(db.Text, primary_key=True)
+    preview_url = db.Column(db.Text)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<CachedPreview key={self.key} preview_url={self.preview_url}>"
+
+class ImageAnalysis(db.Model):
+    """
+    Keywords Everypixel returned for an image
+    Keyed by the SHA-256 of the uploaded bytes or of the canonicalized image URL
+
+    """
+
+    __tablename__ = "image_analyses"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    source = db.Column(db.String(10), nullable=False) # 'file' or 'url'
+    num_keywords = db.Column(db.Integer, nullable=False)
+    keywords = db.Column(db.JSON, nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('content_hash', 'num_keywords', name='unique_image_analysis'),
+    )
+
+    def __repr__(self):
+        return f"<ImageAnalysis id={self.id} content_hash={self.content_hash} source={self.source}>"
+
+class Job(db.Model):
+    """
+    Background job queued in Postgres + processed by `flask worker`
+    Workers claim jobs with SELECT ... FOR UPDATE SKIP LOCKED
+
+    """
+
+    __tablename__ = "jobs"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+
+    # 'queued' -> 'running' -> 'done' / 'failed'
+    status = db.Column(db.String(10), nullable=False, default='queued', index=True)
+    stage = db.Column(db.String(50)) # human readable progress, e.g. 'Finding songs'
+    progress = db.Column(db.Integer, nullable=False, default=0) # 0 - 100
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+
+    # post the job works on, if any (lets show_post report progress)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'), index=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now, nullable=False)
+
+    def __repr__(self):
+        return f"<Job id={self.id} kind={self.kind} status={self.status}>"
+
+class PostKeyword(db.Model):
+    """Normalized keywords that produced a post's songs"""
+
+    __tablename__ = "post_keywords"
+
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True)
+    keyword = db.Column(db.Text, primary_key=True)
+
+    def __repr__(self):
+        return f"<PostKeyword post_id={self.post_id} keyword={self.keyword}>"
+
+class KeywordSong(db.Model):
+    """
+    Inverted index : keyword -> songs posts with that keyword were given
+    post_count is how many posts link this keyword + song
+
+    """
+
+    __tablename__ = "keyword_songs"
+
+    keyword = db.Column(db.Text, primary_key=True)
+    song_id = db.Column(db.Integer, db.ForeignKey('songs.id', ondelete='CASCADE'), primary_key=True)
+    post_count = db.Column(db.Integer, nullable=False, default=1)
+    # last time Spotify was searched for the keyword (or the entry was added), older entries
+    # than INDEX_REFRESH_TTL don't answer lookups any more
+    refreshed_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+    # entries no post links any more, deleted by unindex_post (only ever holds those few rows)
+    __table_args__ = (
+        db.Index('ix_keyword_songs_emptied', 'post_count', postgresql_where=db.text('post_count <= 0')),
+    )
+
+    def __repr__(self):
+        return f"<KeywordSong keyword={self.keyword} song_id={self.song_id} post_count={self.post_count}>"
+
+class TimelineEntry(db.Model):
+    """
+    A post on a user's home feed, written when the post is made (fan-out on write)
+    Kept up by the TIMELINE_TRIGGERS below, read by utils/feed.py
+
+    """
+
+    __tablename__ = "timeline_entries"
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True)
+    author_id = db.Column(db.Integer, nullable=False)
+    post_timestamp = db.Column(db.DateTime, nullable=False)
+
+    # a user's newest entries first, page by page
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_id_timestamp', 'user_id', db.text('post_timestamp DESC'),
+                 db.text('post_id DESC')),
+    )
+
+    def __repr__(self):
+        return f"<TimelineEntry user_id={self.user_id} post_id={self.post_id}>"
+
+class TimelineSetting(db.Model):
+    """
+    TIMELINE_LENGTH + FANOUT_MAX_FOLLOWERS as the timeline triggers + the home feed read them
+    ('length', 'fanout_max_followers'), so both always run on the same values
+    Seeded when the tables are created, brought in step with the env by utils/timeline.sync_timeline_settings
+
+    """
+
+    __tablename__ = "timeline_settings"
+
+    name = db.Column(db.Text, primary_key=True)
+    value = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<TimelineSetting {self.name}={self.value}>"
+
+
+# keep users' counters in step with every insert / delete, whichever code path (or cascade) makes it
+# follows are written through the User.following secondary table, which ORM events on Follow never see
+COUNTER_TRIGGERS = """
+CREATE OR REPLACE FUNCTION count_user_posts() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE users SET post_count = post_count + 1 WHERE id = NEW.user_id;
+    ELSE
+        UPDATE users SET post_count = post_count - 1 WHERE id = OLD.user_id;
+    END IF;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION count_user_favorites() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE users SET favorite_count = favorite_count + 1 WHERE id = NEW.user_id;
+    ELSE
+        UPDATE users SET favorite_count = favorite_count - 1 WHERE id = OLD.user_id;
+    END IF;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+-- both users in one UPDATE
+CREATE OR REPLACE FUNCTION count_user_follows() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE users
+        SET following_count = following_count + CASE WHEN id = NEW.follower_id THEN 1 ELSE 0 END,
+            follower_count = follower_count + CASE WHEN id = NEW.followed_id THEN 1 ELSE 0 END
+        WHERE id IN (NEW.follower_id, NEW.followed_id);
+    ELSE
+        UPDATE users
+        SET following_count = following_count - CASE WHEN id = OLD.follower_id THEN 1 ELSE 0 END,
+            follower_count = follower_count - CASE WHEN id = OLD.followed_id THEN 1 ELSE 0 END
+        WHERE id IN (OLD.follower_id, OLD.followed_id);
+    END IF;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS posts_count ON posts;
+CREATE TRIGGER posts_count AFTER INSERT OR DELETE ON posts
+    FOR EACH ROW EXECUTE PROCEDURE count_user_posts();
+
+DROP TRIGGER IF EXISTS favorited_songs_count ON favorited_songs;
+CREATE TRIGGER favorited_songs_count AFTER INSERT OR DELETE ON favorited_songs
+    FOR EACH ROW EXECUTE PROCEDURE count_user_favorites();
+
+DROP TRIGGER IF EXISTS follows_count ON follows;
+CREATE TRIGGER follows_count AFTER INSERT OR DELETE ON follows
+    FOR EACH ROW EXECUTE PROCEDURE count_user_follows();
+"""
+
+event.listen(db.Model.metadata, 'after_create', DDL(COUNTER_TRIGGERS))
+
+# stamp posts.image_hashed_at whenever a hash is set, on insert (uploads) or later (`flask image-hash backfill`)
+IMAGE_HASH_TRIGGERS = """
+-- columns only read when it runs : the trigger can be created before `flask migrate` adds them
+CREATE OR REPLACE FUNCTION stamp_image_hash() RETURNS trigger AS $$
+BEGIN
+    IF NEW.image_hash IS NOT NULL AND (TG_OP = 'INSERT' OR NEW.image_hash IS DISTINCT FROM OLD.image_hash) THEN
+        NEW.image_hashed_at = clock_timestamp();
+    END IF;
+    RETURN NEW;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS posts_image_hashed ON posts;
+CREATE TRIGGER posts_image_hashed BEFORE INSERT OR UPDATE ON posts
+    FOR EACH ROW EXECUTE PROCEDURE stamp_image_hash();
+"""
+
+event.listen(db.Model.metadata, 'after_create', DDL(IMAGE_HASH_TRIGGERS))
+
+# fan posts out to their author's + followers' timelines as they are made, like the counters above
+# deleted posts + users leave the timelines through the foreign keys' ON DELETE CASCADE
+# the settings are read from timeline_settings when the triggers run (the env is only the seed)
+TIMELINE_TRIGGERS = f"""
+INSERT INTO timeline_settings (name, value)
+VALUES ('length', {TIMELINE_LENGTH}), ('fanout_max_followers', {FANOUT_MAX_FOLLOWERS})
+ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION timeline_setting(setting text) RETURNS integer AS $$
+    SELECT value FROM timeline_settings WHERE name = setting
+$$ LANGUAGE sql STABLE;
+
+-- cut timelines back to TIMELINE_LENGTH entries, moving their horizon up to what was cut
+CREATE OR REPLACE FUNCTION trim_timelines(user_ids integer[]) RETURNS void AS $$
+DECLARE
+    over integer[];
+BEGIN
+    SELECT array_agg(u.id) INTO over
+    FROM unnest(user_ids) AS u(id)
+    WHERE EXISTS (SELECT 1 FROM timeline_entries e WHERE e.user_id = u.id
+                  ORDER BY e.post_timestamp DESC, e.post_id DESC OFFSET timeline_setting('length'));
+
+    IF over IS NULL THEN
+        RETURN;
+    END IF;
+
+    -- lock the users in id order first, so fan-outs sharing followers can't deadlock on them
+    PERFORM 1 FROM users WHERE id = ANY(over) ORDER BY id FOR UPDATE;
+
+    WITH cutoffs AS (
+        SELECT u.id AS user_id, c.post_timestamp, c.post_id
+        FROM unnest(over) AS u(id)
+        CROSS JOIN LATERAL (
+            SELECT e.post_timestamp, e.post_id FROM timeline_entries e
+            WHERE e.user_id = u.id
+            ORDER BY e.post_timestamp DESC, e.post_id DESC
+            OFFSET timeline_setting('length') LIMIT 1
+        ) c
+    ), trimmed AS (
+        DELETE FROM timeline_entries e USING cutoffs c
+        WHERE e.user_id = c.user_id AND (e.post_timestamp, e.post_id) <= (c.post_timestamp, c.post_id)
+    )
+    UPDATE users u SET timeline_horizon = GREATEST(u.timeline_horizon, c.post_timestamp)
+    FROM cutoffs c WHERE u.id = c.user_id;
+END $$ LANGUAGE plpgsql;
+
+-- a new post goes on its author's timeline right away, its followers' are filled by a
+-- '{FAN_OUT_JOB}' background job (fan_out_to_followers) outside the post's transaction,
+-- unless the author has too many of them
+CREATE OR REPLACE FUNCTION fan_out_post() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO timeline_entries (user_id, post_id, author_id, post_timestamp)
+    VALUES (NEW.user_id, NEW.id, NEW.user_id, NEW.timestamp);
+
+    PERFORM trim_timelines(ARRAY[NEW.user_id]);
+
+    IF EXISTS (SELECT 1 FROM users a WHERE a.id = NEW.user_id
+               AND a.follower_count BETWEEN 1 AND timeline_setting('fanout_max_followers')) THEN
+        INSERT INTO jobs (kind, payload, status, progress, attempts, created_at, updated_at)
+        VALUES ('{FAN_OUT_JOB}', json_build_object('post_id', NEW.id), 'queued', 0, 0, now(), now());
+    END IF;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+-- put a post on its author's followers' timelines (run by the fan-out job)
+-- followers are read now : follows made since the post backfilled it already, unfollows must not get it
+CREATE OR REPLACE FUNCTION fan_out_to_followers(pid integer) RETURNS void AS $$
+DECLARE
+    user_ids integer[];
+BEGIN
+    SELECT array_agg(f.follower_id) INTO user_ids
+    FROM posts p
+    JOIN users a ON a.id = p.user_id
+    JOIN follows f ON f.followed_id = p.user_id
+    WHERE p.id = pid AND a.follower_count <= timeline_setting('fanout_max_followers');
+
+    IF user_ids IS NULL THEN
+        RETURN; -- deleted since, or no followers left
+    END IF;
+
+    INSERT INTO timeline_entries (user_id, post_id, author_id, post_timestamp)
+    SELECT unnest(user_ids), p.id, p.user_id, p.timestamp FROM posts p WHERE p.id = pid
+    ON CONFLICT DO NOTHING;
+
+    PERFORM trim_timelines(user_ids);
+END $$ LANGUAGE plpgsql;
+
+-- put an author's latest posts (newer than each user's horizon) on these users' timelines
+CREATE OR REPLACE FUNCTION backfill_author_posts(user_ids integer[], aid integer) RETURNS void AS $$
+BEGIN
+    INSERT INTO timeline_entries (user_id, post_id, author_id, post_timestamp)
+    SELECT u.id, p.id, p.user_id, p.timestamp
+    FROM users u
+    CROSS JOIN LATERAL (
+        SELECT p.id, p.user_id, p.timestamp FROM posts p
+        WHERE p.user_id = aid AND (u.timeline_horizon IS NULL OR p.timestamp > u.timeline_horizon)
+        ORDER BY p.timestamp DESC, p.id DESC
+        LIMIT timeline_setting('length') + 1
+    ) p
+    WHERE u.id = ANY(user_ids)
+    ON CONFLICT DO NOTHING;
+
+    PERFORM trim_timelines(user_ids);
+END $$ LANGUAGE plpgsql;
+
+-- an author back under the fan-out cap : their followers' timelines get the posts that were read
+-- at query time until now (run by the backfill job)
+CREATE OR REPLACE FUNCTION backfill_author(aid integer) RETURNS void AS $$
+DECLARE
+    user_ids integer[];
+BEGIN
+    SELECT array_agg(f.follower_id ORDER BY f.follower_id) INTO user_ids
+    FROM follows f JOIN users a ON a.id = f.followed_id
+    WHERE f.followed_id = aid AND a.follower_count <= timeline_setting('fanout_max_followers');
+
+    IF user_ids IS NOT NULL THEN
+        PERFORM backfill_author_posts(user_ids, aid);
+    END IF;
+END $$ LANGUAGE plpgsql;
+
+-- following backfills the author's latest posts, unfollowing takes them back out
+-- (follows_count runs first, follower_count is already up to date)
+-- an unfollow bringing the author back to the cap queues a '{BACKFILL_AUTHOR_JOB}' job for the rest
+-- of their followers, going over it needs nothing : the feed reads those authors at query time
+CREATE OR REPLACE FUNCTION follow_timeline() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF EXISTS (SELECT 1 FROM users a WHERE a.id = NEW.followed_id
+                   AND a.follower_count <= timeline_setting('fanout_max_followers')) THEN
+            PERFORM backfill_author_posts(ARRAY[NEW.follower_id], NEW.followed_id);
+        END IF;
+    ELSE
+        DELETE FROM timeline_entries WHERE user_id = OLD.follower_id AND author_id = OLD.followed_id;
+
+        IF EXISTS (SELECT 1 FROM users a WHERE a.id = OLD.followed_id
+                   AND a.follower_count = timeline_setting('fanout_max_followers')) THEN
+            INSERT INTO jobs (kind, payload, status, progress, attempts, created_at, updated_at)
+            VALUES ('{BACKFILL_AUTHOR_JOB}', json_build_object('author_id', OLD.followed_id), 'queued', 0, 0,
+                    now(), now());
+        END IF;
+    END IF;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+-- refill one user's timeline from scratch (`flask timeline rebuild`)
+CREATE OR REPLACE FUNCTION rebuild_timeline(uid integer) RETURNS void AS $$
+BEGIN
+    DELETE FROM timeline_entries WHERE user_id = uid;
+    UPDATE users SET timeline_horizon = NULL WHERE id = uid;
+
+    INSERT INTO timeline_entries (user_id, post_id, author_id, post_timestamp)
+    SELECT uid, p.id, p.user_id, p.timestamp
+    FROM posts p
+    WHERE p.user_id = uid OR p.user_id IN (
+        SELECT f.followed_id FROM follows f JOIN users a ON a.id = f.followed_id
+        WHERE f.follower_id = uid AND a.follower_count <= timeline_setting('fanout_max_followers'))
+    ORDER BY p.timestamp DESC, p.id DESC
+    LIMIT timeline_setting('length') + 1;
+
+    PERFORM trim_timelines(ARRAY[uid]);
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS posts_fan_out ON posts;
+CREATE TRIGGER posts_fan_out AFTER INSERT ON posts
+    FOR EACH ROW EXECUTE PROCEDURE fan_out_post();
+
+DROP TRIGGER IF EXISTS follows_timeline ON follows;
+CREATE TRIGGER follows_timeline AFTER INSERT OR DELETE ON follows
+    FOR EACH ROW EXECUTE PROCEDURE follow_timeline();
+"""
+
+event.listen(db.Model.metadata, 'after_create', DDL(TIMELINE_TRIGGERS))
 
 def connect_db(app):
     """Connect DB + app"""
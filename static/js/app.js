@@ -1,8 +1,5 @@
 document.addEventListener('DOMContentLoaded', function () {
-    const loadMoreButton = document.getElementById('load-more-button');
     const songList = document.getElementById('song-list');
-    let offset = loadMoreButton ? parseInt(loadMoreButton.getAttribute('data-offset')) : 0;
-    const postId = loadMoreButton ? loadMoreButton.getAttribute('data-post-id') : null;
 
     const image_form = document.getElementById('image_form');
     const spinner = document.getElementById('loading-spinner');
@@ -30,6 +27,48 @@ document.addEventListener('DOMContentLoaded', function () {
     let currentAudio = null;
     let currentButton = null;
 
+    // Resolve a song's preview the first time it is played (songs are saved without one)
+    // one request per button, even if it is clicked again while waiting
+    function resolvePreview(button) {
+        if (!button.previewRequest) {
+            const songId = button.getAttribute('data-song-id');
+            button.previewRequest = axios.get(`/songs/${songId}/preview`)
+                .then(response => {
+                    const previewUrl = response.data.preview_url || '';
+                    button.setAttribute('data-audio', previewUrl);
+                    return previewUrl;
+                })
+                .catch(error => {
+                    console.error('Error resolving preview:', error);
+                    button.previewRequest = null; // let the next click try again
+                    return null; // unknown, unlike '' (the server found no preview)
+                });
+        }
+        return button.previewRequest;
+    }
+
+    // Play a button's preview, looking it up first when data-audio is empty
+    async function playButton(button) {
+        if (!button.getAttribute('data-audio') && button.getAttribute('data-song-id')) {
+            button.innerHTML = '<i class="fa fa-spinner fa-spin"></i>';
+            const previewUrl = await resolvePreview(button);
+
+            if (previewUrl === null) {
+                // lookup failed, the button stays enabled for another try
+                button.innerHTML = '<i class="fa fa-play"></i>';
+                return;
+            }
+
+            if (!previewUrl) {
+                button.innerHTML = '<i class="fa fa-play"></i>';
+                button.disabled = true;
+                button.title = 'No preview available';
+                return;
+            }
+        }
+        togglePlay(button);
+    }
+
     // Function to play/pause the audio
     function togglePlay(button) {
         const audioUrl = button.getAttribute('data-audio');
@@ -70,7 +109,7 @@ document.addEventListener('DOMContentLoaded', function () {
     // Function to attach the play/pause event listeners
     function attachPlayListeners() {
         document.querySelectorAll('.play-btn').forEach(button => {
-            button.onclick = () => togglePlay(button);
+            button.onclick = () => playButton(button);
         });
     }
 
@@ -94,9 +133,9 @@ document.addEventListener('DOMContentLoaded', function () {
     }
 
     // Attach listeners for favorite toggle
-    function attachFavoriteListeners() {
-        document.querySelectorAll('.favorite-form').forEach(form => {
-            form.addEventListener('submit', handleFavoriteToggle);
+    function attachFavoriteListeners(root = document) {
+        root.querySelectorAll('.favorite-form').forEach(form => {
+            form.onsubmit = handleFavoriteToggle;
         });
     }
 
@@ -117,9 +156,9 @@ document.addEventListener('DOMContentLoaded', function () {
     }
 
     // Attach listeners for removing favorites
-    function attachRemoveFavoriteListeners() {
-        document.querySelectorAll('.remove-favorite-form').forEach(form => {
-            form.addEventListener('submit', handleRemoveFavorite);
+    function attachRemoveFavoriteListeners(root = document) {
+        root.querySelectorAll('.remove-favorite-form').forEach(form => {
+            form.onsubmit = handleRemoveFavorite;
         });
     }
 
@@ -143,61 +182,120 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     }
 
-    // Function to load more songs via Axios
-    function loadMoreSongs() {
-        axios.get(`/posts/${postId}?offset=${offset}&json=true`)
-            .then(response => {
-                const data = response.data;
-
-                if (data.songs.length > 0) {
-                    data.songs.forEach(song => {
-                        const li = document.createElement('li');
-                        li.classList.add('list-group-item', 'd-flex', 'justify-content-between', 'align-items-center', 'custom-audio-item');
-                        li.innerHTML = `
-                        <div class="d-flex align-items-center" style="flex-grow: 1;">
-                            <img src="${song.image_url}" alt="Album Cover" style="width: 50px; height: 50px; margin-right: 15px;">
-                            <div>
-                                <p class="mb-1">
-                                    <a href="${song.spotify_url}" style="text-decoration: none; color: inherit;" target="_blank">
-                                        ${song.title} by ${song.artist}
-                                    </a>
-                                </p>
-                                <div class="audio-player">
-                                    <button class="play-btn" data-audio="${song.preview_url}">
-                                        <i class="fa fa-play"></i>
-                                    </button>
-                                    <div class="progress">
-                                        <div class="progress-bar"></div>
-                                    </div>
-                                </div>
-                            </div>
-                        </div>
-                        <form class="favorite-form" style="margin-left: auto;" action="/posts/${postId}/songs/${song.id}/favorite" method="POST">
-                            <button type="submit" class="favorite-btn">
-                                <i class="${song.is_favorited ? 'fas fa-heart' : 'far fa-heart'}"></i>
-                            </button>
-                        </form>
-                    `;
-                        songList.appendChild(li);
-                    });
-
-                    attachPlayListeners();
-                    attachFavoriteListeners();
-                    attachRemoveFavoriteListeners();
-
-                    offset += data.songs.length;
-                    if (loadMoreButton) {
-                        loadMoreButton.setAttribute('data-offset', offset);
-                    }
-                } else {
-                    loadMoreButton.remove();
-                }
+    // Build a song list item (same markup as posts/detail.html)
+    function buildSongItem(song, postId) {
+        const li = document.createElement('li');
+        li.classList.add('list-group-item', 'd-flex', 'justify-content-between', 'align-items-center', 'custom-audio-item');
+        li.innerHTML = `
+        <div class="d-flex align-items-center" style="flex-grow: 1;">
+            <img src="${song.image_url}" alt="Album Cover" style="width: 50px; height: 50px; margin-right: 15px;">
+            <div>
+                <p class="mb-1">
+                    <a href="${song.spotify_url}" style="text-decoration: none; color: inherit;" target="_blank">
+                        ${song.title} by ${song.artist}
+                    </a>
+                </p>
+                <div class="audio-player">
+                    <button class="play-btn" data-audio="${song.preview_url || ''}" data-song-id="${song.id}">
+                        <i class="fa fa-play"></i>
+                    </button>
+                    <div class="progress">
+                        <div class="progress-bar"></div>
+                    </div>
+                </div>
+            </div>
+        </div>
+        <form class="favorite-form" style="margin-left: auto;" action="/posts/${postId}/songs/${song.id}/favorite" method="POST">
+            <button type="submit" class="favorite-btn">
+                <i class="${song.is_favorited ? 'fas fa-heart' : 'far fa-heart'}"></i>
+            </button>
+        </form>
+    `;
+        return li;
+    }
+
+    // Load the next page of a cursor paginated list (feed, posts, users, favorites, a post's songs)
+    // the server sends the next page's URL, so scrolling deeper never gets slower
+    async function loadNextPage(loadMore) {
+        if (loadMore.loading) return;
+        loadMore.loading = true;
+
+        const list = document.getElementById(loadMore.getAttribute('data-list'));
+        const url = new URL(loadMore.getAttribute('data-next'), window.location.origin);
+        url.searchParams.set('json', 'true');
+
+        try {
+            const data = (await axios.get(url.toString())).data;
+
+            if (data.html !== undefined) {
+                list.insertAdjacentHTML('beforeend', data.html);
+            } else {
+                // a post's songs come as data, built like the streamed ones
+                data.songs.forEach(song => {
+                    list.appendChild(buildSongItem(song, list.getAttribute('data-post-id')));
+                });
+            }
+
+            attachPlayListeners();
+            attachFavoriteListeners(list);
+            attachRemoveFavoriteListeners(list);
+
+            if (data.next_url) {
+                loadMore.setAttribute('data-next', data.next_url);
+                loadMore.loading = false;
+            } else {
+                loadMore.remove();
+            }
+        } catch (error) {
+            console.error('Error loading more:', error);
+            loadMore.loading = false; // the button can try again
+        }
+    }
+
+    // Load the next page when the end of a list scrolls into view, or on click
+    function attachInfiniteScroll() {
+        const observer = 'IntersectionObserver' in window ? new IntersectionObserver(entries => {
+            entries.forEach(entry => {
+                if (entry.isIntersecting) loadNextPage(entry.target);
             });
+        }, { rootMargin: '200px' }) : null;
+
+        document.querySelectorAll('.load-more').forEach(loadMore => {
+            loadMore.querySelector('.load-more-button').addEventListener('click', () => loadNextPage(loadMore));
+            if (observer) observer.observe(loadMore);
+        });
     }
 
-    // Trigger load more on click
-    if (loadMoreButton) {
-        loadMoreButton.addEventListener('click', loadMoreSongs);
+    // Fill in the song list of a pending post as the background job resolves each song
+    function streamPendingPost() {
+        const pending = document.getElementById('post-pending');
+        if (!pending) return;
+
+        const pendingPostId = pending.getAttribute('data-post-id');
+        const progressText = document.getElementById('post-progress');
+        const source = new EventSource(`/posts/${pendingPostId}/stream`);
+
+        source.addEventListener('song', evt => {
+            const li = buildSongItem(JSON.parse(evt.data), pendingPostId);
+            songList.appendChild(li);
+
+            attachPlayListeners();
+            li.querySelector('.favorite-form').onsubmit = handleFavoriteToggle;
+        });
+
+        source.addEventListener('progress', evt => {
+            progressText.textContent = `${JSON.parse(evt.data).stage}...`;
+        });
+
+        source.addEventListener('done', evt => {
+            source.close();
+            pending.remove();
+
+            if (JSON.parse(evt.data).status === 'failed') {
+                songList.insertAdjacentHTML('beforebegin',
+                    `<p class="text-muted">Sorry, we couldn't imagine tracks for this image.</p>`);
+            }
+        });
     }
 
     // Attach initial listeners
@@ -205,4 +303,6 @@ document.addEventListener('DOMContentLoaded', function () {
     attachFavoriteListeners();
     attachRemoveFavoriteListeners();
     attachFavoritesVisibilityListener();
+    attachInfiniteScroll();
+    streamPendingPost();
 });
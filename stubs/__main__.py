@@ -0,0 +1,56 @@
+"""
+Start every stand-in at once + print the settings that point the app at them
+
+Run : python -m stubs --latency lognormal:200:0.5 --error-rate 0.01 --seed 7
+
+"""
+
+import argparse
+import shlex
+import sys
+from stubs.common import StubBehavior, add_behavior_args
+from stubs.catalog import Catalog
+from stubs.everypixel import EverypixelStub
+from stubs.spotify import SpotifyStub
+
+parser = argparse.ArgumentParser(description='Local stand-ins for Everypixel, Spotify + the preview finder')
+parser.add_argument('--everypixel-port', type=int, default=8001)
+parser.add_argument('--spotify-port', type=int, default=8002)
+parser.add_argument('--seed', type=int, default=0, help='Seed for the catalog, latencies + errors')
+parser.add_argument('--catalog-size', type=int, default=500)
+add_behavior_args(parser) # defaults for every stand-in
+add_behavior_args(parser, prefix='everypixel-')
+add_behavior_args(parser, prefix='spotify-')
+add_behavior_args(parser, prefix='preview-')
+args = parser.parse_args()
+
+def behavior(prefix):
+    # a stand-in's own options win over the shared ones
+    latency = getattr(args, f'{prefix}latency')
+    error_rate = getattr(args, f'{prefix}error_rate')
+    return StubBehavior(latency if latency != 'fixed:0' else args.latency,
+                        error_rate or args.error_rate, args.seed)
+
+catalog = Catalog(seed=args.seed, size=args.catalog_size)
+everypixel = EverypixelStub(port=args.everypixel_port, behavior=behavior('everypixel_'), catalog=catalog).start()
+spotify = SpotifyStub(port=args.spotify_port, behavior=behavior('spotify_'), catalog=catalog).start()
+
+preview = behavior('preview_')
+preview_cmd = [sys.executable, '-m', 'stubs.preview_worker', '--seed', str(args.seed),
+               '--catalog-size', str(args.catalog_size),
+               '--latency', preview.latency_spec, '--error-rate', str(preview.error_rate)]
+
+print('Stand-ins running, point the app at them with :\n')
+print(f'export EPIX_BASE_URL={everypixel.url}')
+print(f'export SPOTIFY_API_URL={spotify.api_url}')
+print(f'export SPOTIFY_TOKEN_URL={spotify.token_url}')
+print(f'export SPOT_CLIENT_ID={spotify.client_id} SPOT_API_KEY={spotify.client_secret}')
+# shlex.join is 3.8+, runtime.txt pins 3.7
+print(f"export PREVIEW_WORKER_CMD={shlex.quote(' '.join(shlex.quote(part) for part in preview_cmd))}")
+print('\n(run the app from the repo root so the preview worker command can import stubs)')
+
+try:
+    everypixel.thread.join()
+except KeyboardInterrupt:
+    everypixel.stop()
+    spotify.stop()
@@ -0,0 +1,110 @@
+"""
+Seeded fake music catalog shared by the Everypixel, Spotify + preview stand-ins
+The same seed + size always give the same images keywords, tracks, search results and previews
+
+"""
+
+import hashlib
+import random
+
+# keywords the Everypixel stand-in hands out, every track is tagged with a few of them
+VOCABULARY = [
+    'rain', 'weather', 'cityscape', 'night', 'umbrella', 'street', 'reflection', 'people', 'urban', 'light',
+    'sunset', 'beach', 'ocean', 'wave', 'sand', 'summer', 'vacation', 'sky', 'cloud', 'horizon',
+    'mountain', 'forest', 'tree', 'snow', 'winter', 'cold', 'hiking', 'nature', 'landscape', 'river',
+    'coffee', 'cafe', 'morning', 'breakfast', 'cup', 'table', 'cozy', 'book', 'reading', 'relax',
+    'dog', 'cat', 'pet', 'cute', 'animal', 'park', 'grass', 'spring', 'flower', 'garden',
+    'car', 'road', 'travel', 'highway', 'speed', 'neon', 'party', 'music', 'dance', 'concert',
+]
+
+TITLE_WORDS = ['Blue', 'Golden', 'Midnight', 'Electric', 'Quiet', 'Wild', 'Paper', 'Silver', 'Velvet', 'Lost',
+               'Summer', 'Neon', 'Hollow', 'Broken', 'Endless', 'Little', 'Northern', 'Static', 'Gentle', 'Burning']
+
+ARTIST_WORDS = ['The', 'Moon', 'Kids', 'Lights', 'Harbor', 'Echo', 'Fox', 'Atlas', 'Violet', 'Machines',
+                'Parade', 'Tides', 'Glass', 'Orchard', 'Satellite', 'River', 'Owls', 'Canyon', 'Bloom', 'Avenue']
+
+
+class Catalog:
+    """
+    Tracks tagged with keywords, searchable like Spotify
+    preview_rate is the share of tracks that have a preview clip
+
+    """
+
+    def __init__(self, seed=0, size=500, preview_rate=0.8):
+        self.seed = seed
+        rng = random.Random(f'catalog:{seed}')
+
+        self.tracks = []
+        self.by_id = {}
+        self.by_query = {} # lowercased "title artist" -> track (what the preview finder gets)
+        self.by_tag = {}
+
+        for n in range(size):
+            title = f'{rng.choice(TITLE_WORDS)} {rng.choice(VOCABULARY).title()}'
+            artist = f'{rng.choice(ARTIST_WORDS)} {rng.choice(ARTIST_WORDS)}'
+            track_id = hashlib.md5(f'{seed}:{n}'.encode()).hexdigest()[:22]
+
+            track = {
+                'id': track_id,
+                'name': title,
+                'artist': artist,
+                'album': f'{rng.choice(TITLE_WORDS)} {rng.choice(TITLE_WORDS)}',
+                'popularity': rng.randint(1, 100),
+                'tags': rng.sample(VOCABULARY, 3),
+                'preview_url': f'https://previews.stub.local/{track_id}.mp3' if rng.random() < preview_rate else None,
+            }
+
+            self.tracks.append(track)
+            self.by_id[track_id] = track
+            self.by_query.setdefault(f'{title} {artist}'.lower(), track)
+            for tag in track['tags']:
+                self.by_tag.setdefault(tag, []).append(track)
+
+    def image_keywords(self, image_key, num_keywords=10):
+        """Keywords (with descending scores) for an image, image_key is its URL or a hash of its bytes"""
+
+        rng = random.Random(f'{self.seed}:image:{image_key}')
+        keywords = rng.sample(VOCABULARY, min(num_keywords, len(VOCABULARY)))
+
+        return [{'keyword': keyword, 'score': round(0.99 - i * 0.04, 2)} for i, keyword in enumerate(keywords)]
+
+    def search(self, query, limit=10, offset=0):
+        """Tracks tagged with the query's words (most popular first), topped up deterministically"""
+
+        words = query.lower().split()
+        matches = sorted({track['id']: track for word in words for track in self.by_tag.get(word, [])}.values(),
+                         key=lambda track: (-track['popularity'], track['id']))
+
+        if len(matches) < offset + limit:
+            rng = random.Random(f'{self.seed}:search:{query.lower()}')
+            seen = {track['id'] for track in matches}
+            matches += [track for track in rng.sample(self.tracks, min(len(self.tracks), offset + limit * 2))
+                        if track['id'] not in seen]
+
+        return matches[offset:offset + limit]
+
+    def track(self, track_id):
+        return self.by_id.get(track_id)
+
+    def preview_for(self, query):
+        """Preview URL for a "title artist" query, None if the track has none or isn't known"""
+
+        track = self.by_query.get(' '.join(query.lower().split()))
+        return track['preview_url'] if track else None
+
+    def spotify_track(self, track):
+        """A catalog track in the shape of a Spotify API track object"""
+
+        return {
+            'id': track['id'],
+            'name': track['name'],
+            'artists': [{'name': track['artist']}],
+            'album': {'name': track['album'],
+                      'images': [{'url': f'https://images.stub.local/{track["id"]}.jpg', 'height': 640, 'width': 640}]},
+            'external_urls': {'spotify': f'https://open.spotify.com/track/{track["id"]}'},
+            'popularity': track['popularity'],
+            'preview_url': None, # like the real API these days, previews come from the preview finder
+            'type': 'track',
+            'uri': f'spotify:track:{track["id"]}',
+        }
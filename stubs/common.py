@@ -0,0 +1,180 @@
+"""
+Pieces shared by the local API stand-ins : latency / error behaviour + a small threaded JSON server
+
+Latency specs (milliseconds) :
+    fixed:100            always 100ms
+    uniform:50:250       anywhere between 50ms and 250ms
+    normal:120:30        mean 120ms, std dev 30ms (never below 0)
+    lognormal:120:0.5    median 120ms, sigma 0.5 (long tail, like real APIs)
+
+"""
+
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def parse_latency(spec):
+    """Turn a latency spec into a function(rng) -> seconds"""
+
+    kind, *args = (spec or 'fixed:0').split(':')
+    args = [float(arg) for arg in args]
+
+    if kind == 'fixed':
+        return lambda rng: args[0] / 1000
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(args[0], args[1]) / 1000
+    if kind == 'normal':
+        return lambda rng: max(0.0, rng.gauss(args[0], args[1])) / 1000
+    if kind == 'lognormal':
+        return lambda rng: rng.lognormvariate(math.log(args[0]), args[1]) / 1000
+
+    raise ValueError(f'Unknown latency distribution {spec!r}')
+
+
+class StubBehavior:
+    """
+    Latency + error rate of a stand-in, reproducible for a given seed
+    Draws are seeded per (key, nth request for that key), so concurrent requests
+    get the same answers whatever order the threads run in
+
+    """
+
+    def __init__(self, latency='fixed:0', error_rate=0.0, seed=0):
+        self.latency_spec = latency
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.seed = seed
+        self.seen = {}
+        self.lock = threading.Lock()
+
+    def draw(self, key):
+        """(seconds to wait, whether this request fails) for a request identified by key"""
+
+        with self.lock:
+            count = self.seen[key] = self.seen.get(key, 0) + 1
+
+        rng = random.Random(f'{self.seed}:{key}:{count}')
+        return self.latency(rng), rng.random() < self.error_rate
+
+    def delay(self, key):
+        """Sleep for this request's latency, returns True if it should fail"""
+
+        seconds, fail = self.draw(key)
+        time.sleep(seconds)
+        return fail
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, one handler instance per connection
+
+    def setup(self):
+        super().setup()
+        self.server.stub.count('connections')
+
+    def read_body(self):
+        # drain the (possibly large) body so the connection can be reused
+        length = int(self.headers.get('Content-Length', 0))
+        chunks = []
+        remaining = length
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 64 * 1024))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+
+        self.server.stub.count('bytes_received', length)
+        return b''.join(chunks)
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # keep test output quiet
+
+
+class StubServer:
+    """
+    Threaded HTTP server on 127.0.0.1 for one stand-in
+    Counts connections + requests, fail_with((status, retry_after), ...) queues error answers
+
+    """
+
+    handler = JSONHandler
+
+    def __init__(self, host='127.0.0.1', port=0, behavior=None):
+        self.server = ThreadingHTTPServer((host, port), self.handler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+
+        self.behavior = behavior or StubBehavior()
+        self.scheme = 'http'
+        self.stats = {'connections': 0, 'requests': 0, 'bytes_received': 0, 'errors': 0}
+        self.failures = []
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'{self.scheme}://{host}:{port}'
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def fail_with(self, *failures):
+        with self.lock:
+            self.failures.extend(failures)
+
+    def next_failure(self, key):
+        """Queued failure first, then the random error rate : (status, retry_after) or None"""
+
+        with self.lock:
+            if self.failures:
+                return self.failures.pop(0)
+
+        if self.behavior.delay(key):
+            return (503, None)
+
+        return None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def serve_forever(self):
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def add_behavior_args(parser, prefix=''):
+    """--latency / --error-rate options for a stand-in's command line"""
+
+    parser.add_argument(f'--{prefix}latency', default='fixed:0', help='Latency spec, e.g. lognormal:120:0.5 (ms)')
+    parser.add_argument(f'--{prefix}error-rate', type=float, default=0.0, help='Share of requests that fail (0 - 1)')
@@ -0,0 +1,83 @@
+"""
+Local stand-in for the Everypixel keywords API
+Keywords come from the seeded catalog, so the same image always gets the same keywords
+Counts TCP connections so tests can see how many handshakes a client paid for
+
+Run : python -m stubs.everypixel --port 8001 --latency lognormal:400:0.4 --error-rate 0.02
+Then point the app at it : EPIX_BASE_URL=http://127.0.0.1:8001/v1/keywords
+
+"""
+
+import argparse
+import hashlib
+import ssl
+from urllib.parse import urlparse, parse_qs
+from stubs.common import JSONHandler, StubServer, StubBehavior, add_behavior_args
+from stubs.catalog import Catalog
+
+
+class EverypixelStubHandler(JSONHandler):
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        self.answer(query.get('url', [''])[0])
+
+    def do_POST(self):
+        body = self.read_body()
+        self.answer(hashlib.sha256(body).hexdigest())
+
+    def answer(self, image_key):
+        stub = self.server.stub
+        stub.count('requests')
+
+        url = urlparse(self.path)
+        if url.path != stub.path:
+            return self.send_json(404, {'status': 'error', 'message': 'Not found'})
+
+        failure = stub.next_failure(f'keywords:{image_key}')
+        if failure:
+            status, retry_after = failure
+            stub.count('errors')
+            headers = {'Retry-After': str(retry_after)} if retry_after is not None else {}
+            return self.send_json(status, {'status': 'error'}, headers)
+
+        num_keywords = int(parse_qs(url.query).get('num_keywords', ['10'])[0])
+        keywords = stub.catalog.image_keywords(image_key, num_keywords)
+
+        self.send_json(200, {'status': 'ok', 'keywords': keywords})
+
+
+class EverypixelStub(StubServer):
+    """Answers /v1/keywords like Everypixel, for image URLs (GET) + uploads (POST)"""
+
+    handler = EverypixelStubHandler
+    path = '/v1/keywords'
+
+    def __init__(self, host='127.0.0.1', port=0, behavior=None, catalog=None, certfile=None):
+        super().__init__(host, port, behavior)
+        self.catalog = catalog or Catalog(seed=self.behavior.seed)
+
+        if certfile:
+            # TLS, so the saved handshakes include the expensive part
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile)
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+            self.scheme = 'https'
+
+    @property
+    def url(self):
+        return self.base_url + self.path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local Everypixel keywords API stub')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--certfile', help='PEM file with certificate + key to serve over TLS')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for keywords, latencies + errors')
+    add_behavior_args(parser)
+    args = parser.parse_args()
+
+    behavior = StubBehavior(args.latency, args.error_rate, args.seed)
+    stub = EverypixelStub(port=args.port, behavior=behavior, certfile=args.certfile)
+    print(f'Everypixel stub listening on {stub.url}')
+    stub.serve_forever()
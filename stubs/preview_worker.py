@@ -0,0 +1,63 @@
+"""
+Fake `node get_preview.js --server` backend
+Speaks the same JSON-lines protocol on stdin / stdout, answers from the seeded catalog
+
+Point the app at it (run from the repo root) :
+    PREVIEW_WORKER_CMD="python -m stubs.preview_worker --latency lognormal:300:0.6 --error-rate 0.01"
+
+"""
+
+import argparse
+import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from stubs.common import StubBehavior, add_behavior_args
+from stubs.catalog import Catalog
+
+
+def serve(catalog, behavior, concurrency=4, stdin=sys.stdin, stdout=sys.stdout):
+    """Answer requests until stdin closes, up to `concurrency` at a time like the node worker"""
+
+    write_lock = threading.Lock()
+
+    def answer(request):
+        query = request.get('query', '')
+
+        if behavior.delay(f'preview:{query.lower()}'):
+            response = {'id': request.get('id'), 'error': 'Stub failure'}
+        else:
+            url = catalog.preview_for(query)
+            response = {'id': request.get('id'), 'previewUrls': [url] if url else []}
+
+        with write_lock:
+            stdout.write(json.dumps(response) + '\n')
+            stdout.flush()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for line in stdin:
+            if not line.strip():
+                continue
+
+            try:
+                request = json.loads(line)
+            except ValueError:
+                with write_lock:
+                    stdout.write(json.dumps({'id': None, 'error': 'Invalid request'}) + '\n')
+                    stdout.flush()
+                continue
+
+            pool.submit(answer, request)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake preview finder worker')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the catalog, latencies + errors')
+    parser.add_argument('--catalog-size', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=4)
+    add_behavior_args(parser)
+    args = parser.parse_args()
+
+    serve(Catalog(seed=args.seed, size=args.catalog_size),
+          StubBehavior(args.latency, args.error_rate, args.seed),
+          concurrency=args.concurrency)
@@ -0,0 +1,113 @@
+"""
+Local stand-in for the Spotify Web API (client credentials token + track search)
+Search results come from the seeded catalog
+
+Run : python -m stubs.spotify --port 8002 --latency lognormal:150:0.5
+Then point the app at it :
+    SPOTIFY_API_URL=http://127.0.0.1:8002/v1/
+    SPOTIFY_TOKEN_URL=http://127.0.0.1:8002/api/token
+
+"""
+
+import argparse
+from urllib.parse import urlparse, parse_qs
+from stubs.common import JSONHandler, StubServer, StubBehavior, add_behavior_args
+from stubs.catalog import Catalog
+
+
+class SpotifyStubHandler(JSONHandler):
+
+    def do_POST(self):
+        stub = self.server.stub
+        self.read_body()
+        stub.count('requests')
+
+        if urlparse(self.path).path != '/api/token':
+            return self.send_json(404, {'error': 'not_found'})
+
+        stub.count('tokens')
+        self.send_json(200, {'access_token': stub.token, 'token_type': 'Bearer', 'expires_in': 3600})
+
+    def do_GET(self):
+        stub = self.server.stub
+        stub.count('requests')
+
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+
+        if self.headers.get('Authorization') != f'Bearer {stub.token}':
+            return self.send_json(401, {'error': {'status': 401, 'message': 'No token provided'}})
+
+        if url.path == '/v1/search':
+            return self.search(query)
+
+        if url.path.startswith('/v1/tracks/'):
+            track = stub.catalog.track(url.path.rsplit('/', 1)[-1])
+            if track is None:
+                return self.send_json(404, {'error': {'status': 404, 'message': 'Non existing id'}})
+            return self.send_json(200, stub.catalog.spotify_track(track))
+
+        self.send_json(404, {'error': {'status': 404, 'message': 'Service not found'}})
+
+    def search(self, query):
+        stub = self.server.stub
+        q = query.get('q', '')
+        limit = int(query.get('limit', 10))
+        offset = int(query.get('offset', 0))
+
+        failure = stub.next_failure(f'search:{q.lower()}:{limit}:{offset}')
+        if failure:
+            status, retry_after = failure
+            stub.count('errors')
+            headers = {'Retry-After': str(retry_after)} if retry_after is not None else {}
+            return self.send_json(status, {'error': {'status': status, 'message': 'Stub failure'}}, headers)
+
+        stub.count('searches')
+        tracks = stub.catalog.search(q, limit=limit, offset=offset)
+
+        self.send_json(200, {'tracks': {
+            'href': f'{stub.base_url}{self.path}',
+            'items': [stub.catalog.spotify_track(track) for track in tracks],
+            'limit': limit,
+            'offset': offset,
+            'total': len(stub.catalog.tracks),
+            'next': None,
+            'previous': None,
+        }})
+
+
+class SpotifyStub(StubServer):
+    """Token + /v1/search endpoints shaped like Spotify's"""
+
+    handler = SpotifyStubHandler
+    token = 'stub-access-token'
+    # any credentials get a token, these are what the stand-in's clients send
+    client_id = 'stub-client-id'
+    client_secret = 'stub-client-secret'
+
+    def __init__(self, host='127.0.0.1', port=0, behavior=None, catalog=None):
+        super().__init__(host, port, behavior)
+        self.catalog = catalog or Catalog(seed=self.behavior.seed)
+        self.stats.update({'tokens': 0, 'searches': 0})
+
+    @property
+    def api_url(self):
+        return self.base_url + '/v1/'
+
+    @property
+    def token_url(self):
+        return self.base_url + '/api/token'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local Spotify Web API stub')
+    parser.add_argument('--port', type=int, default=8002)
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the catalog, latencies + errors')
+    parser.add_argument('--catalog-size', type=int, default=500)
+    add_behavior_args(parser)
+    args = parser.parse_args()
+
+    behavior = StubBehavior(args.latency, args.error_rate, args.seed)
+    stub = SpotifyStub(port=args.port, behavior=behavior, catalog=Catalog(seed=args.seed, size=args.catalog_size))
+    print(f'Spotify stub listening on {stub.api_url} (token URL {stub.token_url})')
+    stub.serve_forever()
@@ -1,4 +1,7 @@
 import requests
+import threading
+import time
+from concurrent.futures import Future
 from unittest import TestCase
 from unittest.mock import patch, Mock
 from api_helpers import image_to_keywords, keywords_to_songs
@@ -6,9 +9,8 @@ from api_helpers import image_to_keywords, keywords_to_songs
 class EpixTestCase(TestCase):
     """Test that image_to_keywords method is properly integrated"""
 
-    @patch('api_helpers.requests.get')
-    @patch('api_helpers.requests.post')
-    def test_image_to_keywords(self, mock_get, mock_post):
+    @patch('api_helpers.everypixel.session.request')
+    def test_image_to_keywords(self, mock_request):
         """Test that image_to_keywords method extract correct keywords from image posts"""
 
         mock_response = Mock()
@@ -23,8 +25,7 @@ class EpixTestCase(TestCase):
         }
 
         # mimic mock responses
-        mock_get.return_value = mock_response
-        mock_post.return_value = mock_response
+        mock_request.return_value = mock_response
 
         keywords = image_to_keywords('/tests/test_image.jpg')
 
@@ -33,7 +34,6 @@ class EpixTestCase(TestCase):
         self.assertIsInstance(keywords, list)
         self.assertGreater(len(keywords), 0)
 
-    @patch('api_helpers.random.shuffle', lambda x: None) # don't randomize in mock
     @patch('api_helpers.sp.search')
     def test_keywords_to_songs(self, mock_search):
         """Test that keywords_to_songs method correctly maps keywords to Spotipy tracks"""
@@ -42,6 +42,7 @@ class EpixTestCase(TestCase):
             'tracks': {
                 'items': [
                     {
+                        'id': 'song1',
                         'name': 'Rainy Day',
                         'artists': [{'name': 'Artist 1'}],
                         'album': {'name': 'A Rainy Album',
@@ -50,6 +51,7 @@ class EpixTestCase(TestCase):
                         'preview_url': 'https://test.com/preview1.mp3'
                     },
                     {
+                        'id': 'song2',
                         'name': 'City Lights',
                         'artists': [{'name': 'Artist 2'}],
                         'album': {'name': 'City Album',
@@ -74,7 +76,6 @@ class EpixTestCase(TestCase):
         self.assertGreater(len(songs), 0)
 
 
-    @patch('api_helpers.random.shuffle', lambda x: None) # don't randomize in mock
     @patch('api_helpers.sp.search')
     def test_keywords_to_songs_no_results(self, mock_search):
         """Test that keywords_to_songs handles no results."""
@@ -82,4 +83,77 @@ class EpixTestCase(TestCase):
         mock_search.return_value = {'tracks': {'items': []}}
 
         songs = keywords_to_songs(['no data'])
-        self.assertEqual(songs, [])
\ No newline at end of file
+        self.assertEqual(songs, [])
+
+class SpotifyFanOutTestCase(TestCase):
+    """Test that keywords_to_songs searches keywords concurrently"""
+
+    def make_track(self, title, artist):
+        return {
+            'id': title,
+            'name': title,
+            'artists': [{'name': artist}],
+            'album': {'name': f'{title} Album',
+                      'images': [{'url': f'https://test.com/{title}.jpg'}]},
+            'external_urls': {'spotify': f'https://test.com/{title}'}
+        }
+
+    def fake_preview_pool(self):
+        """Preview pool stand-in that answers every lookup right away"""
+
+        def submit(query):
+            future = Future()
+            future.set_result(f'https://test.com/{query}.mp3')
+            return future
+
+        return Mock(submit=Mock(side_effect=submit))
+
+    @patch('api_helpers.sp.search')
+    def test_searches_run_concurrently(self, mock_search):
+        """Test that searches overlap and results stay in keyword order"""
+
+        in_flight = []
+        peak = []
+        lock = threading.Lock()
+
+        def search(q, type, limit):
+            with lock:
+                in_flight.append(q)
+                peak.append(len(in_flight))
+            # later keywords answer first
+            time.sleep(0.05 * (5 - int(q[-1])))
+            with lock:
+                in_flight.remove(q)
+            return {'tracks': {'items': [self.make_track(f'Song {q}', 'Artist')]}}
+
+        mock_search.side_effect = search
+
+        with patch('api_helpers.get_preview_pool', return_value=self.fake_preview_pool()):
+            songs = keywords_to_songs(['keyword1', 'keyword2', 'keyword3', 'keyword4'])
+
+        self.assertGreater(max(peak), 1)
+        self.assertEqual([song['title'] for song in songs],
+                         ['Song keyword1', 'Song keyword2', 'Song keyword3', 'Song keyword4'])
+        self.assertEqual(songs[0]['preview_url'], 'https://test.com/Song keyword1 Artist.mp3')
+
+    @patch('api_helpers.sp.search')
+    def test_song_cap_and_dedupe(self, mock_search):
+        """Test that results are deduped by (title, artist) and capped at 10 songs"""
+
+        def search(q, type, limit):
+            return {'tracks': {'items': [self.make_track('Same Song', 'Artist'),
+                                         self.make_track(f'Song {q} a', 'Artist'),
+                                         self.make_track(f'Song {q} b', 'Artist')]}}
+
+        mock_search.side_effect = search
+        pool = self.fake_preview_pool()
+
+        with patch('api_helpers.get_preview_pool', return_value=pool):
+            songs = keywords_to_songs([f'k{i}' for i in range(10)])
+
+        titles = [song['title'] for song in songs]
+        self.assertEqual(len(songs), 10)
+        # found by every keyword first, then by keyword rank + position in its results
+        self.assertEqual(titles[:3], ['Same Song', 'Song k0 a', 'Song k1 a'])
+        self.assertEqual(titles.count('Same Song'), 1)
+        self.assertEqual(pool.submit.call_count, 10) # previews for the 10 winners only, not all 21 candidates
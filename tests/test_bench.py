@@ -0,0 +1,107 @@
+from unittest import TestCase
+from app import app
+from models import db
+from bench.harness import percentile, compare, QueryCounter, run_level
+from bench.scenarios import run_benchmark
+from bench import image_hash as image_hash_bench
+from bench import timeline as timeline_bench
+
+
+class HarnessTestCase(TestCase):
+    """Test the benchmark's stats + comparison helpers"""
+
+    def test_percentile(self):
+        """Test interpolated percentiles"""
+
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 50), 50.5)
+        self.assertAlmostEqual(percentile(values, 99), 99.01)
+        self.assertEqual(percentile([3], 95), 3)
+        self.assertIsNone(percentile([], 50))
+
+    def test_compare_flags_regressions(self):
+        """Test that slower latency + lower throughput beyond the threshold are flagged, not noise"""
+
+        baseline = {'results': [{'scenario': 'route', 'concurrency': 4, 'p50_ms': 100, 'p95_ms': 200,
+                                 'throughput': 10, 'db_queries': 50}]}
+        results = {'results': [{'scenario': 'route', 'concurrency': 4, 'p50_ms': 105, 'p95_ms': 260,
+                                'throughput': 8, 'db_queries': 40},
+                               {'scenario': 'songs', 'concurrency': 4, 'p50_ms': 1}]} # no baseline, skipped
+
+        flagged = {row[2]: row[-1] for row in compare(results, baseline, threshold=0.1)}
+
+        self.assertEqual(flagged, {'p50_ms': False, 'p95_ms': True, 'throughput': True, 'db_queries': False})
+
+    def test_run_level_counts_errors(self):
+        """Test that failing uploads are counted, not timed"""
+
+        def upload(n):
+            if n % 2:
+                raise ValueError('odd')
+
+        latencies, errors, wall = run_level(upload, uploads=6, concurrency=3)
+
+        self.assertEqual((len(latencies), len(errors)), (3, 3))
+
+    def test_query_counter(self):
+        """Test that statements are counted only while attached"""
+
+        with app.app_context():
+            with QueryCounter(db.engine) as queries:
+                db.engine.execute('SELECT 1')
+                db.engine.execute('SELECT 2')
+            db.engine.execute('SELECT 3')
+
+        self.assertEqual(queries.count, 2)
+
+
+class BenchmarkRunTestCase(TestCase):
+    """Test a tiny benchmark run end to end against the stand-ins"""
+
+    def tearDown(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+    def test_run_benchmark(self):
+        """Test that every scenario runs + reports latency, upstream calls + queries"""
+
+        results = run_benchmark(levels=[2], uploads=2, report=lambda line: None)
+
+        self.assertEqual([row['scenario'] for row in results['results']], ['keywords', 'songs', 'route'])
+
+        for row in results['results']:
+            self.assertEqual(row['errors'], 0, row['sample_errors'])
+            self.assertIsNotNone(row['p99_ms'])
+            self.assertGreater(row['throughput'], 0)
+            self.assertGreater(row['db_queries'], 0)
+
+        keywords, songs, route = results['results']
+        self.assertEqual(keywords['upstream'], {'everypixel': 1, 'spotify_token': 0, 'spotify_search': 0, 'preview': 0})
+        self.assertEqual(route['upstream']['everypixel'], 1)
+        self.assertGreater(route['upstream']['spotify_search'], 0)
+
+    def test_image_hash_benchmark(self):
+        """Test that the hash index finds the same matches as the NumPy scan"""
+
+        results = image_hash_bench.run(images=2000, queries=20)
+        matches = {row['lookup']: row['matches'] for row in results['results']}
+
+        self.assertEqual(matches['index near'], matches['numpy scan near'])
+        self.assertGreaterEqual(matches['index near'], 10) # every near query finds its original
+        self.assertEqual(matches['index unseen'], matches['numpy scan unseen'])
+
+    def test_timeline_benchmark(self):
+        """Test that the timeline + query time feeds are timed and show the same pages"""
+
+        results = timeline_bench.run(users=60, following=10, posts=5, readers=5, depth=2, writes=3)
+        reads = {row['read']: row for row in results['results']}
+
+        self.assertEqual(results['mismatches'], 0)
+        self.assertEqual(reads['timeline first page']['pages'], 5)
+        self.assertEqual(reads['query time page 3']['pages'], 5)
+        self.assertIsNotNone(results['write']['p50_ms'])
+        self.assertIsNotNone(results['fan_out']['p50_ms'])
+        self.assertGreater(results['entries'], 0)
+        self.assertIn('timeline page 3', timeline_bench.format_results(results))
@@ -0,0 +1,138 @@
+import os
+import json
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+os.environ['DATABASE_URL'] = 'postgresql:///imagime_test_db'
+
+from app import app
+from models import db, User, Post, Song, PostSong
+from utils.bulk_import import load_sources, import_images, RateLimiter
+
+TEST_IMAGE = os.path.join(os.path.dirname(__file__), 'test_image.jpg')
+
+
+def fake_songs(keywords, deadline=None):
+    return [{'title': f'Song {keyword}', 'artist': 'Artist', 'image_url': None,
+             'spotify_url': f'https://test.com/{keyword}', 'preview_url': f'https://test.com/{keyword}.mp3'}
+            for keyword in keywords]
+
+
+@patch('utils.bulk_import.keywords_to_songs', side_effect=fake_songs)
+@patch('utils.bulk_import.image_to_keywords')
+class BulkImportTestCase(TestCase):
+    """Test importing many images as posts for one user"""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            user = User.signup(username='partner', email='partner@test.com', password='password', profile_img=None)
+            db.session.commit()
+            self.user_id = user.id
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        self.tmp = tempfile.mkdtemp()
+        self.uploads = os.path.join(self.tmp, 'uploads')
+        os.makedirs(os.path.join(self.tmp, 'images'))
+        os.makedirs(self.uploads)
+        for name in ('a.jpg', 'b.jpg', 'c.png', 'notes.txt'):
+            shutil.copyfile(TEST_IMAGE, os.path.join(self.tmp, 'images', name))
+
+        self.manifest = os.path.join(self.tmp, 'manifest.txt')
+        with open(self.manifest, 'w') as file:
+            file.write('# partner images\nhttps://test.com/1.jpg Sunset at the pier\n\nhttps://test.com/2.jpg\n')
+
+        self.state_file = os.path.join(self.tmp, 'state.jsonl')
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+        shutil.rmtree(self.tmp)
+
+    def test_load_sources(self, mock_keywords, mock_songs):
+        """Test that image files + manifest URLs are picked up, other files skipped"""
+
+        sources = load_sources(directory=os.path.join(self.tmp, 'images'), manifest=self.manifest)
+
+        self.assertEqual([os.path.basename(item['source']) for item in sources],
+                         ['a.jpg', 'b.jpg', 'c.png', '1.jpg', '2.jpg'])
+        self.assertEqual(sources[3]['description'], 'Sunset at the pier')
+        self.assertIsNone(sources[4]['description'])
+
+    def test_import_in_batches(self, mock_keywords, mock_songs):
+        """Test that every image becomes a post with its songs + is recorded in the state file"""
+
+        mock_keywords.return_value = ['rain', 'night']
+        sources = load_sources(directory=os.path.join(self.tmp, 'images'), manifest=self.manifest)
+
+        stats = import_images(self.user_id, sources, self.uploads, state_file=self.state_file,
+                              processes=0, rate=0, batch_size=2, report=lambda line: None)
+
+        self.assertEqual(stats['imported'], 5)
+        self.assertEqual(stats['songs'], 10)
+        self.assertEqual(Post.query.filter_by(user_id=self.user_id).count(), 5)
+        self.assertEqual(Song.query.count(), 2) # the same songs are reused across posts
+        self.assertEqual(PostSong.query.count(), 10)
+        self.assertTrue(os.path.exists(os.path.join(self.uploads, 'a.jpg')))
+        self.assertIsNotNone(Post.query.filter_by(image='/static/images/uploads/a.jpg').first())
+
+        with open(self.state_file) as file:
+            self.assertEqual(len(file.readlines()), 5)
+
+    def test_resume(self, mock_keywords, mock_songs):
+        """Test that failed images are retried on the next run and finished ones are skipped"""
+
+        def keywords(image_url=None, local_image_file=None, deadline=None):
+            if image_url == 'https://test.com/2.jpg':
+                raise ValueError('Everypixel is down')
+            return ['rain']
+
+        mock_keywords.side_effect = keywords
+        sources = load_sources(manifest=self.manifest)
+
+        stats = import_images(self.user_id, sources, self.uploads, state_file=self.state_file,
+                              processes=0, rate=0, report=lambda line: None)
+        self.assertEqual((stats['imported'], stats['failed']), (1, 1))
+
+        mock_keywords.side_effect = None
+        mock_keywords.return_value = ['rain']
+
+        stats = import_images(self.user_id, sources, self.uploads, state_file=self.state_file,
+                              processes=0, rate=0, report=lambda line: None)
+        self.assertEqual((stats['imported'], stats['failed'], stats['skipped']), (1, 0, 1))
+        self.assertEqual(mock_keywords.call_args[1]['image_url'], 'https://test.com/2.jpg')
+        self.assertEqual(Post.query.count(), 2)
+
+        with open(self.state_file) as file:
+            self.assertEqual({json.loads(line)['source'] for line in file},
+                             {'https://test.com/1.jpg', 'https://test.com/2.jpg'})
+
+    def test_cli(self, mock_keywords, mock_songs):
+        """Test the flask import-images command"""
+
+        mock_keywords.return_value = ['rain']
+
+        result = app.test_cli_runner().invoke(args=['import-images', 'partner', '--manifest', self.manifest,
+                                                    '--processes', '0', '--rate', '0'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Imported 2 post(s) with 2 song(s), 0 failed, 0 skipped', result.output)
+        self.assertTrue(os.path.exists(self.manifest + '.state'))
+
+    def test_rate_limit(self, mock_keywords, mock_songs):
+        """Test that the rate limiter spaces calls out"""
+
+        limiter = RateLimiter(20)
+
+        start = time.perf_counter()
+        for _ in range(5):
+            limiter.acquire()
+
+        self.assertGreaterEqual(time.perf_counter() - start, 0.19)
@@ -0,0 +1,98 @@
+import os
+import requests
+from unittest import TestCase
+from unittest.mock import patch
+from utils.everypixel import EverypixelClient, MultipartFileBody
+from stubs.everypixel import EverypixelStub
+
+TEST_IMAGE = os.path.join(os.path.dirname(__file__), 'test_image.jpg')
+
+
+class EverypixelClientTestCase(TestCase):
+    """Test the pooled, retrying Everypixel client against the local stub"""
+
+    def setUp(self):
+        self.stub = EverypixelStub().start()
+        self.client = EverypixelClient('id', 'key', base_url=self.stub.url, backoff=0.01, max_retries=2)
+
+    def tearDown(self):
+        self.client.close()
+        self.stub.stop()
+
+    def test_keywords_from_url(self):
+        """Test that a URL lookup returns the stub's keywords"""
+
+        response = self.client.keywords(image_url='https://test.com/img.jpg', num_keywords=3)
+        again = self.client.keywords(image_url='https://test.com/img.jpg', num_keywords=3)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['keywords']), 3)
+        self.assertEqual(response.json(), again.json()) # seeded, same image -> same keywords
+
+    def test_file_upload_streams_whole_file(self):
+        """Test that the multipart body is streamed with a Content-Length covering the file"""
+
+        body = MultipartFileBody(TEST_IMAGE)
+        self.assertEqual(len(body), len(b''.join(body)))
+        self.assertEqual(len(b''.join(body)), len(b''.join(body))) # iterable again for retries
+
+        response = self.client.keywords(image_file=TEST_IMAGE)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stub.stats['bytes_received'], len(body))
+        self.assertGreater(self.stub.stats['bytes_received'], os.path.getsize(TEST_IMAGE))
+
+    def test_connection_reuse(self):
+        """Test that the session reuses one connection where bare requests opens one per call"""
+
+        calls = 10
+
+        for _ in range(calls):
+            requests.get(self.stub.url, params={'url': 'https://test.com/img.jpg'})
+        unpooled_connections = self.stub.stats['connections']
+
+        for _ in range(calls):
+            self.client.keywords(image_url='https://test.com/img.jpg')
+        pooled_connections = self.stub.stats['connections'] - unpooled_connections
+
+        self.assertEqual(unpooled_connections, calls)
+        self.assertEqual(pooled_connections, 1)
+
+        # the connection the client opened is back in its pool, ready for the next call
+        pool = self.client.session.get_adapter(self.stub.url).poolmanager.connection_from_url(self.stub.url)
+        self.assertEqual(pool.num_connections, 1)
+        self.assertEqual(pool.pool.qsize(), pool.pool.maxsize)
+
+    @patch('utils.everypixel.time.sleep')
+    def test_retries_honour_retry_after(self, mock_sleep):
+        """Test that 429 / 5xx are retried, waiting Retry-After when the server sends it"""
+
+        self.stub.fail_with((429, 2), (503, None))
+
+        response = self.client.keywords(image_url='https://test.com/img.jpg')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stub.stats['requests'], 3)
+        self.assertEqual(mock_sleep.call_args_list[0][0][0], 2)
+        self.assertLessEqual(mock_sleep.call_args_list[1][0][0], 0.02) # jittered backoff
+
+    @patch('utils.everypixel.time.sleep')
+    def test_gives_up_after_max_retries(self, mock_sleep):
+        """Test that the last error response is returned once retries run out"""
+
+        self.stub.fail_with((500, None), (500, None), (500, None))
+
+        response = self.client.keywords(image_url='https://test.com/img.jpg')
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.stub.stats['requests'], 3)
+
+    def test_client_errors_not_retried(self):
+        """Test that a 4xx other than 429 comes straight back"""
+
+        self.stub.fail_with((401, None))
+
+        response = self.client.keywords(image_url='https://test.com/img.jpg')
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.stub.stats['requests'], 1)
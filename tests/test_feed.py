@@ -0,0 +1,95 @@
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+from sqlalchemy import event
+
+os.environ['DATABASE_URL'] = 'postgresql:///imagime_test_db'
+
+from app import app, CURR_USER_KEY
+from models import db, User, Post, Follow
+from utils.feed import home_feed
+from utils.jobs import work
+
+
+class HomeFeedTestCase(TestCase):
+    """Test the home feed : content, order + the queries it takes"""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        self.user = self.make_user('me')
+        self.friend = self.make_user('friend')
+        self.stranger = self.make_user('stranger')
+        db.session.add(Follow(follower_id=self.user.id, followed_id=self.friend.id))
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user.id
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def make_user(self, username):
+        user = User(username=username, email=f'{username}@test.com', password='password')
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    def add_posts(self, user, count, start=datetime(2024, 1, 1)):
+        db.session.add_all([Post(user_id=user.id, image=f'/static/{user.username}-{i}.png', description=f'{user.username} {i}',
+                                 timestamp=start + timedelta(minutes=i)) for i in range(count)])
+        db.session.commit()
+        work(burst=True) # fan them out to the followers' timelines
+
+    def test_feed_content(self):
+        """Test that the feed has the user's + followed users' posts, newest first, capped"""
+
+        self.add_posts(self.user, 10)
+        self.add_posts(self.friend, 10, start=datetime(2024, 1, 1, 0, 0, 30))
+        self.add_posts(self.stranger, 5, start=datetime(2025, 1, 1))
+
+        posts = home_feed(self.user).items
+
+        self.assertEqual(len(posts), 15)
+        self.assertEqual({post.user_id for post in posts}, {self.user.id, self.friend.id})
+        self.assertEqual([post.timestamp for post in posts], sorted((post.timestamp for post in posts), reverse=True))
+        self.assertEqual(posts[0].description, 'friend 9')
+
+    def test_home_page_queries(self):
+        """Test that the home page takes one feed query however many users are followed"""
+
+        others = [User(username=f'user{i}', email=f'user{i}@test.com', password='password') for i in range(300)]
+        db.session.add_all(others)
+        db.session.commit()
+
+        db.session.add_all([Follow(follower_id=self.user.id, followed_id=other.id) for other in others])
+        db.session.add_all([Post(user_id=other.id, image='/static/test.png', description=f'post by {other.username}')
+                            for other in others[:40]])
+        db.session.commit()
+        work(burst=True)
+        db.session.remove()
+
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            html = self.client.get('/').get_data(as_text=True)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual(html.count('post-item'), 15)
+        self.assertIn('<strong>user39</strong>', html) # authors rendered
+
+        # g.user + the feed, no per-post author loads, no loading the followed users
+        self.assertEqual(len(statements), 2, statements)
+        self.assertIn('FROM posts', statements[1])
+        self.assertIn('JOIN users', statements[1])
@@ -0,0 +1,115 @@
+import os
+from unittest import TestCase
+from sqlalchemy import event
+
+os.environ['DATABASE_URL'] = 'postgresql:///imagime_test_db'
+
+from app import app, CURR_USER_KEY
+from models import db, User, Follow
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FollowIdsTestCase(TestCase):
+    """Test the per request cache of a user's follows + the follow checks built on it"""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        self.users = [User.signup(username=f'user{n}', email=f'u{n}@test.com', password='password', profile_img=None)
+                      for n in range(1, 8)]
+        db.session.commit()
+        self.u1 = self.users[0]
+
+        # user1 follows users 2-4, users 5 + 6 follow user1
+        db.session.add_all([Follow(follower_id=self.u1.id, followed_id=user.id) for user in self.users[1:4]] +
+                           [Follow(follower_id=user.id, followed_id=self.u1.id) for user in self.users[4:6]])
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1.id
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def follows_statements(self, send):
+        """Statements reading follows while `send` runs"""
+
+        statements = []
+        def record(conn, cursor, statement, *args):
+            if 'FROM follows' in statement:
+                statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            result = send()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        return statements, result
+
+    def test_follow_checks(self):
+        """Test is_following, is_followed_by + follow_ids outside a request"""
+
+        u2, u5 = self.users[1], self.users[4]
+
+        self.assertEqual(self.u1.follow_ids(), ({user.id for user in self.users[1:4]}, {u5.id, self.users[5].id}))
+        self.assertTrue(self.u1.is_following(u2))
+        self.assertFalse(self.u1.is_following(u5))
+        self.assertTrue(self.u1.is_followed_by(u5))
+        self.assertFalse(u2.is_following(self.u1))
+        self.assertTrue(u2.is_followed_by(self.u1))
+
+    def test_following_among(self):
+        """Test the batch check : one query, none once the request's follow ids are loaded"""
+
+        u2, u3, u5 = self.users[1], self.users[2], self.users[4]
+
+        statements, followed = self.follows_statements(lambda: self.u1.following_among([u2, u5, u3]))
+        self.assertEqual(followed, {u2.id, u3.id})
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(self.u1.following_among([]), set())
+
+        with app.test_request_context():
+            self.u1.follow_ids()
+            statements, followed = self.follows_statements(lambda: self.u1.following_among([u2, u5]))
+
+        self.assertEqual(followed, {u2.id})
+        self.assertEqual(statements, [])
+
+    def test_profile_reads_follows_once(self):
+        """Test that the profile's three follow checks share one query"""
+
+        u2 = self.users[1]
+
+        statements, resp = self.follows_statements(lambda: self.client.get(f'/users/{u2.id}'))
+
+        self.assertIn('Unfollow', resp.get_data(as_text=True))
+        self.assertEqual(len(statements), 1)
+
+    def test_user_list_reads_follows_once(self):
+        """Test that /users shows every follow button from one query"""
+
+        statements, resp = self.follows_statements(lambda: self.client.get('/users'))
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(html.count('>Unfollow</button>'), 3)
+        self.assertEqual(html.count('>Follow</button>'), 3)
+
+    def test_follow_seen_by_next_request(self):
+        """Test that each request starts without the previous one's follow ids"""
+
+        u7 = self.users[6]
+
+        self.assertNotIn('Unfollow', self.client.get(f'/users/{u7.id}').get_data(as_text=True))
+        self.client.post(f'/users/follow/{u7.id}')
+
+        self.assertIn('Unfollow', self.client.get(f'/users/{u7.id}').get_data(as_text=True))
@@ -0,0 +1,102 @@
+import os
+from unittest import TestCase
+from unittest.mock import patch, Mock
+
+os.environ['DATABASE_URL'] = 'postgresql:///imagime_test_db'
+
+from app import app
+from models import db, ImageAnalysis
+from utils.image_analyses import canonical_url, file_hash, url_hash
+from api_helpers import image_to_keywords
+
+TEST_IMAGE = os.path.join(os.path.dirname(__file__), 'test_image.jpg')
+
+
+class ImageAnalysisTestCase(TestCase):
+    """Test that repeated images reuse their stored analysis"""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        self.response = Mock(status_code=200)
+        self.response.json.return_value = {
+            'status': 'ok',
+            'keywords': [{'keyword': 'rain', 'score': 0.98}, {'keyword': 'cityscape', 'score': 0.87}]
+        }
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def test_canonical_url(self):
+        """Test that trivially different URLs canonicalize the same way"""
+
+        self.assertEqual(canonical_url('HTTPS://Test.com:443/img.jpg?b=2&a=1#top'),
+                         canonical_url('https://test.com/img.jpg?a=1&b=2'))
+        self.assertNotEqual(canonical_url('https://test.com/img.jpg?a=1'),
+                            canonical_url('https://test.com/img.jpg?a=2'))
+
+    @patch('api_helpers.everypixel.session.request')
+    def test_same_file_analyzed_once(self, mock_request):
+        """Test that re-posting the same image bytes skips Everypixel"""
+
+        mock_request.return_value = self.response
+
+        first = image_to_keywords(local_image_file=TEST_IMAGE)
+        second = image_to_keywords(local_image_file=TEST_IMAGE)
+
+        self.assertEqual(first, ['rain', 'cityscape'])
+        self.assertEqual(second, first)
+        self.assertEqual(mock_request.call_count, 1)
+
+        analysis = ImageAnalysis.query.one()
+        self.assertEqual(analysis.content_hash, file_hash(TEST_IMAGE))
+        self.assertEqual(analysis.source, 'file')
+
+    @patch('api_helpers.everypixel.session.request')
+    def test_same_url_analyzed_once(self, mock_request):
+        """Test that re-posting the same image URL skips Everypixel"""
+
+        mock_request.return_value = self.response
+
+        image_to_keywords(image_url='https://test.com/img.jpg?a=1&b=2')
+        keywords = image_to_keywords(image_url='https://TEST.com/img.jpg?b=2&a=1')
+
+        self.assertEqual(keywords, ['rain', 'cityscape'])
+        self.assertEqual(mock_request.call_count, 1)
+
+    @patch('api_helpers.everypixel.session.request')
+    def test_failed_analysis_not_stored(self, mock_request):
+        """Test that a non-ok Everypixel answer is not stored"""
+
+        self.response.json.return_value = {'status': 'error'}
+        mock_request.return_value = self.response
+
+        self.assertIsNone(image_to_keywords(image_url='https://test.com/img.jpg'))
+        self.assertEqual(ImageAnalysis.query.count(), 0)
+
+    @patch('api_helpers.everypixel.session.request')
+    def test_scores_kept(self, mock_request):
+        """Test that Everypixel's scores are stored + handed back with_scores, older plain rows still work"""
+
+        mock_request.return_value = self.response
+
+        image_to_keywords(image_url='https://test.com/img.jpg')
+        scored = image_to_keywords(image_url='https://test.com/img.jpg', with_scores=True)
+
+        self.assertEqual(scored, [{'keyword': 'rain', 'score': 0.98}, {'keyword': 'cityscape', 'score': 0.87}])
+        self.assertEqual(mock_request.call_count, 1)
+
+        # analyses stored before scores were kept
+        db.session.add(ImageAnalysis(content_hash=url_hash('https://test.com/old.jpg'), source='url',
+                                     num_keywords=10, keywords=['rain', 'cityscape']))
+        db.session.commit()
+
+        self.assertEqual(image_to_keywords(image_url='https://test.com/old.jpg', with_scores=True),
+                         [{'keyword': 'rain', 'score': None}, {'keyword': 'cityscape', 'score': None}])
+        self.assertEqual(image_to_keywords(image_url='https://test.com/old.jpg'), ['rain', 'cityscape'])
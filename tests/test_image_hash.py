@@ -0,0 +1,256 @@
+import io
+import os
+import random
+from unittest import TestCase
+from unittest.mock import patch
+from PIL import Image, ImageOps
+
+os.environ['DATABASE_URL'] = 'postgresql:///imagime_test_db'
+
+from app import app, CURR_USER_KEY
+from models import db, User, Post, Song, PostSong, PostKeyword, KeywordSong, Job
+from utils.image_hash import (dhash, hamming, to_signed, from_signed, MultiIndexHash, post_hash_index,
+                              find_similar_post, backfill_hashes)
+from utils.keyword_index import record_post_keywords, index_post_songs
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+TEST_IMAGE = os.path.join(os.path.dirname(__file__), 'test_image.jpg')
+
+
+def variant(scale=0.5, quality=60, mirror=False):
+    """The test photo resized + recompressed (or mirrored), as JPEG bytes"""
+
+    with Image.open(TEST_IMAGE) as image:
+        image = image.convert('RGB')
+        image = image.resize((int(image.width * scale), int(image.height * scale)), Image.BILINEAR)
+        if mirror:
+            image = ImageOps.mirror(image)
+
+        out = io.BytesIO()
+        image.save(out, format='JPEG', quality=quality)
+        return out.getvalue()
+
+
+class DHashTestCase(TestCase):
+    """Test the perceptual hash + the BK-tree"""
+
+    def test_near_duplicates_are_close(self):
+        """Test that a resized + recompressed copy hashes within a few bits, a different image doesn't"""
+
+        original = dhash(TEST_IMAGE)
+
+        self.assertLessEqual(hamming(original, dhash(variant(0.5, 60))), 6)
+        self.assertLessEqual(hamming(original, dhash(variant(0.25, 40))), 6)
+        self.assertGreater(hamming(original, dhash(variant(mirror=True))), 16)
+        self.assertLess(original, 1 << 64)
+
+    def test_signed_round_trip(self):
+        """Test that hashes with the top bit set fit a signed BIGINT + come back unchanged"""
+
+        for image_hash in (0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1):
+            stored = to_signed(image_hash)
+            self.assertTrue(-(1 << 63) <= stored < 1 << 63)
+            self.assertEqual(from_signed(stored), image_hash)
+
+    def test_index_matches_linear_scan(self):
+        """Test that index lookups find exactly what comparing with every hash finds, at any distance"""
+
+        rng = random.Random(1)
+        hashes = [rng.getrandbits(64) for _ in range(2000)]
+        # near duplicates of the first few hashes
+        hashes += [h ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for h in hashes[:50]]
+
+        hashes.append(hashes[0]) # an exact copy
+
+        index = MultiIndexHash()
+        for item, image_hash in enumerate(hashes):
+            index.add(image_hash, item)
+
+        self.assertEqual(len(index), len(hashes))
+
+        for max_distance in (0, 3, 6, 10):
+            for query in hashes[:20] + [rng.getrandbits(64) for _ in range(20)]:
+                expected = sorted((hamming(query, h), item) for item, h in enumerate(hashes)
+                                  if hamming(query, h) <= max_distance)
+                found = index.search(query, max_distance)
+
+                self.assertEqual(sorted(found), expected)
+                self.assertEqual([match[0] for match in found], sorted(match[0] for match in found))
+
+        self.assertEqual(MultiIndexHash().search(hashes[0], 6), [])
+
+
+class SimilarPostTestCase(TestCase):
+    """Test finding earlier posts of the same photo + reusing their songs"""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+        post_hash_index.reset()
+
+        self.user = User.signup(username='user1', email='u1@test.com', password='password', profile_img=None)
+        db.session.commit()
+
+        self.hash = dhash(TEST_IMAGE)
+        self.post = self.add_post(self.hash)
+
+        self.song = Song(title='Rainy Day', artist='Artist 1', spotify_url='https://test.com/song1')
+        db.session.add(self.song)
+        db.session.flush()
+        db.session.add(PostSong(post_id=self.post.id, song_id=self.song.id))
+        record_post_keywords(self.post.id, ['rain', 'sky'])
+        index_post_songs(self.post.id, [self.song.id])
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user.id
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+        post_hash_index.reset()
+
+    def add_post(self, image_hash, status='ready'):
+        post = Post(user_id=self.user.id, image='/static/test.png', status=status,
+                    image_hash=to_signed(image_hash) if image_hash is not None else None)
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def upload(self, data, filename='similar_test.jpg'):
+        return self.client.post('/posts/new',
+                                data={'image_file': (io.BytesIO(data), filename), 'description': 'Again'},
+                                content_type='multipart/form-data')
+
+    def remove_upload(self):
+        path = os.path.join(app.config['UPLOAD_FOLDER'], 'similar_test.jpg')
+        if os.path.exists(path):
+            os.remove(path)
+
+    def test_find_similar_post(self):
+        """Test that only ready posts with songs within the distance match, closest first"""
+
+        self.add_post(self.hash ^ 1, status='pending') # pending : no songs yet
+        self.add_post(self.hash ^ 3) # ready but without songs
+
+        post, distance = find_similar_post(dhash(variant()))
+        self.assertEqual(post.id, self.post.id)
+        self.assertLessEqual(distance, 6)
+
+        self.assertEqual(find_similar_post(dhash(variant(mirror=True))), (None, None))
+
+    def test_index_picks_up_new_posts(self):
+        """Test that posts saved after the first lookup are found without a rebuild"""
+
+        far = self.hash ^ ((1 << 40) - 1) # 40 bits away from every existing post
+        self.assertEqual(find_similar_post(far), (None, None))
+
+        newer = self.add_post(far)
+        db.session.add(PostSong(post_id=newer.id, song_id=self.song.id))
+        db.session.commit()
+
+        self.assertEqual(find_similar_post(far), (newer, 0))
+
+    def test_index_picks_up_late_hashes(self):
+        """Test that a hash set on an older post after a lookup (backfill, out of order commit) is found"""
+
+        far = self.hash ^ ((1 << 40) - 1)
+        older = self.add_post(None)
+        db.session.add(PostSong(post_id=older.id, song_id=self.song.id))
+        newest = self.add_post(self.hash ^ ((1 << 20) - 1))
+        db.session.commit()
+
+        self.assertEqual(find_similar_post(far), (None, None)) # index loaded up to the newest post
+        self.assertLess(older.id, newest.id)
+
+        older.image_hash = to_signed(far)
+        db.session.commit()
+        self.assertIsNotNone(older.image_hashed_at)
+
+        self.assertEqual(find_similar_post(far), (older, 0))
+
+    def test_index_reloaded(self):
+        """Test that the index is rebuilt from scratch every HASH_INDEX_RELOAD seconds"""
+
+        find_similar_post(self.hash)
+        stale = post_hash_index.index
+
+        with patch('utils.image_hash.HASH_INDEX_RELOAD', 0):
+            post, distance = find_similar_post(self.hash)
+
+        self.assertIsNot(post_hash_index.index, stale)
+        self.assertEqual((post.id, distance), (self.post.id, 0))
+
+    def test_reupload_offers_reuse(self):
+        """Test that re-uploading a resized copy offers the earlier post's songs + 'reuse' copies them"""
+
+        self.addCleanup(self.remove_upload)
+
+        response = self.upload(variant())
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.location.endswith('/posts/new/similar'))
+        self.assertEqual(Post.query.count(), 1) # nothing saved until the user answers
+
+        offer = self.client.get('/posts/new/similar').get_data(as_text=True)
+        self.assertIn('Rainy Day', offer)
+        self.assertIn('Use these songs', offer)
+
+        response = self.client.post('/posts/new/similar', data={'choice': 'reuse'})
+        self.assertEqual(response.status_code, 302)
+
+        new_post = Post.query.filter_by(description='Again').one()
+        self.assertEqual(new_post.status, 'ready')
+        self.assertIsNotNone(new_post.image_hash)
+        self.assertEqual([song.id for song in new_post.songs], [self.song.id])
+        self.assertEqual({row.keyword for row in PostKeyword.query.filter_by(post_id=new_post.id)}, {'rain', 'sky'})
+        self.assertEqual(KeywordSong.query.filter_by(keyword='rain').one().post_count, 2)
+        self.assertEqual(Job.query.count(), 0) # no API calls
+
+        # the offer is used up
+        self.assertTrue(self.client.get('/posts/new/similar').location.endswith('/posts/new'))
+
+    def test_decline_reuse(self):
+        """Test that 'find new songs' queues the upload like any other"""
+
+        self.addCleanup(self.remove_upload)
+
+        self.upload(variant())
+        self.client.post('/posts/new/similar', data={'choice': 'analyze'})
+
+        new_post = Post.query.filter_by(description='Again').one()
+        self.assertEqual(new_post.status, 'pending')
+        self.assertEqual(Job.query.one().post_id, new_post.id)
+        self.assertTrue(Job.query.one().payload['image_file'].endswith('similar_test.jpg'))
+
+    def test_different_photo_posts_directly(self):
+        """Test that an upload with no similar post goes straight to the post"""
+
+        self.addCleanup(self.remove_upload)
+
+        response = self.upload(variant(mirror=True))
+        new_post = Post.query.filter_by(description='Again').one()
+
+        self.assertTrue(response.location.endswith(f'/posts/{new_post.id}'))
+        self.assertEqual(new_post.status, 'pending')
+
+    def test_backfill(self):
+        """Test that old uploads get a hash, URL posts + missing files are skipped"""
+
+        self.addCleanup(self.remove_upload)
+        with open(os.path.join(app.config['UPLOAD_FOLDER'], 'similar_test.jpg'), 'wb') as file:
+            file.write(variant())
+
+        upload = Post(user_id=self.user.id, image='/static/images/uploads/similar_test.jpg')
+        gone = Post(user_id=self.user.id, image='/static/images/uploads/gone.jpg')
+        url = Post(user_id=self.user.id, image='https://test.com/a.jpg')
+        db.session.add_all([upload, gone, url])
+        db.session.commit()
+
+        self.assertEqual(backfill_hashes(app.config['UPLOAD_FOLDER'], batch_size=2), (1, 2))
+        self.assertLessEqual(hamming(from_signed(upload.image_hash), self.hash), 6)
@@ -0,0 +1,146 @@
+import io
+import os
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+from PIL import Image
+from utils.image_prep import prepare_image, fetch_image, prep_stats
+from utils.everypixel import EverypixelClient
+from stubs.everypixel import EverypixelStub
+from api_helpers import fetch_image_keywords
+
+TEST_IMAGE = os.path.join(os.path.dirname(__file__), 'test_image.jpg')
+
+
+def phone_photo(size=(4000, 3000), orientation=None):
+    """A big noisy JPEG with EXIF (camera model, GPS-ish tag + optional rotation)"""
+
+    image = Image.effect_noise(size, 64).convert('RGB')
+    exif = Image.Exif()
+    exif[0x0110] = 'Test Phone' # camera model
+    if orientation:
+        exif[0x0112] = orientation
+
+    out = io.BytesIO()
+    image.save(out, format='JPEG', quality=95, exif=exif.tobytes())
+    return out.getvalue()
+
+
+class PrepareImageTestCase(TestCase):
+    """Test downscaling + re-encoding images before tagging"""
+
+    def test_downscales_and_strips_metadata(self):
+        """Test that a big photo comes out small, within max_side and without EXIF"""
+
+        original = phone_photo()
+        prepared = prepare_image(original, max_side=1024)
+
+        self.assertEqual(prepared.original_size, (4000, 3000))
+        self.assertEqual(prepared.size, (1024, 768))
+        self.assertLess(len(prepared.data), len(original) / 5)
+        self.assertEqual(prepared.bytes_saved, len(original) - len(prepared.data))
+        self.assertEqual(prepared.content_type, 'image/jpeg')
+
+        with Image.open(io.BytesIO(prepared.data)) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(len(image.getexif()), 0)
+
+    def test_rotation_applied(self):
+        """Test that the EXIF orientation is applied before the EXIF is dropped"""
+
+        prepared = prepare_image(phone_photo((400, 200), orientation=6), max_side=1024) # 90 degrees
+
+        self.assertEqual(prepared.size, (200, 400))
+
+    def test_file_path_and_webp(self):
+        """Test that files on disk work, original untouched, + WebP output"""
+
+        before = os.path.getsize(TEST_IMAGE)
+        prepared = prepare_image(TEST_IMAGE, max_side=256, fmt='WEBP')
+
+        self.assertEqual(os.path.getsize(TEST_IMAGE), before)
+        self.assertEqual(prepared.original_bytes, before)
+        self.assertEqual(prepared.content_type, 'image/webp')
+        self.assertLessEqual(max(prepared.size), 256)
+
+    def test_stats_recorded(self):
+        """Test that bytes saved + time spent add up across images"""
+
+        before = prep_stats()
+        prepared = prepare_image(phone_photo((1200, 900)), max_side=512)
+        after = prep_stats()
+
+        self.assertEqual(after['images'], before['images'] + 1)
+        self.assertEqual(after['bytes_saved'] - before['bytes_saved'], prepared.bytes_saved)
+        self.assertGreater(after['seconds'], before['seconds'])
+
+    def test_not_an_image(self):
+        """Test that undecodable data raises OSError"""
+
+        with self.assertRaises(OSError):
+            prepare_image(b'not an image')
+
+    @patch('utils.image_prep._fetch_session.get')
+    def test_fetch_image_size_cap(self, mock_get):
+        """Test that downloads bigger than max_bytes are refused, even without a Content-Length"""
+
+        response = MagicMock(headers={})
+        response.iter_content.return_value = [b'x' * 600, b'x' * 600]
+        mock_get.return_value.__enter__.return_value = response
+
+        self.assertEqual(len(fetch_image('https://test.com/a.jpg', max_bytes=2000)), 1200)
+        with self.assertRaises(ValueError):
+            fetch_image('https://test.com/a.jpg', max_bytes=1000)
+
+
+@patch('api_helpers.cache_enabled', lambda: False)
+class PreparedUploadTestCase(TestCase):
+    """Test that Everypixel gets the shrunk image"""
+
+    def setUp(self):
+        self.stub = EverypixelStub().start()
+        self.client = EverypixelClient('id', 'key', base_url=self.stub.url)
+
+    def tearDown(self):
+        self.client.close()
+        self.stub.stop()
+
+    def test_file_upload_is_shrunk(self):
+        """Test that the upload is smaller than the file on disk"""
+
+        with patch('api_helpers.everypixel', self.client):
+            keywords = fetch_image_keywords(local_image_file=TEST_IMAGE)
+
+        self.assertEqual(len(keywords), 10)
+        self.assertLess(self.stub.stats['bytes_received'], os.path.getsize(TEST_IMAGE))
+
+    def test_prep_off_sends_original(self):
+        """Test that IMAGE_PREP off streams the original file"""
+
+        with patch('api_helpers.everypixel', self.client), patch('api_helpers.IMAGE_PREP', False):
+            fetch_image_keywords(local_image_file=TEST_IMAGE)
+
+        self.assertGreater(self.stub.stats['bytes_received'], os.path.getsize(TEST_IMAGE))
+
+    def test_urls(self):
+        """Test that URLs go to Everypixel as is by default, + are fetched + shrunk with IMAGE_PREP_URLS"""
+
+        with patch('api_helpers.everypixel', self.client), patch('api_helpers.fetch_image') as mock_fetch:
+            fetch_image_keywords(image_url='https://test.com/a.jpg')
+            self.assertFalse(mock_fetch.called)
+
+            mock_fetch.return_value = phone_photo((2000, 1500))
+            with patch('api_helpers.IMAGE_PREP_URLS', True):
+                fetch_image_keywords(image_url='https://test.com/a.jpg')
+
+        self.assertEqual(mock_fetch.call_args[0][0], 'https://test.com/a.jpg')
+        self.assertGreater(self.stub.stats['bytes_received'], 0) # posted, not a GET
+
+    def test_unreadable_image_falls_back(self):
+        """Test that an image Pillow can't read is sent as it is"""
+
+        with patch('api_helpers.everypixel', self.client), \
+             patch('api_helpers.prepare_image', side_effect=OSError('cannot identify image file')):
+            keywords = fetch_image_keywords(local_image_file=TEST_IMAGE)
+
+        self.assertEqual(len(keywords), 10)
+        self.assertGreater(self.stub.stats['bytes_received'], os.path.getsize(TEST_IMAGE))
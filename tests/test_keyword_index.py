@@ -0,0 +1,186 @@
+import os
+from datetime import datetime, timedelta
+from concurrent.futures import Future
+from unittest import TestCase
+from unittest.mock import patch
+
+os.environ['DATABASE_URL'] = 'postgresql:///imagime_test_db'
+
+from app import app
+from models import db, User, Post, FavoritedSong, KeywordSong, PostKeyword
+from utils.recommendations import save_post_songs
+from utils.keyword_index import record_post_keywords, unindex_post, rebuild_index, lookup_keyword_songs
+from api_helpers import keywords_to_songs
+
+
+def song(n):
+    return {'title': f'Song {n}', 'artist': 'Artist', 'image_url': None,
+            'spotify_url': f'https://test.com/{n}', 'preview_url': f'https://test.com/{n}.mp3'}
+
+def spotify_result(q, type='track', limit=3):
+    return {'tracks': {'items': [{
+        'id': f'spotify-{q}',
+        'name': f'Spotify {q}',
+        'artists': [{'name': 'Artist'}],
+        'album': {'name': 'Album', 'images': [{'url': 'https://test.com/album.jpg'}]},
+        'external_urls': {'spotify': f'https://test.com/spotify/{q}'}
+    }]}}
+
+
+class KeywordIndexTestCase(TestCase):
+    """Test the keyword -> song index built from saved posts"""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        self.user = User.signup(username='user1', email='u1@test.com', password='password', profile_img=None)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def add_post(self, keywords, songs):
+        post = Post(user_id=self.user.id, image='/static/test.png')
+        db.session.add(post)
+        db.session.flush()
+
+        record_post_keywords(post.id, keywords)
+        save_post_songs(post, songs)
+        db.session.commit()
+
+        return post
+
+    def counts(self):
+        return {(row.keyword, row.song_id): row.post_count for row in KeywordSong.query}
+
+    def test_index_updates_incrementally(self):
+        """Test that each new post adds to the counts of its keyword + song pairs"""
+
+        self.add_post(['Rain', ' city  lights'], [song(1), song(2)])
+        self.add_post(['rain'], [song(1)])
+
+        counts = self.counts()
+        self.assertEqual(counts[('rain', 1)], 2)
+        self.assertEqual(counts[('rain', 2)], 1)
+        self.assertEqual(counts[('city lights', 1)], 1)
+        self.assertEqual(len(counts), 4)
+
+    def test_unindex_post(self):
+        """Test that removing a post takes its counts out (and is safe to repeat)"""
+
+        first = self.add_post(['rain'], [song(1), song(2)])
+        self.add_post(['rain'], [song(1)])
+
+        unindex_post(first.id)
+        unindex_post(first.id)
+        db.session.commit()
+
+        self.assertEqual(self.counts(), {('rain', 1): 1})
+        self.assertEqual(PostKeyword.query.filter_by(post_id=first.id).count(), 0)
+
+    def test_delete_post_route(self):
+        """Test that deleting a post through the app updates the index"""
+
+        post = self.add_post(['rain'], [song(1)])
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['curr_user'] = self.user.id
+            client.post(f'/posts/{post.id}/delete')
+
+        self.assertEqual(KeywordSong.query.count(), 0)
+
+    def test_rebuild_matches_incremental(self):
+        """Test that a full rebuild gives the same counts as the incremental updates"""
+
+        self.add_post(['rain', 'night'], [song(1), song(2)])
+        self.add_post(['rain'], [song(2), song(3)])
+        counts = self.counts()
+
+        self.assertEqual(rebuild_index(), len(counts))
+        self.assertEqual(self.counts(), counts)
+
+    def test_ranking_uses_favorites(self):
+        """Test that songs are ranked by post count, with favorites adding weight"""
+
+        self.add_post(['rain'], [song(1), song(2)])
+        self.add_post(['rain'], [song(2)])
+
+        self.assertEqual([s['title'] for s in lookup_keyword_songs(['rain'], limit=2)['rain']],
+                         ['Song 2', 'Song 1'])
+
+        song_1 = KeywordSong.query.filter_by(song_id=1).first().song_id
+        db.session.add(FavoritedSong(user_id=self.user.id, song_id=song_1))
+        db.session.commit()
+
+        self.assertEqual([s['title'] for s in lookup_keyword_songs(['RAIN'], limit=2)['rain']],
+                         ['Song 1', 'Song 2'])
+        self.assertEqual(lookup_keyword_songs(['rain'], limit=3), {}) # too few candidates
+
+    @patch('api_helpers.sp.search', side_effect=spotify_result)
+    def test_index_answers_covered_keywords(self, mock_search):
+        """Test that covered keywords skip Spotify and only the missing one is searched"""
+
+        self.add_post(['rain', 'night', 'city'], [song(1), song(2), song(3)])
+
+        with patch('api_helpers.get_preview_pool') as mock_pool:
+            mock_pool.return_value.submit.side_effect = lambda query: self.answered(None)
+            songs = keywords_to_songs(['rain', 'night', 'city', 'umbrella'])
+
+        mock_pool.return_value.submit.assert_called_once_with('Spotify umbrella Artist')
+        self.assertEqual([call[1]['q'] for call in mock_search.call_args_list], ['umbrella'])
+        self.assertEqual([s['title'] for s in songs], ['Song 1', 'Song 2', 'Song 3', 'Spotify umbrella'])
+        self.assertEqual(songs[0]['preview_url'], 'https://test.com/1.mp3')
+
+    @patch('api_helpers.sp.search', side_effect=spotify_result)
+    def test_low_coverage_goes_to_spotify(self, mock_search):
+        """Test that Spotify answers everything when the index knows too few keywords"""
+
+        self.add_post(['rain'], [song(1), song(2), song(3)])
+
+        with patch('api_helpers.get_preview_pool') as mock_pool:
+            mock_pool.return_value.submit.side_effect = lambda query: self.answered(None)
+            songs = keywords_to_songs(['rain', 'night'])
+
+        self.assertEqual(mock_search.call_count, 2)
+        self.assertEqual([s['title'] for s in songs], ['Spotify rain', 'Spotify night'])
+
+    @patch('api_helpers.sp.search', side_effect=spotify_result)
+    def test_stale_keyword_goes_to_spotify(self, mock_search):
+        """Test that a keyword not refreshed for INDEX_REFRESH_TTL is searched again, then answered by the index"""
+
+        self.add_post(['rain'], [song(1), song(2), song(3)])
+        KeywordSong.query.update({'refreshed_at': datetime.now() - timedelta(days=8)})
+        db.session.commit()
+
+        with patch('api_helpers.get_preview_pool') as mock_pool:
+            mock_pool.return_value.submit.side_effect = lambda query: self.answered(None)
+            stale = keywords_to_songs(['rain'])
+            fresh = keywords_to_songs(['rain'])
+
+        self.assertEqual(mock_search.call_count, 1)
+        self.assertEqual([s['title'] for s in stale], ['Spotify rain'])
+        self.assertEqual([s['title'] for s in fresh], ['Song 1', 'Song 2', 'Song 3'])
+
+    def test_lookup_max_age(self):
+        """Test that entries older than max_age don't count as candidates"""
+
+        self.add_post(['rain'], [song(1), song(2)])
+        KeywordSong.query.filter_by(song_id=1).update({'refreshed_at': datetime.now() - timedelta(hours=2)})
+        db.session.commit()
+
+        self.assertEqual(len(lookup_keyword_songs(['rain'], limit=2)['rain']), 2)
+        self.assertEqual(lookup_keyword_songs(['rain'], limit=2, max_age=3600), {})
+        self.assertEqual([s['title'] for s in lookup_keyword_songs(['rain'], limit=1, max_age=3600)['rain']],
+                         ['Song 2'])
+
+    def answered(self, url):
+        future = Future()
+        future.set_result(url)
+        return future
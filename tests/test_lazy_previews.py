@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+os.environ['DATABASE_URL'] = 'postgresql:///imagime_test_db'
+
+from app import app, CURR_USER_KEY
+from models import db, User, Post, Song, PostSong, NO_PREVIEW
+from utils.recommendations import save_post_songs
+from utils.preview_cache import cache_previews
+from api_helpers import iter_keywords_to_songs
+
+
+def spotify_result(q, type='track', limit=3):
+    return {'tracks': {'items': [{
+        'id': f'song-{q}',
+        'name': f'Song {q}',
+        'artists': [{'name': 'Artist'}],
+        'album': {'name': 'Album', 'images': [{'url': 'https://test.com/album.jpg'}]},
+        'external_urls': {'spotify': f'https://test.com/spotify/{q}'}
+    }]}}
+
+
+class LazyPreviewTestCase(TestCase):
+    """Test saving songs without previews + resolving them on first play"""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        self.user = User.signup(username='user1', email='u1@test.com', password='password', profile_img=None)
+        db.session.commit()
+
+        self.post = Post(user_id=self.user.id, image='/static/test.png')
+        db.session.add(self.post)
+        db.session.commit()
+
+        save_post_songs(self.post, [{'title': 'Rainy Day', 'artist': 'Artist 1', 'image_url': None,
+                                     'spotify_url': 'https://test.com/song1', 'preview_url': None}])
+        db.session.commit()
+        self.song_id = Song.query.one().id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    @patch('api_helpers.get_preview_pool')
+    @patch('api_helpers.sp.search', side_effect=spotify_result)
+    def test_songs_come_without_node(self, mock_search, mock_pool):
+        """Test that resolve_previews=False never asks Node but still uses the preview cache"""
+
+        cache_previews({'song rain artist': 'https://test.com/cached.mp3'})
+
+        songs = list(iter_keywords_to_songs(['rain', 'snow'], resolve_previews=False))
+
+        mock_pool.assert_not_called()
+        self.assertEqual([(song['title'], song['preview_url']) for song in songs],
+                         [('Song rain', 'https://test.com/cached.mp3'), ('Song snow', None)])
+
+    def test_songs_keyed_by_spotify_url(self):
+        """Test that songs without previews stay separate + a later preview fills in the saved song"""
+
+        other = Post(user_id=self.user.id, image='/static/test2.png')
+        db.session.add(other)
+        db.session.commit()
+
+        save_post_songs(other, [{'title': 'City Lights', 'artist': 'Artist 2', 'image_url': None,
+                                     'spotify_url': 'https://test.com/song2', 'preview_url': None},
+                                    {'title': 'Rainy Day', 'artist': 'Artist 1', 'image_url': None,
+                                     'spotify_url': 'https://test.com/song1', 'preview_url': 'https://test.com/1.mp3'}])
+        db.session.commit()
+
+        self.assertEqual(Song.query.count(), 2)
+        self.assertEqual(PostSong.query.count(), 3)
+        self.assertEqual(Song.query.get(self.song_id).preview_url, 'https://test.com/1.mp3')
+
+    @patch('utils.recommendations.find_preview_url', return_value='https://test.com/1.mp3')
+    def test_preview_resolved_once(self, mock_node):
+        """Test that the first play looks the preview up + stores it, later plays read it"""
+
+        first = self.client.get(f'/songs/{self.song_id}/preview')
+        second = self.client.get(f'/songs/{self.song_id}/preview')
+
+        self.assertEqual(first.json, {'id': self.song_id, 'preview_url': 'https://test.com/1.mp3'})
+        self.assertEqual(second.json, first.json)
+        mock_node.assert_called_once_with('Rainy Day Artist 1')
+
+        db.session.expire_all()
+        self.assertEqual(Song.query.get(self.song_id).preview_url, 'https://test.com/1.mp3')
+
+    @patch('utils.recommendations.find_preview_url', return_value=None)
+    def test_missing_preview_stored(self, mock_node):
+        """Test that a song without a preview is marked so later plays don't ask Node again"""
+
+        first = self.client.get(f'/songs/{self.song_id}/preview')
+        second = self.client.get(f'/songs/{self.song_id}/preview')
+
+        self.assertEqual(first.json['preview_url'], None)
+        self.assertEqual(second.json['preview_url'], None)
+        mock_node.assert_called_once()
+
+        db.session.expire_all()
+        self.assertEqual(Song.query.get(self.song_id).preview_url, NO_PREVIEW)
+
+    def test_failed_lookup_retried(self):
+        """Test that a lookup that failed isn't stored, the next play asks again"""
+
+        with patch('utils.recommendations.find_preview_url', side_effect=TimeoutError('Node timed out')):
+            self.assertEqual(self.client.get(f'/songs/{self.song_id}/preview').json['preview_url'], None)
+
+        with patch('utils.recommendations.find_preview_url', return_value='https://test.com/1.mp3') as mock_node:
+            self.assertEqual(self.client.get(f'/songs/{self.song_id}/preview').json['preview_url'],
+                             'https://test.com/1.mp3')
+        mock_node.assert_called_once()
+
+    def test_no_lock_during_lookup(self):
+        """Test that the song row isn't locked (nor a transaction left open) while Node is asked"""
+
+        locked = []
+
+        def node(query):
+            with db.engine.connect() as conn:
+                locked.append(conn.execute(
+                    'SELECT id FROM songs WHERE id = %s FOR UPDATE NOWAIT', self.song_id).first() is None)
+            return 'https://test.com/1.mp3'
+
+        with patch('utils.recommendations.find_preview_url', side_effect=node):
+            self.client.get(f'/songs/{self.song_id}/preview')
+
+        self.assertEqual(locked, [False])
+
+    def test_unknown_song(self):
+        """Test that an unknown song is a JSON 404"""
+
+        response = self.client.get('/songs/9999/preview')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json, {'error': 'Song not found'})
+
+    def test_concurrent_clicks_single_flight(self):
+        """Test that clicks arriving while a lookup runs wait for it instead of asking Node again"""
+
+        calls = []
+
+        def slow_node(query):
+            calls.append(query)
+            time.sleep(0.3)
+            return 'https://test.com/1.mp3'
+
+        answers = []
+
+        def click():
+            answers.append(app.test_client().get(f'/songs/{self.song_id}/preview').json['preview_url'])
+
+        with patch('utils.recommendations.find_preview_url', side_effect=slow_node):
+            clicks = [threading.Thread(target=click) for _ in range(4)]
+            for thread in clicks:
+                thread.start()
+            for thread in clicks:
+                thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(answers, ['https://test.com/1.mp3'] * 4)
+
+    def test_player_markup(self):
+        """Test that a song without a preview renders an empty data-audio + its id for the lookup"""
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user.id
+
+        self.post.status = 'ready'
+        db.session.commit()
+
+        html = self.client.get(f'/posts/{self.post.id}').get_data(as_text=True)
+
+        self.assertIn(f'data-audio="" data-song-id="{self.song_id}"', html)
@@ -0,0 +1,219 @@
+import os
+import tempfile
+from unittest import TestCase
+from sqlalchemy import text
+
+os.environ['DATABASE_URL'] = 'postgresql:///imagime_test_db'
+
+from app import app
+from models import db, User, Post
+from utils.feed import home_feed
+from utils.migrations import (MIGRATIONS_DIR, migration_files, split_statements, statement_groups, pending_migrations,
+                              apply_migrations)
+
+# every secondary index the models declare
+MODEL_INDEXES = sorted(index.name for table in db.metadata.sorted_tables for index in table.indexes)
+
+# the tables of the first release, as db.create_all() made them
+BASELINE_SCHEMA = '''
+    CREATE TABLE songs (
+        id SERIAL PRIMARY KEY, title VARCHAR(255) NOT NULL, artist VARCHAR(255) NOT NULL,
+        image_url TEXT, spotify_url TEXT NOT NULL, preview_url TEXT);
+    CREATE TABLE users (
+        id SERIAL PRIMARY KEY, email VARCHAR NOT NULL UNIQUE, username VARCHAR NOT NULL UNIQUE,
+        bio TEXT, profile_img TEXT, password VARCHAR NOT NULL, favorites_public BOOLEAN);
+    CREATE TABLE follows (
+        id SERIAL PRIMARY KEY, follower_id INTEGER NOT NULL REFERENCES users (id),
+        followed_id INTEGER NOT NULL REFERENCES users (id), timestamp TIMESTAMP NOT NULL,
+        CONSTRAINT unique_follow UNIQUE (follower_id, followed_id));
+    CREATE TABLE posts (
+        id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id),
+        image VARCHAR(255) NOT NULL, description TEXT, timestamp TIMESTAMP);
+    CREATE TABLE favorited_songs (
+        id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id),
+        song_id INTEGER NOT NULL REFERENCES songs (id), post_id INTEGER REFERENCES posts (id) ON DELETE SET NULL,
+        timestamp TIMESTAMP NOT NULL);
+    CREATE TABLE postsongs (
+        id SERIAL PRIMARY KEY, post_id INTEGER NOT NULL REFERENCES posts (id),
+        song_id INTEGER NOT NULL REFERENCES songs (id), CONSTRAINT unique_post_song UNIQUE (post_id, song_id));
+'''
+
+
+class MigrationsTestCase(TestCase):
+    """Test applying the SQL migrations + that they match the models"""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.session.execute(text('DROP TABLE IF EXISTS schema_migrations'))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.execute(text('DROP TABLE IF EXISTS schema_migrations'))
+        db.session.commit()
+        db.session.remove()
+        self.ctx.pop()
+
+    def columns(self):
+        return sorted(db.session.execute(text('''
+            SELECT table_name, column_name, data_type, is_nullable FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name <> 'schema_migrations'
+        ''')))
+
+    def valid_indexes(self):
+        return {name for name, in db.session.execute(text('''
+            SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indisvalid AND c.relname LIKE 'ix_%'
+        '''))}
+
+    def test_split_statements(self):
+        """Test that comments are dropped + statements split on ';'"""
+
+        sql = '-- a comment; not a statement\nCREATE INDEX a ON t (x);\n\n-- another\nCREATE INDEX b\n    ON t (y);\n'
+
+        self.assertEqual(split_statements(sql), ['CREATE INDEX a ON t (x)', 'CREATE INDEX b\n    ON t (y)'])
+
+    def test_statement_groups(self):
+        """Test that runs of plain statements share a transaction + CONCURRENTLY ones run alone"""
+
+        statements = ['ALTER TABLE t ADD COLUMN x INT', 'UPDATE t SET x = 1',
+                      'CREATE UNIQUE INDEX CONCURRENTLY a ON t (x)', 'drop index concurrently b', 'DROP TABLE u']
+
+        self.assertEqual(statement_groups(statements), [
+            (True, statements[:2]), (False, statements[2:3]), (False, statements[3:4]), (True, statements[4:])
+        ])
+
+    def test_failed_migration_rolls_back(self):
+        """Test that a migration failing part way leaves the database as it was + unrecorded"""
+
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, '0001_broken.sql'), 'w') as f:
+                f.write("ALTER TABLE posts ADD COLUMN extra TEXT;\nUPDATE posts SET extra = 'x';\nSELECT no_such_function();\n")
+
+            with self.assertRaises(Exception):
+                apply_migrations(directory, report=lambda line: None)
+
+            self.assertNotIn('extra', {column for table, column, *rest in self.columns() if table == 'posts'})
+            self.assertEqual(pending_migrations(directory), ['0001_broken.sql'])
+
+    def test_index_pack_creates_missing_indexes(self):
+        """Test that a database without the indexes gets every one, once"""
+
+        for name in MODEL_INDEXES:
+            db.session.execute(text(f'DROP INDEX {name}'))
+        db.session.commit()
+        self.assertFalse(self.valid_indexes() & set(MODEL_INDEXES))
+
+        self.assertEqual(apply_migrations(report=lambda line: None), migration_files())
+        self.assertEqual(sorted(self.valid_indexes() & set(MODEL_INDEXES)), MODEL_INDEXES)
+
+        self.assertEqual(pending_migrations(), [])
+        self.assertEqual(apply_migrations(report=lambda line: None), [])
+
+    def test_no_op_on_new_database(self):
+        """Test that a database made by create_all already has everything the migrations add"""
+
+        before = self.valid_indexes()
+        apply_migrations(report=lambda line: None)
+
+        self.assertEqual(self.valid_indexes(), before)
+
+    def test_song_spotify_id_merges_copies(self):
+        """Test that songs saved twice before spotify_id are merged with their links, favorites + keyword counts"""
+
+        user = User.signup(username='user1', email='u1@test.com', password='password', profile_img=None)
+        db.session.commit()
+        post = Post(user_id=user.id, image='/static/test.png')
+        db.session.add(post)
+        db.session.commit()
+        user_id, post_id = user.id, post.id
+
+        # an older database : no spotify_id, the same track saved under two ids
+        db.session.execute(text('ALTER TABLE songs DROP COLUMN spotify_id'))
+        db.session.execute(text('''
+            INSERT INTO songs (id, title, artist, spotify_url) VALUES
+                (1, 'Rainy Day', 'Artist 1', 'https://open.spotify.com/track/abc'),
+                (2, 'Rainy Day', 'Artist 1', 'https://open.spotify.com/track/abc?si=x'),
+                (3, 'City Lights', 'Artist 2', 'https://open.spotify.com/track/def')
+        '''))
+        params = {'user_id': user_id, 'post_id': post_id}
+        db.session.execute(text('''
+            INSERT INTO postsongs (post_id, song_id) VALUES (:post_id, 2), (:post_id, 1), (:post_id, 3);
+            INSERT INTO favorited_songs (user_id, song_id, post_id, timestamp) VALUES (:user_id, 2, :post_id, now());
+            INSERT INTO post_keywords (post_id, keyword) VALUES (:post_id, 'rain');
+            INSERT INTO keyword_songs (keyword, song_id, post_count) VALUES ('rain', 1, 1), ('rain', 2, 1), ('rain', 3, 1);
+        '''), params)
+        db.session.commit()
+
+        apply_migrations(report=lambda line: None)
+
+        self.assertEqual(list(db.session.execute(text('SELECT id, spotify_id FROM songs ORDER BY id'))),
+                         [(1, 'abc'), (3, 'def')])
+        self.assertEqual([song_id for song_id, in db.session.execute(text('SELECT song_id FROM postsongs ORDER BY id'))],
+                         [1, 3])
+        self.assertEqual(db.session.execute(text('SELECT song_id FROM favorited_songs')).scalar(), 1)
+        self.assertEqual(list(db.session.execute(text('SELECT song_id, post_count FROM keyword_songs ORDER BY song_id'))),
+                         [(1, 1), (3, 1)])
+        self.assertIn('ix_songs_spotify_id', self.valid_indexes())
+
+    def test_baseline_database_migrates(self):
+        """Test that a database of the first release ends up with the schema + data the app expects"""
+
+        db.drop_all()
+        db.session.execute(text(BASELINE_SCHEMA))
+        db.session.execute(text('''
+            INSERT INTO users (username, email, password) VALUES ('user1', 'u1@test.com', 'pw'), ('user2', 'u2@test.com', 'pw');
+            INSERT INTO follows (follower_id, followed_id, timestamp) VALUES (1, 2, now());
+            INSERT INTO posts (user_id, image, timestamp) VALUES (2, '/static/a.png', '2024-01-01'), (2, '/static/b.png', NULL);
+            INSERT INTO songs (title, artist, spotify_url) VALUES ('Rainy Day', 'Artist 1', 'https://open.spotify.com/track/abc');
+            INSERT INTO postsongs (post_id, song_id) VALUES (1, 1);
+            INSERT INTO favorited_songs (user_id, song_id, post_id, timestamp) VALUES (1, 1, 1, now());
+        '''))
+        db.session.commit()
+
+        self.assertEqual(apply_migrations(report=lambda line: None), migration_files())
+
+        migrated = self.columns()
+        user1, user2 = User.query.get(1), User.query.get(2)
+        self.assertEqual((user1.post_count, user1.favorite_count, user1.following_count, user1.follower_count),
+                         (0, 1, 1, 0))
+        self.assertEqual((user2.post_count, user2.follower_count), (2, 1))
+        self.assertEqual({post.status for post in Post.query}, {'ready'})
+        self.assertEqual(Post.query.get(2).timestamp.isoformat(), '2024-01-01T00:00:00') # was NULL
+        self.assertEqual(sorted(self.valid_indexes() & set(MODEL_INDEXES)), MODEL_INDEXES)
+
+        # the home timeline was filled + the triggers work on the migrated tables
+        self.assertEqual([post.id for post in home_feed(user1).items], [2, 1]) # same time, newest id first
+        db.session.add(Post(user_id=1, image='/static/c.png'))
+        db.session.commit()
+        self.assertEqual(User.query.get(1).post_count, 1)
+        self.assertEqual(len(home_feed(User.query.get(1)).items), 3)
+
+        # same columns as a database made from the models
+        db.session.commit()
+        db.drop_all()
+        db.create_all()
+        self.assertEqual(migrated, self.columns())
+
+    def test_models_and_migrations_agree(self):
+        """Test that every index on the models is created by a migration"""
+
+        sql = ''
+        for name in migration_files():
+            with open(os.path.join(MIGRATIONS_DIR, name)) as f:
+                sql += f.read()
+
+        for name in MODEL_INDEXES:
+            self.assertIn(f'IF NOT EXISTS {name} ON', sql)
+
+    def test_cli_dry_run(self):
+        """Test that `flask migrate --dry-run` lists the pending migrations without applying them"""
+
+        result = app.test_cli_runner().invoke(args=['migrate', '--dry-run'])
+
+        self.assertIn('pending: 0001_index_pack.sql', result.output)
+        self.assertEqual(pending_migrations(), migration_files())
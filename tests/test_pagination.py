@@ -0,0 +1,197 @@
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+from sqlalchemy import event
+
+os.environ['DATABASE_URL'] = 'postgresql:///imagime_test_db'
+
+from app import app, CURR_USER_KEY
+from models import db, User, Post, Song, PostSong, FavoritedSong, Follow
+from utils.pagination import encode_cursor, decode_cursor, paginate
+from utils.jobs import work
+
+
+class CursorTestCase(TestCase):
+    """Test encoding + decoding page cursors"""
+
+    def test_round_trip(self):
+        """Test that a (timestamp, id) keyset comes back unchanged from its cursor"""
+
+        keyset = (datetime(2024, 5, 1, 12, 30, 15, 123456), 42)
+        cursor = encode_cursor(keyset)
+
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), keyset)
+        self.assertEqual(decode_cursor(encode_cursor([7])), (7,))
+
+    def test_malformed(self):
+        """Test that missing + tampered cursors mean 'first page' rather than an error"""
+
+        for cursor in (None, '', 'not a cursor', encode_cursor(['yesterday', 1]), encode_cursor([{'id': 1}]),
+                       encode_cursor([True])):
+            self.assertIsNone(decode_cursor(cursor), cursor)
+
+
+class PaginationTestCase(TestCase):
+    """Test keyset pages of the feed, user posts, favorites, the user directory + a post's songs"""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        self.user = User.signup(username='me', email='me@test.com', password='password', profile_img=None)
+        self.friend = User.signup(username='friend', email='friend@test.com', password='password', profile_img=None)
+        db.session.commit()
+        db.session.add(Follow(follower_id=self.user.id, followed_id=self.friend.id))
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user.id
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def add_posts(self, user, count, start=datetime(2024, 1, 1), step=timedelta(minutes=1)):
+        posts = [Post(user_id=user.id, image='/static/test.png', description=f'{user.username} {i}',
+                      timestamp=start + step * i) for i in range(count)]
+        db.session.add_all(posts)
+        db.session.commit()
+        work(burst=True) # fan them out to the followers' timelines
+        return posts
+
+    def walk(self, url):
+        """Follow next_url from a JSON page to the last one, returning every page's data"""
+
+        pages = []
+        while url:
+            data = self.client.get(url).get_json()
+            pages.append(data)
+            url = data['next_url']
+        return pages
+
+    def test_ties_not_skipped_or_repeated(self):
+        """Test that posts sharing a timestamp are all listed once, in (timestamp, id) order"""
+
+        posts = self.add_posts(self.user, 23, step=timedelta(0))  # all at the same moment
+        query = Post.query.filter(Post.user_id == self.user.id)
+
+        seen = []
+        cursor = None
+        while True:
+            page = paginate(query, (Post.timestamp, Post.id), cursor=cursor, per_page=5)
+            seen += [post.id for post in page.items]
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, sorted((post.id for post in posts), reverse=True))
+        self.assertEqual(len(page.items), 3)
+
+    def test_feed_pages(self):
+        """Test that the home feed goes on past the first page, newest first, without repeats"""
+
+        self.add_posts(self.user, 20)
+        self.add_posts(self.friend, 20, start=datetime(2024, 1, 1, 0, 0, 30))
+
+        html = self.client.get('/').get_data(as_text=True)
+        self.assertEqual(html.count('post-item'), 15)
+        self.assertIn('data-next="/?cursor=', html)
+
+        pages = self.walk('/?json=1')
+        descriptions = [post['description'] for page in pages for post in page['posts']]
+
+        self.assertEqual([len(page['posts']) for page in pages], [15, 15, 10])
+        self.assertEqual(len(set(descriptions)), 40)
+        self.assertEqual(descriptions[0], 'friend 19')
+        self.assertEqual(descriptions[-1], 'me 0')
+        self.assertEqual(pages[1]['html'].count('post-item'), 15)
+        self.assertIsNone(pages[-1]['next_cursor'])
+
+    def test_deep_page_seeks(self):
+        """Test that a deep page is one keyset query (no OFFSET), the same as the first"""
+
+        self.add_posts(self.friend, 100)
+        pages = self.walk(f'/users/{self.friend.id}/posts?json=1')
+        self.assertEqual(sum(len(page['posts']) for page in pages), 100)
+
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            self.client.get(pages[-2]['next_url'])
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        posts_queries = [statement for statement in statements if 'FROM posts' in statement]
+        self.assertEqual(len(posts_queries), 1)
+        self.assertNotIn('OFFSET', posts_queries[0])
+        self.assertIn('(posts.timestamp, posts.id) <', posts_queries[0])
+
+    def test_favorites_pages(self):
+        """Test that favorites page newest first, with their songs loaded in the same query"""
+
+        songs = [Song(title=f'Song {i}', artist='Artist', spotify_url=f'https://test.com/{i}') for i in range(25)]
+        db.session.add_all(songs)
+        db.session.commit()
+        db.session.add_all([FavoritedSong(user_id=self.user.id, song_id=song.id,
+                                          timestamp=datetime(2024, 1, 1) + timedelta(minutes=i))
+                            for i, song in enumerate(songs)])
+        db.session.commit()
+
+        html = self.client.get(f'/users/{self.user.id}/favorited').get_data(as_text=True)
+        self.assertEqual(html.count('custom-audio-item'), 20)
+
+        pages = self.walk(f'/users/{self.user.id}/favorited?json=1')
+        titles = [fave['title'] for page in pages for fave in page['favorites']]
+        self.assertEqual(titles, [f'Song {i}' for i in reversed(range(25))])
+        self.assertIn('Song 0', pages[-1]['html'])
+
+    def test_user_directory_keeps_search(self):
+        """Test that the user directory pages by id + keeps the search across pages"""
+
+        db.session.add_all([User(username=f'{prefix}{i}', email=f'{prefix}{i}@test.com', password='password')
+                            for prefix in ('cat', 'dog') for i in range(30)])
+        db.session.commit()
+
+        html = self.client.get('/users?q=cat').get_data(as_text=True)
+        self.assertEqual(html.count('user-list-card'), 24)
+        self.assertIn('q=cat', html)
+
+        pages = self.walk('/users?q=cat&json=1')
+        usernames = [user['username'] for page in pages for user in page['users']]
+        self.assertEqual(usernames, [f'cat{i}' for i in range(30)])
+
+    def test_post_songs_pages(self):
+        """Test that a post's songs page in the order they were found, after the last one shown"""
+
+        post = self.add_posts(self.user, 1)[0]
+        songs = [Song(title=f'Song {i}', artist='Artist', spotify_url=f'https://test.com/{i}') for i in range(12)]
+        db.session.add_all(songs)
+        db.session.flush()
+        db.session.add_all([PostSong(post_id=post.id, song_id=song.id) for song in songs])
+        db.session.commit()
+
+        html = self.client.get(f'/posts/{post.id}').get_data(as_text=True)
+        self.assertEqual(html.count('custom-audio-item'), 5)
+        self.assertIn(f'data-next="/posts/{post.id}?cursor=', html)
+
+        pages = self.walk(f'/posts/{post.id}?json=1')
+        self.assertEqual([song['title'] for page in pages for song in page['songs']], [f'Song {i}' for i in range(12)])
+        self.assertEqual([len(page['songs']) for page in pages], [5, 5, 2])
+
+    def test_cursor_of_another_list_ignored(self):
+        """Test that a cursor that doesn't fit the list starts it from the top"""
+
+        self.add_posts(self.user, 3)
+        user_cursor = encode_cursor([self.user.id])
+
+        data = self.client.get(f'/?json=1&cursor={user_cursor}').get_json()
+        self.assertEqual(len(data['posts']), 3)
@@ -178,8 +178,8 @@ class ModelTestCase(TestCase):
 
     ########################  Post Song Models #######################
 
-    @patch('blueprints.posts.routes.image_to_keywords')
-    @patch('blueprints.posts.routes.keywords_to_songs')
+    @patch('utils.recommendations.image_to_keywords')
+    @patch('utils.recommendations.iter_keywords_to_songs')
     def test_post_creation_with_mocked_apis(self, mock_keywords_to_songs, mock_image_to_keywords):
         """Test post creation with mocked API responses"""
 
@@ -1,9 +1,10 @@
 import os
+from datetime import datetime, timedelta
 from unittest import TestCase
 from unittest.mock import patch
 from app import g, app, CURR_USER_KEY
-from models import db, User, Post, Song, PostSong, FavoritedSong
-from api_helpers import image_to_keywords, keywords_to_songs
+from models import db, User, Post, Song, PostSong, FavoritedSong, Job
+from utils.jobs import work, JOB_MAX_ATTEMPTS
 
 os.environ['DATABASE_URL'] = "postgresql:///imagime_test_db"
 
@@ -91,7 +92,8 @@ class PostSongViewTestCase(TestCase):
     def image_post_setup(self, image_to_keywords_mock, keywords_to_songs_mock):
         """Helper method to set up mock responses for image posting tests"""
 
-        image_to_keywords_mock.return_value = ['keyword1', 'keyword2']
+        image_to_keywords_mock.return_value = [{'keyword': 'keyword1', 'score': 0.9},
+                                               {'keyword': 'keyword2', 'score': 0.8}]
         keywords_to_songs_mock.return_value = [{
             'title': 'Test Song 1',
             'artist': 'Artist 1',
@@ -112,8 +114,8 @@ class PostSongViewTestCase(TestCase):
             'preview_url': 'https://example.com/preview2.mp3'
         }]
 
-    @patch('blueprints.posts.routes.keywords_to_songs')
-    @patch('blueprints.posts.routes.image_to_keywords')
+    @patch('utils.recommendations.iter_keywords_to_songs')
+    @patch('utils.recommendations.image_to_keywords')
     def test_add_post_image_url(self, image_to_keywords_mock, keywords_to_songs_mock):
         """Test that a logged-in user can create a new image URL post and mock API response"""
 
@@ -134,13 +136,25 @@ class PostSongViewTestCase(TestCase):
             flash_messages = sess['_flashes']
             self.assertIn(('success', 'Post successfully added!'), flash_messages)
 
+        # post is saved right away, songs come from the background job
+        new_post = Post.query.filter_by(description='New test post').first()
+        self.assertEqual(new_post.status, 'pending')
+        image_to_keywords_mock.assert_not_called()
+
+        work(burst=True)
+
+        image_to_keywords_mock.assert_called_once()
+        self.assertEqual(image_to_keywords_mock.call_args[1]['image_url'],
+                         'https://fastly.picsum.photos/id/171/2048/1536.jpg?hmac=16eVtfmqTAEcr8VwTREQX4kV8dzZKcGWI5ouMlhRBuk')
+
         response = self.client.get(response.location, follow_redirects=True)
         self.assertEqual(response.status_code, 200)
         self.assertIn('New test post', str(response.data))
+        self.assertIn('Test Song 1', str(response.data))
 
 
-    @patch('blueprints.posts.routes.keywords_to_songs')
-    @patch('blueprints.posts.routes.image_to_keywords')
+    @patch('utils.recommendations.iter_keywords_to_songs')
+    @patch('utils.recommendations.image_to_keywords')
     def test_add_post_image_file(self, image_to_keywords_mock, keywords_to_songs_mock):
         """Test that a logged in user can post an image and mock API responses"""
 
@@ -165,6 +179,16 @@ class PostSongViewTestCase(TestCase):
             self.assertEqual(response.status_code, 200)
             self.assertIn('New test post with local image file', str(response.data))
 
+        work(burst=True)
+
+        # the worker analyzed the saved upload from disk
+        saved_file = image_to_keywords_mock.call_args[1]['local_image_file']
+        self.assertTrue(saved_file.endswith('test_image.jpg'))
+
+        new_post = Post.query.filter_by(description='New test post with local image file').first()
+        self.assertEqual(new_post.status, 'ready')
+        self.assertEqual(len(new_post.songs), 2)
+
 
     def test_display_post(self):
         """Test that a logged in user can view their posts as well as other users"""
@@ -339,8 +363,8 @@ class PostSongViewTestCase(TestCase):
         self.assertIn('Test Song 2', html)
 
 
-    @patch('blueprints.posts.routes.keywords_to_songs')
-    @patch('blueprints.posts.routes.image_to_keywords')
+    @patch('utils.recommendations.iter_keywords_to_songs')
+    @patch('utils.recommendations.image_to_keywords')
     def test_unique_post_song_association(self, image_to_keywords_mock, keywords_to_songs_mock):
         """Test that a song cannot be associated with the same post more than once."""
 
@@ -355,6 +379,8 @@ class PostSongViewTestCase(TestCase):
             'description': "Test post with duplicate songs"
         }, follow_redirects=True)
 
+        work(burst=True)
+
         # fetch the post from the database
         new_post = Post.query.filter_by(description='Test post with duplicate songs').first()
         self.assertIsNotNone(new_post)
@@ -364,3 +390,115 @@ class PostSongViewTestCase(TestCase):
 
         self.assertEqual(len(unique_songs), 2)  # There should be only 2 unique songs, not 3
         self.assertEqual(len(new_post.songs), 2)  # Should only count unique songs
+
+    ################ Background Recommendation Jobs ######################
+
+    def test_pending_post_progress(self):
+        """Test that a pending post renders its pending state + reports progress as JSON"""
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1.id
+
+        post = Post(user_id=self.u1.id, image='/static/test3.png', description='Pending post', status='pending')
+        db.session.add(post)
+        db.session.flush()
+        db.session.add(Job(kind='recommend_songs', payload={'post_id': post.id},
+                           post_id=post.id, stage='Finding songs', progress=40))
+        db.session.commit()
+
+        response = self.client.get(f'/posts/{post.id}')
+        self.assertIn('id="post-pending"', response.get_data(as_text=True))
+
+        response = self.client.get(f'/posts/{post.id}?json=1')
+        self.assertEqual(response.json['status'], 'pending')
+        self.assertEqual(response.json['progress'], {'stage': 'Finding songs', 'percent': 40})
+        self.assertEqual(response.json['songs'], [])
+
+    @patch('utils.recommendations.iter_keywords_to_songs')
+    @patch('utils.recommendations.image_to_keywords')
+    def test_failing_job_marks_post_failed(self, image_to_keywords_mock, keywords_to_songs_mock):
+        """Test that a job is retried + the post is marked failed once it runs out of attempts"""
+
+        image_to_keywords_mock.side_effect = RuntimeError('Everypixel is down')
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1.id
+
+        self.client.post('/posts/new', data={
+            'image_url': 'https://test.com/test_image.jpg',
+            'description': 'Post with failing job'
+        })
+
+        work(burst=True)
+
+        post = Post.query.filter_by(description='Post with failing job').first()
+        job = Job.query.filter_by(post_id=post.id).first()
+
+        self.assertEqual(post.status, 'failed')
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.attempts, 3)
+        self.assertIn('Everypixel is down', job.error)
+        keywords_to_songs_mock.assert_not_called()
+
+    @patch('utils.recommendations.image_to_keywords')
+    def test_stale_job_out_of_attempts_fails(self, image_to_keywords_mock):
+        """Test that a job whose worker died is claimed again only while it has attempts left"""
+
+        long_ago = datetime.now() - timedelta(hours=1)
+        posts = [Post(user_id=self.u1.id, image='/static/test3.png', status='pending') for _ in range(2)]
+        db.session.add_all(posts)
+        db.session.flush()
+        crashed, retried = [Job(kind='recommend_songs', payload={'post_id': post.id}, post_id=post.id,
+                                status='running', attempts=attempts, updated_at=long_ago)
+                            for post, attempts in zip(posts, (JOB_MAX_ATTEMPTS, 1))]
+        db.session.add_all([crashed, retried])
+        db.session.commit()
+
+        image_to_keywords_mock.return_value = []
+        work(burst=True)
+
+        self.assertEqual(image_to_keywords_mock.call_count, 1) # only the job with attempts left ran
+        self.assertEqual((crashed.status, crashed.attempts), ('failed', JOB_MAX_ATTEMPTS))
+        self.assertIn('Worker stopped', crashed.error)
+        self.assertEqual(Post.query.get(posts[0].id).status, 'failed')
+        self.assertEqual((retried.status, retried.attempts), ('done', 2))
+        self.assertEqual(Post.query.get(posts[1].id).status, 'ready')
+
+    def test_stream_post_songs(self):
+        """Test that the song stream pushes every song of a post then a done event"""
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u2.id
+
+        response = self.client.get(f'/posts/{self.p2.id}/stream')
+        body = response.get_data(as_text=True)
+
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertTrue(body.startswith('retry: 2000\n\n')) # the browser reconnects once a stream ends
+        self.assertIn('event: song', body)
+        self.assertIn('"title": "Test Song 2"', body)
+        self.assertTrue(body.endswith('event: done\ndata: {"status": "ready"}\n\n'))
+
+    @patch('blueprints.posts.routes.SSE_MAX_DURATION', 0)
+    def test_stream_pending_post(self):
+        """Test that a pending post streams the songs saved so far + job progress"""
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1.id
+
+        Post.query.get(self.p1.id).status = 'pending'
+        db.session.add(Job(kind='recommend_songs', payload={'post_id': self.p1.id},
+                           post_id=self.p1.id, stage='Finding songs', progress=50))
+        db.session.commit()
+
+        response = self.client.get(f'/posts/{self.p1.id}/stream')
+        body = response.get_data(as_text=True)
+
+        self.assertIn('"title": "Test Song 1"', body)
+        self.assertIn('event: progress\ndata: {"stage": "Finding songs"}', body)
+        self.assertNotIn('event: done', body)
+
+        # a reconnect resumes after the last song received
+        link_id = PostSong.query.filter_by(post_id=self.p1.id).first().id
+        response = self.client.get(f'/posts/{self.p1.id}/stream', headers={'Last-Event-ID': str(link_id)})
+        self.assertNotIn('event: song', response.get_data(as_text=True))
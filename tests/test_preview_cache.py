@@ -0,0 +1,93 @@
+import os
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import patch
+
+os.environ['DATABASE_URL'] = 'postgresql:///imagime_test_db'
+
+from app import app
+from models import db, Song, CachedPreview
+from utils.preview_cache import (preview_cache_key, get_cached_previews, cache_previews,
+                                 seed_preview_cache, preview_cache_stats)
+from api_helpers import get_preview_urls_from_node
+
+
+class PreviewCacheTestCase(TestCase):
+    """Test the persistent preview URL cache"""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def test_cache_key(self):
+        """Test that keys are normalized"""
+
+        self.assertEqual(preview_cache_key('  Rainy   Day ARTIST 1 '), 'rainy day artist 1')
+
+    def test_positive_and_negative_entries(self):
+        """Test that found + not found previews are both cached"""
+
+        cache_previews({'rainy day artist 1': 'https://test.com/preview1.mp3',
+                        'no preview artist 2': None})
+
+        cached = get_cached_previews(['rainy day artist 1', 'no preview artist 2', 'unknown'])
+
+        self.assertEqual(cached, {'rainy day artist 1': 'https://test.com/preview1.mp3',
+                                  'no preview artist 2': None})
+
+        negative = CachedPreview.query.get('no preview artist 2')
+        positive = CachedPreview.query.get('rainy day artist 1')
+        self.assertLess(negative.expires_at, positive.expires_at)
+
+    def test_expired_entries_miss(self):
+        """Test that expired entries are treated as misses"""
+
+        db.session.add(CachedPreview(key='old song', preview_url='https://test.com/old.mp3',
+                                     expires_at=datetime.utcnow() - timedelta(minutes=1)))
+        db.session.commit()
+
+        self.assertEqual(get_cached_previews(['old song']), {})
+
+    def test_seed_from_songs(self):
+        """Test that preview URLs saved on songs seed the cache"""
+
+        db.session.add_all([
+            Song(title='Test Song 1', artist='Test Artist 1', spotify_url='https://test.com/song1',
+                 preview_url='https://test.com/preview1.mp3'),
+            Song(title='Test Song 2', artist='Test Artist 2', spotify_url='https://test.com/song2')
+        ])
+        db.session.commit()
+
+        self.assertEqual(seed_preview_cache(), 1)
+        self.assertEqual(get_cached_previews(['test song 1 test artist 1']),
+                         {'test song 1 test artist 1': 'https://test.com/preview1.mp3'})
+
+    def test_lookups_use_cache_first(self):
+        """Test that cached previews skip Node + fresh answers are stored"""
+
+        cache_previews({'cached song artist': 'https://test.com/cached.mp3'})
+
+        with patch('api_helpers.get_preview_pool') as mock_pool:
+            mock_pool.return_value.submit.side_effect = self.fake_lookup
+            hits_before = preview_cache_stats()['hits']
+
+            urls = get_preview_urls_from_node(['Cached Song Artist', 'Fresh Song Artist'])
+
+        self.assertEqual(urls, ['https://test.com/cached.mp3', 'https://test.com/fresh.mp3'])
+        mock_pool.return_value.submit.assert_called_once_with('Fresh Song Artist')
+        self.assertEqual(preview_cache_stats()['hits'], hits_before + 1)
+        self.assertIsNotNone(CachedPreview.query.get('fresh song artist'))
+
+    def fake_lookup(self, query):
+        future = Future()
+        future.set_result('https://test.com/fresh.mp3')
+        return future
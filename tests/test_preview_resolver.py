@@ -0,0 +1,60 @@
+import sys
+from unittest import TestCase
+from utils.preview_resolver import PreviewResolverPool
+
+# stand-in for `node get_preview.js --server` speaking the same JSON-lines protocol
+FAKE_WORKER = '''
+import json, sys, time
+for line in sys.stdin:
+    request = json.loads(line)
+    query = request['query']
+    if query == 'crash':
+        sys.exit(1)
+    if query == 'slow':
+        time.sleep(5)
+    if query == 'missing':
+        urls = []
+    else:
+        urls = ['https://test.com/' + query.replace(' ', '-') + '.mp3']
+    print(json.dumps({'id': request['id'], 'previewUrls': urls}), flush=True)
+'''
+
+class PreviewResolverPoolTestCase(TestCase):
+    """Test the pool of long-running preview workers"""
+
+    def setUp(self):
+        self.pool = PreviewResolverPool([sys.executable, '-c', FAKE_WORKER], size=2, timeout=1)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_resolve_many(self):
+        """Test that many queries resolve in order through the same workers"""
+
+        urls = self.pool.resolve_many(['Rainy Day Artist 1', 'City Lights Artist 2', 'missing'])
+
+        self.assertEqual(urls, ['https://test.com/Rainy-Day-Artist-1.mp3',
+                                'https://test.com/City-Lights-Artist-2.mp3',
+                                None])
+
+        # the same processes answer the next batch
+        processes = [worker.process for worker in self.pool.workers]
+        self.pool.resolve_many(['Song Artist'])
+        self.assertEqual(processes, [worker.process for worker in self.pool.workers])
+
+    def test_worker_restarts_after_crash(self):
+        """Test that a crashed worker fails its requests and is restarted on the next one"""
+
+        self.assertEqual(self.pool.resolve_many(['crash']), [None])
+
+        urls = self.pool.resolve_many(['after crash', 'and again'])
+
+        self.assertEqual(urls, ['https://test.com/after-crash.mp3', 'https://test.com/and-again.mp3'])
+        self.assertGreaterEqual(self.pool.restarts, 1)
+
+    def test_request_timeout(self):
+        """Test that a slow lookup times out without blocking the other workers"""
+
+        urls = self.pool.resolve_many(['slow', 'fast'])
+
+        self.assertEqual(urls, [None, 'https://test.com/fast.mp3'])
@@ -0,0 +1,88 @@
+import os
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = 'postgresql:///imagime_test_db'
+
+from app import app, CURR_USER_KEY
+from models import db, User, Post, Song, PostSong, FavoritedSong, Follow
+from bench.query_plans import PlanChecker, seq_scans
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class QueryPlansTestCase(TestCase):
+    """Test the query plan checker + that the main routes use indexes"""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        self.user = User.signup(username='user1', email='u1@test.com', password='password', profile_img=None)
+        self.other = User.signup(username='user2', email='u2@test.com', password='password', profile_img=None)
+        self.song = Song(title='Rainy Day', artist='Artist 1', spotify_url='https://test.com/song1')
+        db.session.add(self.song)
+        db.session.commit()
+
+        self.post = Post(user_id=self.other.id, image='/static/test.png', description='rain')
+        db.session.add(self.post)
+        db.session.add(Follow(follower_id=self.user.id, followed_id=self.other.id))
+        db.session.flush()
+        db.session.add(PostSong(post_id=self.post.id, song_id=self.song.id))
+        db.session.add(FavoritedSong(user_id=self.user.id, song_id=self.song.id, post_id=self.post.id))
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user.id
+
+        self.checker = PlanChecker(db.engine)
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def test_seq_scans(self):
+        """Test that Seq Scans are found anywhere in a plan, on the listed tables only"""
+
+        plan = {'Node Type': 'Nested Loop', 'Plans': [
+            {'Node Type': 'Seq Scan', 'Relation Name': 'posts'},
+            {'Node Type': 'Index Scan', 'Relation Name': 'users', 'Plans': [
+                {'Node Type': 'Seq Scan', 'Relation Name': 'tiny_table'}]}]}
+
+        self.assertEqual(seq_scans(plan), ['posts'])
+        self.assertEqual(seq_scans(plan, tables=('posts', 'tiny_table')), ['posts', 'tiny_table'])
+
+    def test_flags_unindexed_lookups_in_requests(self):
+        """Test that only statements sent during a request are checked + unindexed ones flagged"""
+
+        with self.checker:
+            Song.query.filter_by(title='Rainy Day').all() # outside a request : not checked
+
+            with app.test_request_context():
+                Song.query.filter_by(title='Rainy Day').all()
+                Song.query.filter_by(spotify_url='https://test.com/song1').all()
+
+        self.assertEqual(len(self.checker.plans), 2)
+        self.assertEqual([(scanned, statement.count('songs.title =')) for statement, scanned, test in self.checker.flagged],
+                         [(['songs'], 1)])
+
+    def test_routes_use_indexes(self):
+        """Test that browsing, favoriting + deleting a post never scans a large table"""
+
+        with self.checker:
+            for url in ('/', f'/users/{self.other.id}/posts', '/users', '/users?q=user',
+                        f'/users/{self.user.id}/favorited', f'/posts/{self.post.id}', f'/users/{self.other.id}'):
+                self.assertEqual(self.client.get(url).status_code, 200, url)
+
+            self.client.post(f'/posts/{self.post.id}/songs/{self.song.id}/favorite')
+
+            with self.client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.other.id
+            self.client.post(f'/posts/{self.post.id}/delete')
+
+        self.assertGreater(len(self.checker.plans), 10)
+        self.assertEqual(self.checker.flagged, [])
@@ -0,0 +1,188 @@
+import time
+from concurrent.futures import Future
+from unittest import TestCase
+from unittest.mock import patch, Mock
+from utils.resilience import Deadline, DeadlineExceeded, CircuitBreaker, CircuitOpen
+from utils.search_cache import SearchCache, CachedSpotify
+from api_helpers import iter_keywords_to_songs
+
+
+def make_track(title, artist='Artist'):
+    return {
+        'id': title,
+        'name': title,
+        'artists': [{'name': artist}],
+        'album': {'name': f'{title} Album', 'images': [{'url': f'https://test.com/{title}.jpg'}]},
+        'external_urls': {'spotify': f'https://test.com/{title}'}
+    }
+
+def fake_search(q, type='track', limit=10, market=None):
+    return {'tracks': {'items': [make_track(f'Song {q}')]}}
+
+
+class DeadlineTestCase(TestCase):
+    """Test the pipeline time budget"""
+
+    def test_stage_share(self):
+        """Test that a stage gets its share of the total, never past the overall end"""
+
+        deadline = Deadline(10)
+        self.assertAlmostEqual(deadline.stage(0.3).remaining(), 3, places=1)
+
+        deadline.ends_at = time.monotonic() + 1 # most of the budget is used up
+        self.assertLessEqual(deadline.stage(0.3).remaining(), 1)
+
+    def test_check(self):
+        """Test that an expired deadline raises"""
+
+        deadline = Deadline(0)
+
+        self.assertTrue(deadline.expired)
+        with self.assertRaises(DeadlineExceeded):
+            deadline.check()
+
+
+class CircuitBreakerTestCase(TestCase):
+    """Test opening, half opening + closing a circuit breaker"""
+
+    def setUp(self):
+        self.breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=0.05)
+
+    def fail(self):
+        with self.assertRaises(ValueError):
+            with self.breaker:
+                raise ValueError('upstream down')
+
+    def test_opens_after_threshold(self):
+        """Test that consecutive failures open the circuit + calls are rejected"""
+
+        self.fail()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.fail()
+        self.assertEqual(self.breaker.state, 'open')
+
+        with self.assertRaises(CircuitOpen):
+            with self.breaker:
+                pass
+
+        self.assertEqual(self.breaker.snapshot(),
+                         {'state': 'open', 'failures': 2, 'trips': 1, 'rejected': 1})
+
+    def test_half_open_trial(self):
+        """Test that one trial call goes through after the reset timeout"""
+
+        self.fail()
+        self.fail()
+        time.sleep(0.06)
+
+        self.assertTrue(self.breaker.allow()) # the trial
+        self.assertFalse(self.breaker.allow()) # everyone else waits for it
+        self.breaker.record_success()
+
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_trial_reopens(self):
+        """Test that a failing trial call re-opens the circuit"""
+
+        self.fail()
+        self.fail()
+        time.sleep(0.06)
+
+        self.fail()
+
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertEqual(self.breaker.trips, 2)
+
+    def test_cached_search_while_open(self):
+        """Test that cached searches are still answered while Spotify's circuit is open"""
+
+        client = Mock()
+        client.search.side_effect = fake_search
+        sp = CachedSpotify(client, SearchCache(maxsize=10, ttl=60), breaker=self.breaker)
+
+        sp.search(q='rain', limit=3)
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+        self.assertEqual(sp.search(q='rain', limit=3)['tracks']['items'][0]['name'], 'Song rain')
+        with self.assertRaises(CircuitOpen):
+            sp.search(q='snow', limit=3)
+        self.assertEqual(client.search.call_count, 1)
+
+
+@patch('api_helpers.cache_enabled', lambda: False)
+@patch('api_helpers.sp.search')
+class PipelineDegradationTestCase(TestCase):
+    """Test that the song pipeline skips failing stages instead of waiting on them"""
+
+    def test_preview_breaker_open(self, mock_search):
+        """Test that songs come back without previews, without asking Node, while its circuit is open"""
+
+        mock_search.side_effect = fake_search
+        breaker = CircuitBreaker('node_preview')
+        breaker.state, breaker.opened_at = 'open', time.monotonic()
+        pool = Mock()
+
+        with patch('api_helpers.preview_breaker', breaker), patch('api_helpers.get_preview_pool', return_value=pool):
+            songs = list(iter_keywords_to_songs(['rain', 'snow']))
+
+        self.assertEqual([song['title'] for song in songs], ['Song rain', 'Song snow'])
+        self.assertEqual([song['preview_url'] for song in songs], [None, None])
+        pool.submit.assert_not_called()
+
+    def test_slow_previews_cut_at_deadline(self, mock_search):
+        """Test that previews still pending at the deadline are dropped, not waited for"""
+
+        mock_search.side_effect = fake_search
+        pool = Mock(submit=Mock(side_effect=lambda query: Future())) # never answers
+
+        start = time.monotonic()
+        with patch('api_helpers.get_preview_pool', return_value=pool):
+            songs = list(iter_keywords_to_songs(['rain'], deadline=Deadline(0.2)))
+
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(songs[0]['title'], 'Song rain')
+        self.assertIsNone(songs[0]['preview_url'])
+
+    def test_slow_search_skipped(self, mock_search):
+        """Test that a search still running after the search budget is skipped"""
+
+        def search(q, type, limit):
+            if q == 'slow':
+                time.sleep(1)
+            return fake_search(q, type, limit)
+
+        mock_search.side_effect = search
+        pool = Mock(submit=Mock(side_effect=self.answered))
+
+        start = time.monotonic()
+        with patch('api_helpers.get_preview_pool', return_value=pool):
+            songs = list(iter_keywords_to_songs(['rain', 'slow', 'snow'], deadline=Deadline(1)))
+
+        self.assertLess(time.monotonic() - start, 0.8)
+        self.assertEqual([song['title'] for song in songs], ['Song rain', 'Song snow'])
+
+    def test_failed_search_skipped(self, mock_search):
+        """Test that one failing keyword doesn't sink the rest, but all failing raises"""
+
+        def search(q, type, limit):
+            if q == 'broken':
+                raise CircuitOpen('Circuit spotify_search is open')
+            return fake_search(q, type, limit)
+
+        mock_search.side_effect = search
+        pool = Mock(submit=Mock(side_effect=self.answered))
+
+        with patch('api_helpers.get_preview_pool', return_value=pool):
+            songs = list(iter_keywords_to_songs(['rain', 'broken']))
+
+            with self.assertRaises(CircuitOpen):
+                list(iter_keywords_to_songs(['broken']))
+
+        self.assertEqual([song['title'] for song in songs], ['Song rain'])
+
+    def answered(self, query):
+        future = Future()
+        future.set_result(f'https://test.com/{query}.mp3')
+        return future
@@ -0,0 +1,86 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from unittest.mock import Mock
+from utils.search_cache import LRUCache, SearchCache, CachedSpotify
+
+
+class SearchCacheTestCase(TestCase):
+    """Test the Spotify search result cache"""
+
+    def setUp(self):
+        self.client = Mock()
+        self.client.search.side_effect = lambda q, **kwargs: {'tracks': {'items': [{'name': q}]}}
+        self.sp = CachedSpotify(self.client, SearchCache(maxsize=2, ttl=60))
+
+    def test_repeat_searches_hit_cache(self):
+        """Test that the same keyword only reaches Spotify once"""
+
+        first = self.sp.search(q='sky', type='track', limit=3)
+        second = self.sp.search(q='Sky ', type='track', limit=3)
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.client.search.call_count, 1)
+        self.assertEqual(self.sp.cache.stats['local_hits'], 1)
+
+    def test_stats_from_threads(self):
+        """Test that hits + misses counted from many threads at once are all kept"""
+
+        cache = SearchCache(maxsize=10, ttl=60)
+        cache.set('sky', 1)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda n: (cache.get('sky'), cache.get(f'city{n}')), range(4000)))
+
+        self.assertEqual(cache.stats, {'local_hits': 4000, 'shared_hits': 0, 'misses': 4000})
+
+    def test_key_includes_limit_and_market(self):
+        """Test that entries are keyed by (keyword, limit, market)"""
+
+        self.sp.search(q='sky', type='track', limit=3)
+        self.sp.search(q='sky', type='track', limit=5)
+        self.sp.search(q='sky', type='track', limit=3, market='US')
+
+        self.assertEqual(self.client.search.call_count, 3)
+
+    def test_lru_eviction(self):
+        """Test that the least recently used keyword is evicted first"""
+
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set('sky', 1)
+        cache.set('city', 2)
+        cache.get('sky')
+        cache.set('nature', 3)
+
+        self.assertEqual(cache.get('sky'), 1)
+        self.assertIsNone(cache.get('city'))
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl_expiry(self):
+        """Test that entries expire after their TTL"""
+
+        cache = LRUCache(maxsize=2, ttl=0.01)
+        cache.set('sky', 1)
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get('sky'))
+
+    def test_shared_layer(self):
+        """Test that a hit in the shared layer fills the local layer"""
+
+        shared = {}
+        cache = SearchCache(maxsize=2, ttl=60)
+        cache.shared = Mock(get=Mock(side_effect=shared.get),
+                            setex=Mock(side_effect=lambda key, ttl, value: shared.__setitem__(key, value)))
+
+        # another worker already searched this keyword
+        other_worker = CachedSpotify(self.client, cache)
+        other_worker.search(q='sky', type='track', limit=3)
+        cache.local.clear()
+
+        result = CachedSpotify(self.client, cache).search(q='sky', type='track', limit=3)
+
+        self.assertEqual(result, json.loads(list(shared.values())[0]))
+        self.assertEqual(self.client.search.call_count, 1)
+        self.assertEqual(cache.stats['shared_hits'], 1)
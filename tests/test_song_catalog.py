@@ -0,0 +1,142 @@
+import os
+from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import event
+
+os.environ['DATABASE_URL'] = 'postgresql:///imagime_test_db'
+
+from app import app
+from models import db, User, Post, Song, PostSong, NO_PREVIEW, spotify_track_id
+from utils.song_catalog import upsert_songs, link_post_songs
+from utils.recommendations import save_post_songs, queue_recommendations
+from utils.jobs import work
+
+
+def make_song(n, preview_url=None):
+    return {'title': f'Song {n}', 'artist': 'Artist', 'image_url': None,
+            'spotify_url': f'https://open.spotify.com/track/track{n}?si=abc', 'preview_url': preview_url}
+
+
+class SongCatalogTestCase(TestCase):
+    """Test saving songs keyed on their Spotify track id"""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        self.user = User.signup(username='user1', email='u1@test.com', password='password', profile_img=None)
+        db.session.commit()
+
+        self.post = Post(user_id=self.user.id, image='/static/test.png')
+        db.session.add(self.post)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def test_spotify_track_id(self):
+        """Test that the track id is the end of the URL, without query or trailing slash"""
+
+        self.assertEqual(spotify_track_id('https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC?si=x1'),
+                         '4uLU6hMCjMI75M1A2tKUQC')
+        self.assertEqual(spotify_track_id('https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC/'),
+                         '4uLU6hMCjMI75M1A2tKUQC')
+        self.assertEqual(Song(title='t', artist='a', spotify_url='https://test.com/song1').spotify_id, None)
+
+        song = Song(title='t', artist='a', spotify_url='https://test.com/song1')
+        db.session.add(song)
+        db.session.commit()
+        self.assertEqual(song.spotify_id, 'song1')
+
+    def test_upsert_songs(self):
+        """Test that saved songs are reused, repeats get one id + a missing preview is filled in"""
+
+        first = upsert_songs([make_song(1), make_song(2, 'https://test.com/2.mp3')])
+        db.session.commit()
+
+        ids = upsert_songs([make_song(3), make_song(1, 'https://test.com/1.mp3'), make_song(2, 'https://test.com/new.mp3'),
+                            dict(make_song(3), spotify_id='track3')])
+        db.session.commit()
+
+        self.assertEqual(ids[1:3], first)
+        self.assertEqual(ids[0], ids[3])
+        self.assertEqual(Song.query.count(), 3)
+        self.assertEqual(Song.query.get(first[0]).preview_url, 'https://test.com/1.mp3')
+        self.assertEqual(Song.query.get(first[1]).preview_url, 'https://test.com/2.mp3') # kept
+
+    def test_upsert_fills_missing_preview_marker(self):
+        """Test that a song marked as having no preview takes a preview a later batch found, and keeps the mark otherwise"""
+
+        first, second = upsert_songs([make_song(1, NO_PREVIEW), make_song(2, NO_PREVIEW)])
+        db.session.commit()
+
+        upsert_songs([make_song(1, 'https://test.com/1.mp3'), make_song(2)])
+        db.session.commit()
+
+        self.assertEqual(Song.query.get(first).preview_url, 'https://test.com/1.mp3')
+        self.assertEqual(Song.query.get(second).preview_url, NO_PREVIEW)
+
+    def test_link_post_songs(self):
+        """Test that links keep the songs' order + songs the post already has are skipped"""
+
+        ids = upsert_songs([make_song(n) for n in range(1, 4)])
+
+        self.assertEqual(link_post_songs(self.post.id, [ids[1], ids[0]]), [ids[1], ids[0]])
+        self.assertEqual(link_post_songs(self.post.id, [ids[0], ids[2], ids[2]]), [ids[2]])
+        db.session.commit()
+
+        self.assertEqual([link.song_id for link in PostSong.query.order_by(PostSong.id)], [ids[1], ids[0], ids[2]])
+
+    def test_save_post_songs_statements(self):
+        """Test that saving a post's songs takes the same few statements for 1 or 10 songs"""
+
+        post = Post.query.get(self.post.id)
+        counts = []
+
+        for songs in ([make_song(1)], [make_song(n) for n in range(2, 12)]):
+            statements = []
+            def record(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                save_post_songs(post, songs)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+            counts.append(len(statements))
+
+        db.session.commit()
+
+        # songs upsert, postsongs insert, keyword index
+        self.assertEqual(counts, [3, 3])
+        self.assertEqual(PostSong.query.filter_by(post_id=self.post.id).count(), 11)
+
+    @patch('utils.recommendations.LAZY_PREVIEWS', True)
+    @patch('utils.recommendations.iter_keywords_to_songs', return_value=iter([make_song(n) for n in range(1, 6)]))
+    @patch('utils.recommendations.image_to_keywords', return_value=[{'keyword': 'rain', 'score': 0.9}])
+    def test_job_saves_songs_in_one_batch(self, mock_keywords, mock_songs):
+        """Test that the recommendation job saves a post's songs with one upsert + one link when previews are lazy"""
+
+        queue_recommendations(self.post, image_url='https://test.com/rain.jpg')
+        db.session.commit()
+
+        statements = []
+        def record(conn, cursor, statement, *args):
+            if statement.startswith('INSERT INTO songs') or statement.startswith('INSERT INTO postsongs'):
+                statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            work(burst=True)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(PostSong.query.filter_by(post_id=self.post.id).count(), 5)
+        self.assertEqual(Post.query.get(self.post.id).status, 'ready')
@@ -0,0 +1,62 @@
+from unittest import TestCase
+from utils.song_ranking import keyword_weights, candidate_matrix, score_candidates, rank_songs
+
+
+def song(title, popularity=None):
+    return {'title': title, 'artist': 'Artist', 'popularity': popularity}
+
+
+class SongRankingTestCase(TestCase):
+    """Test scoring + picking the top songs from every keyword's results"""
+
+    def test_keyword_weights(self):
+        """Test that Everypixel scores are used as is and missing ones decay with rank"""
+
+        self.assertEqual(list(keyword_weights([0.9, None, 0.4])), [0.9, 0.95, 0.4])
+        self.assertEqual(list(keyword_weights([None] * 3)), [1.0, 0.95, 0.9])
+
+    def test_candidate_matrix(self):
+        """Test that candidates are deduped across keywords + hits keep each song's best position"""
+
+        candidates, hits, popularity = candidate_matrix([[song('A', 80), song('B')],
+                                                         [song('B'), song('C', 10), song('B')]])
+
+        self.assertEqual([c['title'] for c in candidates], ['A', 'B', 'C'])
+        self.assertEqual(hits.tolist(), [[1.0, 0.0],
+                                         [1 / 1.5, 1.0],
+                                         [0.0, 1 / 1.5]])
+        self.assertEqual(popularity.tolist(), [80, 50, 10]) # unknown counts as average
+
+    def test_keyword_scores_drive_relevance(self):
+        """Test that songs found by the more confident keyword win"""
+
+        results = [[song('Rain song')], [song('Sky song')]]
+
+        self.assertEqual([s['title'] for s in rank_songs(results, [0.6, 0.9], 2)], ['Sky song', 'Rain song'])
+        self.assertEqual([s['title'] for s in rank_songs(results, [0.9, 0.6], 2)], ['Rain song', 'Sky song'])
+
+    def test_cross_keyword_hits(self):
+        """Test that a song several keywords agree on beats a single keyword's top result"""
+
+        results = [[song('Only rain'), song('Both')], [song('Only sky'), song('Both')]]
+
+        self.assertEqual(rank_songs(results, [0.9, 0.9], 1)[0]['title'], 'Both')
+
+    def test_popularity_breaks_close_calls(self):
+        """Test that popularity separates otherwise equal songs, ties keep search order"""
+
+        results = [[song('Obscure', 5)], [song('Hit', 95)], [song('Same', 5)]]
+
+        self.assertEqual([s['title'] for s in rank_songs(results, [0.9, 0.9, 0.9], 3)], ['Hit', 'Obscure', 'Same'])
+
+    def test_top_k(self):
+        """Test that only k songs come back and empty results give nothing"""
+
+        results = [[song(f'Song {i} {j}') for j in range(3)] for i in range(10)]
+
+        self.assertEqual(len(rank_songs(results, [None] * 10, 10)), 10)
+        self.assertEqual(rank_songs([[], []], [0.9, 0.8], 10), [])
+        self.assertEqual(rank_songs([], [], 10), [])
+
+        candidates, hits, popularity = candidate_matrix(results)
+        self.assertEqual(score_candidates(hits, keyword_weights([None] * 10), popularity).shape, (30,))
@@ -0,0 +1,147 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import MagicMock
+from stubs.common import StubBehavior
+from stubs.spotify import SpotifyStub
+from utils.search_cache import SearchCache, CachedSpotify
+from utils.spotify_token import SharedTokenCache, SharedClientCredentials
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# one "worker" : asks for a token through the shared cache file + prints it
+WORKER = """
+import sys
+from utils.spotify_token import SharedTokenCache, SharedClientCredentials
+auth = SharedClientCredentials('id', 'secret', cache_handler=SharedTokenCache(sys.argv[1]))
+auth.OAUTH_TOKEN_URL = sys.argv[2]
+print(auth.get_access_token(as_dict=False))
+"""
+
+
+class SharedTokenTestCase(TestCase):
+    """Test sharing one Spotify token between threads + processes"""
+
+    def setUp(self):
+        self.spotify = SpotifyStub(behavior=StubBehavior('uniform:20:40', seed=1)).start()
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'token.json')
+
+    def tearDown(self):
+        self.spotify.stop()
+        self.dir.cleanup()
+
+    def credentials(self):
+        auth = SharedClientCredentials('id', 'secret', cache_handler=SharedTokenCache(self.path))
+        auth.OAUTH_TOKEN_URL = self.spotify.token_url
+        return auth
+
+    def save_token(self, expires_in):
+        with open(self.path, 'w') as file:
+            json.dump({'access_token': 'old-token', 'token_type': 'Bearer', 'expires_in': 3600,
+                       'expires_at': int(time.time()) + expires_in}, file)
+
+    def test_worker_processes_share_one_token(self):
+        """Test that workers starting together fetch a single token between them"""
+
+        workers = [subprocess.Popen([sys.executable, '-c', WORKER, self.path, self.spotify.token_url],
+                                    cwd=ROOT, stdout=subprocess.PIPE, text=True) for _ in range(4)]
+        tokens = [worker.communicate(timeout=30)[0].strip() for worker in workers]
+
+        self.assertEqual(tokens, [SpotifyStub.token] * 4)
+        self.assertEqual(self.spotify.stats['tokens'], 1)
+
+        # a restarted worker reads it instead of asking again
+        self.assertEqual(self.credentials().get_access_token(as_dict=False), SpotifyStub.token)
+        self.assertEqual(self.spotify.stats['tokens'], 1)
+
+    def test_threads_share_one_token(self):
+        """Test that concurrent first searches in one process wait for a single fetch"""
+
+        auth = self.credentials()
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(auth.get_access_token(as_dict=False)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(tokens, [SpotifyStub.token] * 8)
+        self.assertEqual(self.spotify.stats['tokens'], 1)
+
+    def test_refresh_before_expiry(self):
+        """Test that a token close to expiry is replaced, a fresh one is used as is"""
+
+        self.save_token(expires_in=3000)
+        self.assertEqual(self.credentials().get_access_token(as_dict=False), 'old-token')
+        self.assertEqual(self.spotify.stats['tokens'], 0)
+
+        self.save_token(expires_in=120)
+        self.assertEqual(self.credentials().get_access_token(as_dict=False), SpotifyStub.token)
+        self.assertEqual(self.spotify.stats['tokens'], 1)
+
+        with open(self.path) as file:
+            self.assertEqual(json.load(file)['access_token'], SpotifyStub.token)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_failed_refresh_keeps_valid_token(self):
+        """Test that a failed early refresh falls back to the old token, an expired one raises"""
+
+        self.spotify.stop()
+
+        self.save_token(expires_in=120)
+        self.assertEqual(self.credentials().get_access_token(as_dict=False), 'old-token')
+
+        self.save_token(expires_in=10)
+        with self.assertRaises(Exception):
+            self.credentials().get_access_token(as_dict=False)
+
+    def test_unreadable_cache(self):
+        """Test that a corrupt cache file means fetching a new token"""
+
+        with open(self.path, 'w') as file:
+            file.write('not json')
+
+        self.assertEqual(self.credentials().get_access_token(as_dict=False), SpotifyStub.token)
+
+
+class LazySpotifyTestCase(TestCase):
+    """Test that the Spotify client isn't built until the first search"""
+
+    def test_client_built_on_first_use(self):
+        """Test that the factory runs once, on the first search"""
+
+        client = MagicMock()
+        client.search.return_value = {'tracks': {'items': []}}
+        factory = MagicMock(return_value=client)
+
+        sp = CachedSpotify(None, SearchCache(maxsize=0), client_factory=factory)
+        self.assertFalse(factory.called)
+
+        sp.search(q='sky', type='track', limit=3)
+        sp.search(q='sea', type='track', limit=3)
+
+        factory.assert_called_once_with()
+        self.assertEqual(client.search.call_count, 2)
+
+    def test_starts_without_credentials(self):
+        """Test that api_helpers imports without Spotify credentials, the error waits for a search"""
+
+        env = {k: v for k, v in os.environ.items() if k not in ('SPOT_CLIENT_ID', 'SPOT_API_KEY')}
+        script = ("import api_helpers\n"
+                  "try:\n"
+                  "    api_helpers.sp.search(q='sky', type='track', limit=3)\n"
+                  "except Exception as e:\n"
+                  "    print(type(e).__name__)\n")
+
+        result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, env=env,
+                                capture_output=True, text=True, timeout=60)
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), 'SpotifyOauthError')
@@ -0,0 +1,131 @@
+import sys
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from spotipy.cache_handler import MemoryCacheHandler
+from stubs.common import StubBehavior, parse_latency
+from stubs.catalog import Catalog
+from stubs.everypixel import EverypixelStub
+from stubs.spotify import SpotifyStub
+from utils.everypixel import EverypixelClient
+from utils.preview_resolver import PreviewResolverPool
+from utils.search_cache import SearchCache, CachedSpotify
+from utils.song_ranking import rank_songs
+from api_helpers import spotify_client, image_to_keywords, keywords_to_songs, track_to_song
+
+
+class StubBehaviorTestCase(TestCase):
+    """Test the seeded latency + error behaviour of the stand-ins"""
+
+    def test_latency_specs(self):
+        """Test that every latency distribution parses + stays in range"""
+
+        import random
+        rng = random.Random(1)
+
+        self.assertEqual(parse_latency('fixed:100')(rng), 0.1)
+        self.assertTrue(0.05 <= parse_latency('uniform:50:250')(rng) <= 0.25)
+        self.assertGreaterEqual(parse_latency('normal:10:50')(rng), 0)
+        self.assertGreater(parse_latency('lognormal:120:0.5')(rng), 0)
+
+        with self.assertRaises(ValueError):
+            parse_latency('pareto:1')
+
+    def test_draws_are_reproducible(self):
+        """Test that the same seed gives the same latencies + errors for the same requests"""
+
+        first = StubBehavior('lognormal:100:0.5', error_rate=0.3, seed=4)
+        second = StubBehavior('lognormal:100:0.5', error_rate=0.3, seed=4)
+
+        draws = [first.draw(f'q{n % 5}') for n in range(50)]
+        self.assertEqual(draws, [second.draw(f'q{n % 5}') for n in range(50)])
+
+        failures = sum(fail for _, fail in draws)
+        self.assertTrue(5 <= failures <= 25)
+
+    def test_catalog_is_seeded(self):
+        """Test that catalogs, searches + image keywords only depend on the seed"""
+
+        self.assertEqual(Catalog(seed=3).search('rain', limit=5), Catalog(seed=3).search('rain', limit=5))
+        self.assertNotEqual(Catalog(seed=3).search('rain', limit=5), Catalog(seed=4).search('rain', limit=5))
+        self.assertTrue(all('rain' in track['tags'] for track in Catalog(seed=3).search('rain', limit=5)))
+        self.assertEqual(Catalog().image_keywords('https://test.com/a.jpg', 5),
+                         Catalog().image_keywords('https://test.com/a.jpg', 5))
+
+
+@patch('api_helpers.cache_enabled', lambda: False)
+class OfflinePipelineTestCase(TestCase):
+    """Test the whole image -> keywords -> songs -> previews chain against the stand-ins"""
+
+    def setUp(self):
+        self.catalog = Catalog(seed=1)
+        self.everypixel = EverypixelStub(behavior=StubBehavior('uniform:1:5', seed=1), catalog=self.catalog).start()
+        self.spotify = SpotifyStub(behavior=StubBehavior('uniform:1:5', seed=1), catalog=self.catalog).start()
+        self.pool = PreviewResolverPool([sys.executable, '-m', 'stubs.preview_worker', '--seed', '1',
+                                         '--latency', 'uniform:1:5'], size=1, timeout=5)
+
+        client = spotify_client(self.spotify.api_url, self.spotify.token_url, cache_handler=MemoryCacheHandler(),
+                                client_id=self.spotify.client_id, client_secret=self.spotify.client_secret)
+        self.sp = CachedSpotify(client, SearchCache(maxsize=0))
+        self.client = EverypixelClient('id', 'key', base_url=self.everypixel.url)
+
+    def tearDown(self):
+        self.pool.close()
+        self.client.close()
+        self.everypixel.stop()
+        self.spotify.stop()
+
+    def test_offline_pipeline(self):
+        """Test that keywords, songs + previews all come from the stand-ins"""
+
+        with patch('api_helpers.everypixel', self.client), patch('api_helpers.sp', self.sp), \
+             patch('api_helpers.get_preview_pool', return_value=self.pool):
+            scored = image_to_keywords(image_url='https://test.com/beach.jpg', num_keywords=4, with_scores=True)
+            keywords = [k['keyword'] for k in scored]
+            songs = keywords_to_songs(keywords, scores=[k['score'] for k in scored])
+
+        self.assertEqual(self.catalog.image_keywords('https://test.com/beach.jpg', 4), scored)
+        self.assertEqual(self.spotify.stats['tokens'], 1) # concurrent first searches share one token
+        self.assertEqual(self.spotify.stats['searches'], 4)
+        self.assertEqual(len(songs), 10)
+
+        # the stand-in's own catalog, ranked the same way, gives the same songs in the same order
+        results = [[track_to_song(self.catalog.spotify_track(track)) for track in self.catalog.search(keyword, limit=3)]
+                   for keyword in keywords]
+        expected = rank_songs(results, [k['score'] for k in scored], 10)
+        self.assertEqual([(song['title'], song['artist']) for song in songs],
+                         [(song['title'], song['artist']) for song in expected])
+
+        best = self.catalog.by_id[expected[0]['spotify_url'].rsplit('/', 1)[-1]]
+        self.assertEqual(songs[0]['preview_url'], best['preview_url'])
+
+    def test_error_rate(self):
+        """Test that stand-in errors surface like upstream errors"""
+
+        failing = EverypixelStub(behavior=StubBehavior(error_rate=1.0)).start()
+        client = EverypixelClient('id', 'key', base_url=failing.url, max_retries=1, backoff=0.01)
+
+        try:
+            response = client.keywords(image_url='https://test.com/a.jpg')
+        finally:
+            client.close()
+            failing.stop()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(failing.stats['errors'], 2)
+
+    def test_latency_applied(self):
+        """Test that the configured latency is added to each request"""
+
+        slow = EverypixelStub(behavior=StubBehavior('fixed:100')).start()
+        client = EverypixelClient('id', 'key', base_url=slow.url)
+
+        try:
+            start = time.perf_counter()
+            client.keywords(image_url='https://test.com/a.jpg')
+            elapsed = time.perf_counter() - start
+        finally:
+            client.close()
+            slow.stop()
+
+        self.assertGreaterEqual(elapsed, 0.1)
@@ -0,0 +1,254 @@
+import os
+import random
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import text
+
+os.environ['DATABASE_URL'] = 'postgresql:///imagime_test_db'
+
+from app import app, CURR_USER_KEY
+from models import (db, User, Post, Follow, Job, TimelineEntry, TimelineSetting, TIMELINE_LENGTH, FANOUT_MAX_FOLLOWERS,
+                    BACKFILL_AUTHOR_JOB)
+from utils.feed import home_feed, live_feed
+from utils.timeline import rebuild_timelines, sync_timeline_settings
+from utils.jobs import work
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TimelineTestCase(TestCase):
+    """Test fanning posts out to timelines + reading the home feed from them"""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        self.me = self.make_user('me')
+        self.friend = self.make_user('friend')
+        self.stranger = self.make_user('stranger')
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.me.id
+
+        self.client.post(f'/users/follow/{self.friend.id}')
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def make_user(self, username):
+        user = User(username=username, email=f'{username}@test.com', password='password')
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    def add_posts(self, user, count, start=datetime(2024, 1, 1), fan_out=True):
+        """
+        count posts by user a minute apart, in one INSERT (the triggers still run per post)
+        + run the fan-out jobs they queued, as `flask worker` would
+
+        """
+
+        db.session.execute(text('''
+            INSERT INTO posts (user_id, image, description, timestamp)
+            SELECT :user_id, '/static/test.png', :username || ' ' || i, :start + i * interval '1 minute'
+            FROM generate_series(0, :count - 1) i
+        '''), {'user_id': user.id, 'username': user.username, 'start': start, 'count': count})
+        db.session.commit()
+
+        if fan_out:
+            work(burst=True)
+
+    def timeline(self, user):
+        return [entry.post_id for entry in TimelineEntry.query.filter_by(user_id=user.id)
+                .order_by(TimelineEntry.post_timestamp.desc(), TimelineEntry.post_id.desc())]
+
+    def feed_ids(self, user, feed=home_feed, limit=15):
+        """Every post id of user's feed, walking page by page"""
+
+        db.session.expire_all()
+        user = User.query.get(user.id)
+
+        ids, cursor = [], None
+        while True:
+            page = feed(user, cursor=cursor, limit=limit)
+            ids += [post.id for post in page.items]
+            cursor = page.next_cursor
+            if cursor is None:
+                return ids
+
+    def test_fan_out(self):
+        """Test that a post lands on its author's + followers' timelines only"""
+
+        self.add_posts(self.friend, 2)
+        post_ids = [post.id for post in Post.query.order_by(Post.timestamp.desc())]
+
+        self.assertEqual(self.timeline(self.me), post_ids)
+        self.assertEqual(self.timeline(self.friend), post_ids)
+        self.assertEqual(self.timeline(self.stranger), [])
+
+    def test_fan_out_runs_in_a_job(self):
+        """Test that the post's transaction only reaches the author's timeline + queues one job for the rest"""
+
+        self.add_posts(self.friend, 2, fan_out=False)
+        self.add_posts(self.stranger, 1, fan_out=False) # no followers, no job
+
+        self.assertEqual(len(self.timeline(self.friend)), 2)
+        self.assertEqual(self.timeline(self.me), [])
+        self.assertEqual([job.payload for job in Job.query.order_by(Job.id)],
+                         [{'post_id': post.id} for post in Post.query.filter_by(user_id=self.friend.id).order_by(Post.id)])
+
+        self.assertEqual(work(burst=True), 2)
+        self.assertEqual(len(self.timeline(self.me)), 2)
+        self.assertEqual({job.status for job in Job.query}, {'done'})
+
+    def test_follow_backfills_unfollow_retracts(self):
+        """Test that following brings the author's posts in + unfollowing takes them out again"""
+
+        self.add_posts(self.stranger, 3)
+        self.add_posts(self.friend, 1)
+        self.assertEqual(len(self.timeline(self.me)), 1)
+
+        self.client.post(f'/users/follow/{self.stranger.id}')
+        self.assertEqual(len(self.timeline(self.me)), 4)
+
+        self.client.post(f'/users/unfollow/{self.stranger.id}')
+        self.assertEqual({entry.author_id for entry in TimelineEntry.query.filter_by(user_id=self.me.id)},
+                         {self.friend.id})
+
+    def test_deleted_post_leaves_timelines(self):
+        """Test that deleting a post (or its author) removes it from every timeline"""
+
+        self.add_posts(self.friend, 2)
+        post = Post.query.filter_by(user_id=self.friend.id).first()
+
+        db.session.delete(post)
+        db.session.commit()
+        self.assertEqual(len(self.timeline(self.me)), 1)
+
+        db.session.delete(self.friend)
+        db.session.commit()
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+    def test_trimmed_timeline_falls_back(self):
+        """Test that timelines stay bounded + the feed reads past them from posts"""
+
+        self.add_posts(self.friend, TIMELINE_LENGTH + 20)
+        self.add_posts(self.me, 5, start=datetime(2023, 12, 1))
+
+        self.assertEqual(len(self.timeline(self.me)), TIMELINE_LENGTH)
+        self.assertIsNotNone(User.query.get(self.me.id).timeline_horizon)
+
+        ids = self.feed_ids(self.me, limit=50)
+        self.assertEqual(len(ids), TIMELINE_LENGTH + 25)
+        self.assertEqual(ids, self.feed_ids(self.me, feed=live_feed, limit=50))
+
+        # following someone whose posts are all older than the horizon adds nothing to the timeline
+        self.add_posts(self.stranger, 3, start=datetime(2023, 1, 1))
+        self.client.post(f'/users/follow/{self.stranger.id}')
+        self.assertEqual(len(self.timeline(self.me)), TIMELINE_LENGTH)
+        self.assertEqual(len(self.feed_ids(self.me, limit=50)), TIMELINE_LENGTH + 28)
+
+    def test_popular_authors_read_at_query_time(self):
+        """Test that authors over the fan-out cap skip their followers' timelines but stay in their feeds"""
+
+        db.session.execute(text('UPDATE users SET follower_count = :count WHERE id = :id'),
+                           {'count': FANOUT_MAX_FOLLOWERS + 1, 'id': self.friend.id})
+        db.session.commit()
+
+        self.add_posts(self.friend, 3)
+        self.add_posts(self.me, 2, start=datetime(2024, 1, 1, 0, 0, 30))
+
+        self.assertEqual(len(self.timeline(self.me)), 2) # only my own posts
+        self.assertEqual(len(self.timeline(self.friend)), 3)
+        self.assertEqual(len(self.feed_ids(self.me)), 5)
+
+    def set_setting(self, name, value):
+        TimelineSetting.query.filter_by(name=name).update({'value': value})
+        db.session.commit()
+
+    def test_settings_read_when_triggers_run(self):
+        """Test that changed settings apply to the triggers + the feed without reinstalling anything"""
+
+        self.set_setting('length', 5)
+        self.add_posts(self.friend, 8)
+        self.assertEqual(len(self.timeline(self.me)), 5)
+
+        # friend (1 follower) is now over the cap : read at query time
+        self.set_setting('fanout_max_followers', 0)
+        self.add_posts(self.friend, 2, start=datetime(2024, 2, 1))
+        self.assertEqual(len(self.timeline(self.me)), 5)
+        self.assertEqual(len(self.feed_ids(self.me, limit=4)), 10)
+
+    def test_author_back_under_cap_backfilled(self):
+        """Test that an unfollow bringing an author back under the cap puts their posts on the timelines"""
+
+        self.set_setting('fanout_max_followers', 1)
+        db.session.add(Follow(follower_id=self.stranger.id, followed_id=self.friend.id))
+        db.session.commit()
+
+        self.add_posts(self.friend, 3)
+        self.assertEqual(self.timeline(self.me), [])
+        self.assertEqual(len(self.feed_ids(self.me)), 3)
+
+        db.session.delete(Follow.query.filter_by(follower_id=self.stranger.id).one())
+        db.session.commit()
+        self.assertEqual(Job.query.filter_by(kind=BACKFILL_AUTHOR_JOB).count(), 1)
+
+        work(burst=True)
+        self.assertEqual(len(self.timeline(self.me)), 3)
+        self.assertEqual(self.feed_ids(self.me), self.feed_ids(self.me, feed=live_feed))
+
+    def test_sync_settings(self):
+        """Test that syncing applies the env values + backfills the authors a raised cap brings under it"""
+
+        self.set_setting('fanout_max_followers', 0)
+        self.add_posts(self.friend, 2)
+        self.assertEqual(self.timeline(self.me), [])
+
+        self.assertEqual(sync_timeline_settings(), {'fanout_max_followers': (0, FANOUT_MAX_FOLLOWERS)})
+        self.assertEqual(sync_timeline_settings(), {})
+
+        work(burst=True)
+        self.assertEqual(len(self.timeline(self.me)), 2)
+
+        with patch('utils.timeline.TIMELINE_LENGTH', 50):
+            self.assertEqual(sync_timeline_settings(), {'length': (TIMELINE_LENGTH, 50)})
+        self.assertEqual(TimelineSetting.query.get('length').value, 50)
+
+    def test_matches_live_feed(self):
+        """Test that the timeline feed pages exactly like the query time feed on a random graph"""
+
+        rng = random.Random(0)
+        users = [self.make_user(f'user{i}') for i in range(12)]
+
+        for user in users:
+            for other in rng.sample(users, 4):
+                if other.id != user.id:
+                    db.session.add(Follow(follower_id=user.id, followed_id=other.id))
+        db.session.commit()
+
+        for user in users:
+            self.add_posts(user, rng.randint(0, 30), start=datetime(2024, 1, rng.randint(1, 20)))
+
+        for user in users:
+            self.assertEqual(self.feed_ids(user), self.feed_ids(user, feed=live_feed))
+
+    def test_rebuild(self):
+        """Test that rebuilding refills timelines exactly as the triggers left them"""
+
+        self.add_posts(self.friend, 4)
+        self.add_posts(self.stranger, 2)
+        before = {user.id: self.timeline(user) for user in (self.me, self.friend, self.stranger)}
+
+        db.session.execute(text('DELETE FROM timeline_entries'))
+        db.session.commit()
+
+        self.assertEqual(rebuild_timelines(batch_size=2), 3)
+        self.assertEqual({user.id: self.timeline(user) for user in (self.me, self.friend, self.stranger)}, before)
@@ -0,0 +1,152 @@
+import os
+from unittest import TestCase
+from sqlalchemy import event, text
+
+os.environ['DATABASE_URL'] = 'postgresql:///imagime_test_db'
+
+from app import app, CURR_USER_KEY
+from models import db, User, Post, Song, PostSong
+from utils.user_counters import drifted_counters, reconcile_counters
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class UserCountersTestCase(TestCase):
+    """Test the post, favorite + follow counters on users"""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        self.u1 = User.signup(username='user1', email='u1@test.com', password='password', profile_img=None)
+        self.u2 = User.signup(username='user2', email='u2@test.com', password='password', profile_img=None)
+        self.song = Song(title='Rainy Day', artist='Artist 1', spotify_url='https://test.com/song1')
+        db.session.add(self.song)
+        db.session.commit()
+
+        self.client = app.test_client()
+        self.login(self.u1)
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def login(self, user):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user.id
+
+    def counts(self, user):
+        db.session.expire_all()
+        user = User.query.get(user.id)
+        return (user.post_count, user.favorite_count, user.following_count, user.follower_count)
+
+    def add_post(self, user):
+        post = Post(user_id=user.id, image='/static/test.png')
+        db.session.add(post)
+        db.session.flush()
+        db.session.add(PostSong(post_id=post.id, song_id=self.song.id))
+        db.session.commit()
+        return post
+
+    def test_follow_unfollow(self):
+        """Test that following + unfollowing move both users' counters"""
+
+        self.client.post(f'/users/follow/{self.u2.id}')
+        self.assertEqual(self.counts(self.u1), (0, 0, 1, 0))
+        self.assertEqual(self.counts(self.u2), (0, 0, 0, 1))
+
+        self.client.post(f'/users/unfollow/{self.u2.id}')
+        self.assertEqual(self.counts(self.u1), (0, 0, 0, 0))
+        self.assertEqual(self.counts(self.u2), (0, 0, 0, 0))
+
+    def test_posts_and_favorites(self):
+        """Test that posting, favoriting, unfavoriting + deleting a post keep the counters right"""
+
+        post = self.add_post(self.u1)
+        self.assertEqual(self.counts(self.u1), (1, 0, 0, 0))
+
+        # favorite is a toggle
+        self.client.post(f'/posts/{post.id}/songs/{self.song.id}/favorite')
+        self.assertEqual(self.counts(self.u1), (1, 1, 0, 0))
+        self.client.post(f'/posts/{post.id}/songs/{self.song.id}/favorite')
+        self.assertEqual(self.counts(self.u1), (1, 0, 0, 0))
+
+        self.client.post(f'/posts/{post.id}/songs/{self.song.id}/favorite')
+        self.client.post(f'/favorites/{self.song.id}/remove')
+        self.assertEqual(self.counts(self.u1), (1, 0, 0, 0))
+
+        # another user's favorite of the post's song outlives the post
+        self.login(self.u2)
+        self.client.post(f'/posts/{post.id}/songs/{self.song.id}/favorite')
+        self.login(self.u1)
+        self.client.post(f'/posts/{post.id}/delete')
+
+        self.assertEqual(self.counts(self.u1), (0, 0, 0, 0))
+        self.assertEqual(self.counts(self.u2), (0, 1, 0, 0))
+
+    def test_deleted_user_leaves_followers_right(self):
+        """Test that deleting an account updates the counters of users it followed + was followed by"""
+
+        self.add_post(self.u1)
+        self.client.post(f'/users/follow/{self.u2.id}')
+        self.login(self.u2)
+        self.client.post(f'/users/follow/{self.u1.id}')
+        self.assertEqual(self.counts(self.u2), (0, 0, 1, 1))
+
+        self.login(self.u1)
+        self.client.post(f'/users/{self.u1.id}', data={'_method': 'DELETE'})
+
+        self.assertIsNone(User.query.get(self.u1.id))
+        self.assertEqual(self.counts(self.u2), (0, 0, 0, 0))
+
+    def test_raw_sql_writes_counted(self):
+        """Test that writes that skip the ORM (bulk SQL) are counted too"""
+
+        db.session.execute(text("INSERT INTO posts (user_id, image, status) VALUES (:u, 'a', 'ready'), (:u, 'b', 'ready')"),
+                           {'u': self.u2.id})
+        db.session.commit()
+
+        self.assertEqual(self.counts(self.u2), (2, 0, 0, 0))
+
+    def test_reconcile(self):
+        """Test that drifted counters are reported, repaired + left alone once right"""
+
+        self.add_post(self.u1)
+        self.client.post(f'/users/follow/{self.u2.id}')
+        db.session.execute(text('UPDATE users SET post_count = 7, follower_count = 3 WHERE id = :id'), {'id': self.u1.id})
+        db.session.commit()
+
+        drift = drifted_counters()
+        self.assertEqual(drift, {self.u1.id: {'post_count': (7, 1), 'follower_count': (3, 0)}})
+
+        self.assertEqual(reconcile_counters(), drift)
+        self.assertEqual(self.counts(self.u1), (1, 0, 1, 0))
+        self.assertEqual(reconcile_counters(), {})
+
+    def test_pages_show_counters_without_loading_collections(self):
+        """Test that /users + profiles render the counters without reading posts, favorites or follows"""
+
+        for _ in range(3):
+            self.add_post(self.u2)
+        self.client.post(f'/users/follow/{self.u2.id}')
+
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            profile = self.client.get(f'/users/{self.u2.id}').get_data(as_text=True)
+            self.client.get('/users')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertIn(f'/users/{self.u2.id}/posts">3</a>', profile)
+        self.assertIn(f'/users/{self.u2.id}/followers">1</a>', profile)
+        # the profile's latest posts are the only posts read
+        self.assertEqual(sum('FROM posts' in statement for statement in statements), 1)
+        self.assertFalse(any('FROM favorited_songs' in statement for statement in statements))
@@ -0,0 +1,227 @@
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from werkzeug.utils import secure_filename
+from models import db, Post
+from api_helpers import image_to_keywords, keywords_to_songs, PIPELINE_BUDGET
+from utils.recommendations import save_post_songs
+from utils.keyword_index import record_post_keywords
+from utils.image_hash import hash_post_image, to_signed
+from utils.resilience import Deadline
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+
+
+class RateLimiter:
+    """
+    Spaces calls out to `rate` per second across every process sharing it
+    The next free slot lives in shared memory, so it can be handed to pool processes
+
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = multiprocessing.get_context('spawn').Value('d', 0.0, lock=False)
+        self.lock = multiprocessing.get_context('spawn').Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_slot.value)
+            self.next_slot.value = slot + self.interval
+
+        time.sleep(max(0, slot - now))
+
+
+def load_sources(directory=None, manifest=None):
+    """
+    Images to import, from a directory of image files or a manifest of URLs
+    Manifest lines are `<image url> [description]`, blank + # lines are skipped
+
+    """
+
+    sources = []
+
+    if directory:
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                sources.append({'source': os.path.abspath(path), 'image_file': os.path.abspath(path)})
+
+    if manifest:
+        with open(manifest) as file:
+            for line in file:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                url, _, description = line.partition(' ')
+                sources.append({'source': url, 'image_url': url, 'description': description.strip() or None})
+
+    return sources
+
+def load_done(state_file):
+    """Sources a previous run already imported"""
+
+    if not state_file or not os.path.exists(state_file):
+        return set()
+
+    with open(state_file) as file:
+        return {json.loads(line)['source'] for line in file if line.strip()}
+
+def mark_done(state_file, entries):
+    """Append imported sources to the state file (only after their batch committed)"""
+
+    if not state_file:
+        return
+
+    with open(state_file, 'a') as file:
+        for entry in entries:
+            file.write(json.dumps(entry) + '\n')
+
+
+_limiter = None
+
+def _init_worker(limiter):
+    global _limiter
+    _limiter = limiter
+
+def analyze_image(item):
+    """
+    Run one image through Everypixel + Spotify (in a pool process, no DB access)
+    Errors are returned, not raised, so one bad image doesn't stop the import
+
+    """
+
+    if _limiter is not None:
+        _limiter.acquire()
+
+    start = time.perf_counter()
+
+    try:
+        deadline = Deadline(PIPELINE_BUDGET)
+        keywords = image_to_keywords(image_url=item.get('image_url'),
+                                     local_image_file=item.get('image_file'),
+                                     deadline=deadline)
+        songs = keywords_to_songs(keywords, deadline=deadline) if keywords else []
+        image_hash = hash_post_image(item['image_file']) if item.get('image_file') else None
+        return {**item, 'keywords': keywords or [], 'songs': songs, 'image_hash': image_hash, 'error': None,
+                'seconds': time.perf_counter() - start}
+
+    except Exception as e:
+        return {**item, 'keywords': [], 'songs': [], 'error': str(e),
+                'seconds': time.perf_counter() - start}
+
+def write_batch(user_id, results, upload_folder):
+    """
+    Save a batch of analyzed images as posts + songs in one transaction
+    Returns [{'source', 'post_id'}] for the state file
+
+    """
+
+    saved = []
+
+    for result in results:
+        if result.get('image_file'):
+            # same place + URL the web form uses for uploads
+            filename = secure_filename(os.path.basename(result['image_file']))
+            shutil.copyfile(result['image_file'], os.path.join(upload_folder, filename))
+            image = f'/static/images/uploads/{filename}'
+        else:
+            image = result['image_url']
+
+        image_hash = result.get('image_hash')
+        post = Post(user_id=user_id, image=image, description=result.get('description'),
+                    image_hash=to_signed(image_hash) if image_hash is not None else None)
+        db.session.add(post)
+        db.session.flush() # make sure post.id exists
+
+        record_post_keywords(post.id, result['keywords'])
+        save_post_songs(post, result['songs'])
+        saved.append({'source': result['source'], 'post_id': post.id})
+
+    db.session.commit()
+
+    return saved
+
+def import_images(user_id, sources, upload_folder, state_file=None, processes=4, rate=2.0,
+                  batch_size=20, report=print):
+    """
+    Import many images for one user
+    Images are analyzed in a process pool under a global rate limit (images / second),
+    posts are written in batched transactions, finished sources are recorded in the
+    state file so an interrupted import picks up where it stopped
+
+    processes=0 analyzes in this process (no pool)
+
+    """
+
+    done = load_done(state_file)
+    todo = [item for item in sources if item['source'] not in done]
+
+    stats = {'total': len(sources), 'skipped': len(sources) - len(todo), 'imported': 0,
+             'failed': 0, 'songs': 0, 'seconds': 0.0}
+    start = time.perf_counter()
+    batch = []
+
+    def flush():
+        if not batch:
+            return
+
+        try:
+            saved = write_batch(user_id, batch, upload_folder)
+        except Exception as e:
+            db.session.rollback()
+            report(f'Error saving batch of {len(batch)}: {e}')
+            stats['failed'] += len(batch)
+        else:
+            mark_done(state_file, saved)
+            stats['imported'] += len(saved)
+            stats['songs'] += sum(len(result['songs']) for result in batch)
+
+        batch.clear()
+
+        elapsed = time.perf_counter() - start
+        finished = stats['imported'] + stats['failed']
+        rate_now = finished / elapsed if elapsed else 0
+        eta = (len(todo) - finished) / rate_now if rate_now else 0
+        report(f'[{finished}/{len(todo)}] {100 * finished / max(len(todo), 1):.0f}% '
+               f'· {rate_now:.2f} images/s · {stats["failed"]} failed · ETA {eta:.0f}s')
+
+    def collect(result):
+        if result['error']:
+            report(f"Failed {result['source']}: {result['error']}")
+            stats['failed'] += 1
+            return
+
+        batch.append(result)
+        if len(batch) >= batch_size:
+            flush()
+
+    if stats['skipped']:
+        report(f"Skipping {stats['skipped']} image(s) imported by an earlier run")
+
+    limiter = RateLimiter(rate)
+
+    if processes:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(limiter,)) as pool:
+            for future in as_completed([pool.submit(analyze_image, item) for item in todo]):
+                collect(future.result())
+    else:
+        _init_worker(limiter)
+        for item in todo:
+            collect(analyze_image(item))
+        _init_worker(None)
+
+    flush()
+
+    stats['seconds'] = time.perf_counter() - start
+    stats['throughput'] = (stats['imported'] + stats['failed']) / stats['seconds'] if stats['seconds'] else 0
+
+    return stats
@@ -0,0 +1,150 @@
+import mimetypes
+import os
+import random
+import time
+import uuid
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class MultipartFileBody:
+    """
+    multipart/form-data body that streams a file from disk in chunks (or sends bytes already in memory)
+    Iterable more than once so a retried request can send it again
+
+    """
+
+    def __init__(self, source, field='data', filename='image', chunk_size=64 * 1024, mime_type=None):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.boundary = uuid.uuid4().hex
+        if mime_type is None and not isinstance(source, (bytes, bytearray)):
+            mime_type = mimetypes.guess_type(source)[0]
+
+        self.head = (f'--{self.boundary}\r\n'
+                     f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                     f'Content-Type: {mime_type or "application/octet-stream"}\r\n\r\n').encode('utf-8')
+        self.tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        # lets requests send a Content-Length instead of a chunked body
+        size = len(self.source) if isinstance(self.source, (bytes, bytearray)) else os.path.getsize(self.source)
+        return len(self.head) + size + len(self.tail)
+
+    def __iter__(self):
+        yield self.head
+        if isinstance(self.source, (bytes, bytearray)):
+            yield bytes(self.source)
+        else:
+            with open(self.source, 'rb') as file:
+                for chunk in iter(lambda: file.read(self.chunk_size), b''):
+                    yield chunk
+        yield self.tail
+
+
+class EverypixelClient:
+    """
+    Everypixel keywords API client
+    One shared keep-alive session (no new TCP + TLS handshake per call), explicit
+    connect / read timeouts + retries with jittered exponential backoff on 429 / 5xx
+
+    """
+
+    BASE_URL = 'https://api.everypixel.com/v1/keywords'
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, client_id, api_key, base_url=None, connect_timeout=3.05, read_timeout=20,
+                 max_retries=3, backoff=0.5, max_backoff=10, pool_size=10):
+        self.base_url = base_url or self.BASE_URL
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        self.session.auth = (client_id, api_key) # auth should be tuple
+
+        # retries are handled below so Retry-After can be honoured
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def keywords(self, image_url=None, image_file=None, num_keywords=10, deadline=None, image_data=None,
+                 mime_type=None):
+        """
+        Ask Everypixel for keywords of an image URL, a local image file or image bytes, returns the response
+        With a deadline (utils.resilience.Deadline) timeouts + retries stay inside its budget
+
+        """
+
+        params = {'num_keywords': num_keywords} # specify # keywords to extract
+
+        if image_url:
+            params['url'] = image_url
+            return self._request('GET', params=params, deadline=deadline)
+
+        if image_file or image_data:
+            body = MultipartFileBody(image_data or image_file, mime_type=mime_type)
+            return self._request('POST', params=params, data=body,
+                                 headers={'Content-Type': body.content_type}, deadline=deadline)
+
+        raise ValueError('You must provide a valid image URL or image file.')
+
+    def _request(self, method, deadline=None, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+
+            timeout = self.timeout
+            if deadline is not None:
+                deadline.check('Everypixel request')
+                timeout = tuple(min(limit, deadline.remaining()) for limit in self.timeout)
+
+            try:
+                response = self.session.request(method, self.base_url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                delay = self._backoff(attempt)
+                if last_attempt or (deadline is not None and delay >= deadline.remaining()):
+                    raise
+            else:
+                if response.status_code not in self.RETRY_STATUSES or last_attempt:
+                    return response
+                delay = self._retry_after(response)
+                if delay is None:
+                    delay = self._backoff(attempt)
+
+                # no time left to wait + try again, hand back what we have
+                if deadline is not None and delay >= deadline.remaining():
+                    return response
+
+            time.sleep(delay)
+
+    def _backoff(self, attempt):
+        """Full jitter : random delay up to backoff * 2^attempt (capped)"""
+
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _retry_after(self, response):
+        """Seconds the server asked us to wait (Retry-After as seconds or an HTTP date), capped"""
+
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                return None
+
+        return min(max(delay, 0), self.max_backoff)
+
+    def close(self):
+        self.session.close()
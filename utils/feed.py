@@ -0,0 +1,83 @@
+from datetime import datetime
+from sqlalchemy import or_, text, column
+from sqlalchemy.orm import joinedload
+from models import db, Post, Follow
+from utils.pagination import paginate, cursor_keyset
+
+# posts on the home page
+FEED_SIZE = 15
+
+# a page's candidates : the user's timeline entries (fanned out on write) + the latest posts of the
+# followed authors who have too many followers to fan out, read here instead, all after the horizon
+# (the cap comes from timeline_settings, same as the triggers)
+TIMELINE_CANDIDATES = '''
+    (SELECT t.post_id FROM timeline_entries t
+     WHERE t.user_id = :user_id AND t.post_timestamp > :horizon {timeline_keyset}
+     ORDER BY t.post_timestamp DESC, t.post_id DESC
+     LIMIT :limit)
+    UNION
+    (SELECT p.id FROM users a
+     CROSS JOIN LATERAL (
+         SELECT p.id FROM posts p
+         WHERE p.user_id = a.id AND p.timestamp > :horizon {posts_keyset}
+         ORDER BY p.timestamp DESC, p.id DESC
+         LIMIT :limit) p
+     WHERE a.follower_count > timeline_setting('fanout_max_followers')
+       AND EXISTS (SELECT 1 FROM follows f WHERE f.follower_id = :user_id AND f.followed_id = a.id))
+'''
+
+
+def home_feed(user, cursor=None, limit=FEED_SIZE):
+    """
+    A page of the newest posts of the user + everyone they follow, authors loaded in the same query
+    Returns a Page, older posts follow from its next_cursor (utils/pagination.py)
+
+    Pages come from the user's timeline (timeline_entries) while they can, one index range
+    however many users are followed; past the timeline's horizon (posts trimmed off it)
+    they are read from posts at query time, see live_feed()
+
+    """
+
+    page = timeline_feed(user, cursor, limit)
+
+    # a short page either is the end of the feed, or ran into the posts trimmed off the timeline
+    if page.next_cursor is None and user.timeline_horizon is not None:
+        return live_feed(user, cursor, limit)
+
+    return page
+
+def timeline_feed(user, cursor=None, limit=FEED_SIZE):
+    """A page of the feed from the user's timeline + the authors that aren't fanned out"""
+
+    keyset = cursor_keyset(cursor, (Post.timestamp, Post.id))
+    params = {'user_id': user.id, 'horizon': user.timeline_horizon or datetime.min, 'limit': limit + 1}
+
+    timeline_keyset = posts_keyset = ''
+    if keyset is not None:
+        timeline_keyset = 'AND (t.post_timestamp, t.post_id) < (:cursor_timestamp, :cursor_id)'
+        posts_keyset = 'AND (p.timestamp, p.id) < (:cursor_timestamp, :cursor_id)'
+        params.update(cursor_timestamp=keyset[0], cursor_id=keyset[1])
+
+    candidates = (text(TIMELINE_CANDIDATES.format(timeline_keyset=timeline_keyset, posts_keyset=posts_keyset))
+                  .bindparams(**params)
+                  .columns(column('post_id')))
+
+    query = Post.query.options(joinedload(Post.user)).filter(Post.id.in_(candidates))
+
+    return paginate(query, (Post.timestamp, Post.id), cursor=cursor, per_page=limit)
+
+def live_feed(user, cursor=None, limit=FEED_SIZE):
+    """
+    A page of the feed read from posts at query time (no timeline)
+    The followed ids stay in a subquery, so following thousands of users is still one round trip
+
+    """
+
+    followed_ids = db.session.query(Follow.followed_id).filter(Follow.follower_id == user.id)
+
+    query = (Post
+             .query
+             .options(joinedload(Post.user))
+             .filter(or_(Post.user_id == user.id, Post.user_id.in_(followed_ids))))
+
+    return paginate(query, (Post.timestamp, Post.id), cursor=cursor, per_page=limit)
@@ -0,0 +1,67 @@
+import hashlib
+from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from models import db, ImageAnalysis
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def canonical_url(url):
+    """
+    Canonicalize an image URL so trivially different spellings share an analysis
+    (lowercase scheme + host, no default port, no fragment, sorted query params)
+
+    """
+
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{parts.port}'
+
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+
+    return urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+def url_hash(url):
+    """SHA-256 of the canonicalized URL"""
+
+    return hashlib.sha256(canonical_url(url).encode('utf-8')).hexdigest()
+
+def file_hash(path, chunk_size=64 * 1024):
+    """SHA-256 of a file's bytes, read in chunks"""
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def get_cached_keywords(content_hash, num_keywords):
+    """Return the stored keywords for this image or None if it was never analyzed"""
+
+    # own connection so the lookup never touches the caller's transaction
+    row = db.engine.execute(
+        select([ImageAnalysis.keywords])
+        .where(ImageAnalysis.content_hash == content_hash)
+        .where(ImageAnalysis.num_keywords == num_keywords)
+    ).first()
+
+    return row[0] if row else None
+
+def cache_keywords(content_hash, source, num_keywords, keywords):
+    """Store the keywords Everypixel returned for this image"""
+
+    stmt = (insert(ImageAnalysis.__table__)
+            .values(content_hash=content_hash,
+                    source=source,
+                    num_keywords=num_keywords,
+                    keywords=keywords,
+                    timestamp=datetime.now())
+            .on_conflict_do_nothing(index_elements=['content_hash', 'num_keywords']))
+
+    db.engine.execute(stmt)
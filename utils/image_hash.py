@@ -0,0 +1,269 @@
+"""
+Near-duplicate detection for post images
+The exact hashes in utils/image_analyses.py miss a photo that was resized or recompressed,
+a perceptual hash (dHash) barely changes for those. Every uploaded post image gets one,
+images a few bits apart are treated as the same photo
+
+    dHash : shrink to (9 x 8) grey pixels, one bit per pixel = is it brighter than its left neighbour
+    index : multi-index hashing, the hash is cut into chunks + each chunk has a hash table.
+            Two hashes at most d bits apart have a chunk at most d // chunks bits apart, so
+            only the buckets near the query's chunks need checking (a pure Python BK-tree
+            was ~7x slower than a NumPy scan at 100k images, see bench/image_hash.py)
+
+"""
+
+import io
+import os
+import time
+import threading
+from datetime import timedelta
+from functools import lru_cache
+from itertools import combinations
+import numpy as np
+from PIL import Image, ImageOps
+from sqlalchemy import select, exists
+from models import db, Post, PostSong
+
+HASH_SIZE = 8 # 8 x 8 = 64 bit hashes
+
+# images whose hashes differ in at most this many bits (of 64) are the same photo
+DUPLICATE_MAX_DISTANCE = int(os.getenv("DUPLICATE_MAX_DISTANCE", 6))
+
+# a hash is stamped when it is written but seen once its transaction commits, so each refresh
+# re-reads the hashes stamped this many seconds before the newest one it has (seconds)
+HASH_INDEX_OVERLAP = 60
+# the whole index is reloaded this often : drops deleted posts + catches hashes committed later still (seconds)
+HASH_INDEX_RELOAD = float(os.getenv("HASH_INDEX_RELOAD", 3600))
+
+
+def dhash(source, hash_size=HASH_SIZE):
+    """
+    Difference hash of an image (a file path or its bytes) as an unsigned int
+    Raises OSError (PIL.UnidentifiedImageError) for anything Pillow can't decode
+
+    """
+
+    file = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+
+    with Image.open(file) as image:
+        # decode JPEGs straight to a small grey image, the hash only needs 9 x 8 pixels
+        image.draft('L', (hash_size * 8, hash_size * 8))
+        image = ImageOps.exif_transpose(image)
+        small = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def hamming(a, b):
+    """Number of bits two hashes differ in"""
+
+    return bin(a ^ b).count('1')
+
+def to_signed(image_hash):
+    """64 bit hash -> the value stored in posts.image_hash (a signed BIGINT)"""
+
+    return image_hash - (1 << 64) if image_hash >= 1 << 63 else image_hash
+
+def from_signed(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+@lru_cache(maxsize=None)
+def flip_masks(bits, radius):
+    """Every mask of at most `radius` set bits among `bits` bits (XOR with one = a value that close)"""
+
+    masks = []
+    for flipped in range(radius + 1):
+        for positions in combinations(range(bits), flipped):
+            mask = 0
+            for position in positions:
+                mask |= 1 << position
+            masks.append(mask)
+
+    return tuple(masks)
+
+
+class MultiIndexHash:
+    """
+    Hamming distance index over 64 bit hashes (multi-index hashing)
+    One dict per chunk maps a chunk value to the hashes that have it, a lookup probes
+    every chunk value within max_distance // chunks bits of the query's + checks those hashes
+
+    """
+
+    def __init__(self, chunks=4, bits=64):
+        self.chunks = chunks
+        self.chunk_bits = bits // chunks
+        self.chunk_mask = (1 << self.chunk_bits) - 1
+        self.tables = [{} for _ in range(chunks)] # chunk value -> [hash]
+        self.items = {} # hash -> [item]
+        self.size = 0
+
+    def split(self, image_hash):
+        return [(image_hash >> (i * self.chunk_bits)) & self.chunk_mask for i in range(self.chunks)]
+
+    def add(self, image_hash, item):
+        self.size += 1
+
+        items = self.items.get(image_hash)
+        if items is not None:
+            items.append(item)
+            return
+
+        self.items[image_hash] = [item]
+        for table, value in zip(self.tables, self.split(image_hash)):
+            table.setdefault(value, []).append(image_hash)
+
+    def search(self, image_hash, max_distance):
+        """[(distance, item)] of everything within max_distance, closest first"""
+
+        masks = flip_masks(self.chunk_bits, max_distance // self.chunks)
+        checked = set()
+        matches = []
+
+        for table, value in zip(self.tables, self.split(image_hash)):
+            for mask in masks:
+                for candidate in table.get(value ^ mask, ()):
+                    if candidate in checked:
+                        continue
+                    checked.add(candidate)
+
+                    distance = hamming(image_hash, candidate)
+                    if distance <= max_distance:
+                        matches.extend((distance, item) for item in self.items[candidate])
+
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+    def __len__(self):
+        return self.size
+
+
+class PostHashIndex:
+    """
+    Index of every hashed post, one per process
+    Each lookup reads the hashes set since the last one (on posts.image_hashed_at, so hashes committed
+    out of id order or backfilled onto older posts are picked up too) + the whole index is reloaded
+    every HASH_INDEX_RELOAD seconds. Posts deleted (or not ready) since are filtered out when a match is picked
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+
+    def refresh(self):
+        if time.monotonic() - self.loaded_at > HASH_INDEX_RELOAD:
+            self._clear()
+
+        query = select([Post.id, Post.image_hash, Post.image_hashed_at]).where(Post.image_hash.isnot(None))
+        if self.hashed_at is not None:
+            query = query.where(Post.image_hashed_at > self.hashed_at - timedelta(seconds=HASH_INDEX_OVERLAP))
+
+        # own connection so the lookup never touches the caller's transaction
+        rows = db.engine.execute(query).fetchall()
+
+        for post_id, value, hashed_at in rows:
+            image_hash = from_signed(value)
+            if self.hashes.get(post_id) != image_hash: # re-read by the overlap
+                self.index.add(image_hash, post_id)
+                self.hashes[post_id] = image_hash
+
+            if hashed_at is not None and (self.hashed_at is None or hashed_at > self.hashed_at):
+                self.hashed_at = hashed_at
+
+    def search(self, image_hash, max_distance=DUPLICATE_MAX_DISTANCE):
+        with self._lock:
+            self.refresh()
+            return self.index.search(image_hash, max_distance)
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self.index = MultiIndexHash()
+        self.hashes = {} # post id -> hash indexed
+        self.hashed_at = None # newest image_hashed_at read
+        self.loaded_at = time.monotonic()
+
+
+post_hash_index = PostHashIndex()
+
+
+def find_similar_post(image_hash, max_distance=DUPLICATE_MAX_DISTANCE):
+    """
+    The closest ready post with songs whose image is within max_distance of this hash
+    Returns (post, distance) or (None, None)
+
+    """
+
+    matches = post_hash_index.search(image_hash, max_distance)
+    if not matches:
+        return None, None
+
+    has_songs = exists().where(PostSong.post_id == Post.id)
+    posts = (Post
+             .query
+             .filter(Post.id.in_([post_id for _, post_id in matches]))
+             .filter(Post.status == 'ready', Post.image_hash.isnot(None))
+             .filter(has_songs)
+             .all())
+
+    # distances come from the saved hashes, the index can be behind (e.g. a re-hashed post)
+    candidates = [(hamming(image_hash, from_signed(post.image_hash)), post.id, post) for post in posts]
+    candidates = [candidate for candidate in candidates if candidate[0] <= max_distance]
+
+    if not candidates:
+        return None, None
+
+    distance, _, post = min(candidates, key=lambda candidate: candidate[:2])
+    return post, distance
+
+def hash_post_image(path):
+    """dHash of a saved upload or None when Pillow can't read it"""
+
+    try:
+        return dhash(path)
+    except OSError as e:
+        print("Error hashing image:", e)
+        return None
+
+def backfill_hashes(upload_folder, batch_size=200):
+    """
+    Hash uploaded images of posts saved before image hashes existed
+    Returns (hashed, skipped), skipped are URL posts + missing / unreadable files
+
+    """
+
+    hashed = skipped = 0
+    last_id = 0
+
+    while True:
+        posts = (Post
+                 .query
+                 .filter(Post.image_hash.is_(None), Post.id > last_id)
+                 .order_by(Post.id)
+                 .limit(batch_size)
+                 .all())
+
+        if not posts:
+            return hashed, skipped
+
+        for post in posts:
+            last_id = post.id
+            path = os.path.join(upload_folder, os.path.basename(post.image))
+            image_hash = None
+
+            if post.image.startswith('/static/images/uploads/') and os.path.isfile(path):
+                image_hash = hash_post_image(path)
+
+            if image_hash is None:
+                skipped += 1
+            else:
+                post.image_hash = to_signed(image_hash)
+                hashed += 1
+
+        db.session.commit()
@@ -0,0 +1,128 @@
+"""
+Shrink images before they are sent to Everypixel
+Phone photos are 5-12 MB, the tagger only looks at a small version of them, so the upload is
+mostly wasted time. Images are decoded, downscaled, stripped of metadata (EXIF / GPS) and
+re-encoded in memory, the original file is left untouched for display
+
+"""
+
+import io
+import os
+import threading
+import time
+import requests
+from PIL import Image, ImageOps
+
+# longest side sent to the tagger, it gains nothing from bigger images
+PREP_MAX_SIDE = int(os.getenv("IMAGE_PREP_MAX_SIDE", 1024))
+PREP_FORMAT = os.getenv("IMAGE_PREP_FORMAT", "JPEG").upper() # JPEG or WEBP
+PREP_QUALITY = int(os.getenv("IMAGE_PREP_QUALITY", 85))
+
+# biggest image fetched from a URL (bytes)
+FETCH_MAX_BYTES = int(os.getenv("IMAGE_FETCH_MAX_BYTES", 20 * 1024 * 1024))
+
+CONTENT_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+
+# running totals for this process, see prep_stats()
+STATS = {'images': 0, 'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0}
+_stats_lock = threading.Lock()
+
+# separate from the Everypixel session so its credentials never go to image hosts
+_fetch_session = requests.Session()
+
+
+class PreparedImage:
+    """A re-encoded image ready to upload, with what it cost + saved"""
+
+    def __init__(self, data, content_type, size, original_size, original_bytes, seconds):
+        self.data = data
+        self.content_type = content_type
+        self.size = size # (width, height) sent
+        self.original_size = original_size
+        self.original_bytes = original_bytes
+        self.seconds = seconds
+
+    @property
+    def bytes_saved(self):
+        return self.original_bytes - len(self.data)
+
+    def __repr__(self):
+        return (f'<PreparedImage {self.original_size} -> {self.size}, '
+                f'{self.original_bytes} -> {len(self.data)} bytes, {self.seconds * 1000:.0f}ms>')
+
+
+def prepare_image(source, max_side=PREP_MAX_SIDE, fmt=PREP_FORMAT, quality=PREP_QUALITY):
+    """
+    Downscale + re-encode an image (a file path or its bytes) for tagging
+    Raises OSError (PIL.UnidentifiedImageError) for anything Pillow can't decode
+
+    """
+
+    start = time.perf_counter()
+
+    if isinstance(source, (bytes, bytearray)):
+        original_bytes = len(source)
+        file = io.BytesIO(source)
+    else:
+        original_bytes = os.path.getsize(source)
+        file = open(source, 'rb')
+
+    with file, Image.open(file) as image:
+        original_size = image.size
+
+        # JPEGs can be decoded straight at 1/2, 1/4 or 1/8 of their size, much faster than full decode + resize
+        # (draft keeps the image at least as big as the size asked for, so ask for the final size)
+        scale = min(1.0, max_side / max(original_size))
+        image.draft('RGB', (int(original_size[0] * scale), int(original_size[1] * scale)))
+
+        # apply the EXIF rotation before the EXIF is dropped
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        out = io.BytesIO()
+        image.save(out, format=fmt, quality=quality, optimize=True) # no exif= : metadata is not written
+        size = image.size
+
+    prepared = PreparedImage(out.getvalue(), CONTENT_TYPES.get(fmt, 'application/octet-stream'),
+                             size, original_size, original_bytes, time.perf_counter() - start)
+    record(prepared)
+
+    return prepared
+
+def fetch_image(url, timeout=10, max_bytes=FETCH_MAX_BYTES):
+    """Download an image's bytes, refusing anything bigger than max_bytes"""
+
+    with _fetch_session.get(url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+
+        if int(response.headers.get('Content-Length') or 0) > max_bytes:
+            raise ValueError(f'Image is bigger than {max_bytes} bytes')
+
+        chunks = []
+        received = 0
+        for chunk in response.iter_content(64 * 1024):
+            received += len(chunk)
+            if received > max_bytes:
+                raise ValueError(f'Image is bigger than {max_bytes} bytes')
+            chunks.append(chunk)
+
+    return b''.join(chunks)
+
+def record(prepared):
+    with _stats_lock:
+        STATS['images'] += 1
+        STATS['bytes_in'] += prepared.original_bytes
+        STATS['bytes_out'] += len(prepared.data)
+        STATS['seconds'] += prepared.seconds
+
+def prep_stats():
+    """Totals for this process : images prepared, bytes in / out / saved, seconds spent"""
+
+    with _stats_lock:
+        stats = dict(STATS)
+
+    stats['bytes_saved'] = stats['bytes_in'] - stats['bytes_out']
+    return stats
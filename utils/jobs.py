@@ -0,0 +1,151 @@
+import os
+import time
+import traceback
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from models import db, Job
+
+# retry a failing job this many times before giving up
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+
+# a 'running' job untouched for this long belonged to a worker that died, it can be claimed again
+JOB_STALE_AFTER = int(os.getenv("JOB_STALE_AFTER", 300))
+
+# kind -> (function(job), on_failure(job) or None)
+HANDLERS = {}
+
+
+def job_handler(kind, on_failure=None):
+    """
+    Register a function as the handler for jobs of this kind
+    on_failure runs once the job has used up all its attempts
+
+    """
+
+    def register(func):
+        HANDLERS[kind] = (func, on_failure)
+        return func
+
+    return register
+
+def enqueue(kind, payload, post_id=None):
+    """Queue a job, it is saved with the caller's next commit"""
+
+    job = Job(kind=kind, payload=payload, post_id=post_id)
+    db.session.add(job)
+
+    return job
+
+def claim_job():
+    """
+    Claim the oldest runnable job for this worker
+    SKIP LOCKED lets many workers poll the same table without blocking each other
+    A stale running job is only claimed again while it has attempts left (see fail_stale_jobs)
+
+    """
+
+    stale = datetime.now() - timedelta(seconds=JOB_STALE_AFTER)
+
+    job = (Job
+           .query
+           .filter(or_(Job.status == 'queued',
+                       (Job.status == 'running') & (Job.updated_at < stale) & (Job.attempts < JOB_MAX_ATTEMPTS)))
+           .order_by(Job.id)
+           .with_for_update(skip_locked=True)
+           .first())
+
+    if job is None:
+        db.session.rollback()
+        return None
+
+    job.status = 'running'
+    job.attempts += 1
+    db.session.commit()
+
+    return job
+
+def fail_stale_jobs():
+    """
+    Fail the stale running jobs that were on their last attempt : their worker died (a job that keeps
+    crashing its worker would otherwise be retried forever), on_failure runs for each
+    Returns how many were failed
+
+    """
+
+    stale = datetime.now() - timedelta(seconds=JOB_STALE_AFTER)
+
+    jobs = (Job
+            .query
+            .filter(Job.status == 'running', Job.updated_at < stale, Job.attempts >= JOB_MAX_ATTEMPTS)
+            .order_by(Job.id)
+            .with_for_update(skip_locked=True)
+            .all())
+
+    for job in jobs:
+        job.status = 'failed'
+        job.error = f'Worker stopped during attempt {job.attempts} of {JOB_MAX_ATTEMPTS}'
+    db.session.commit()
+
+    for job in jobs:
+        _, on_failure = HANDLERS.get(job.kind, (None, None))
+        if on_failure is not None:
+            on_failure(job)
+
+    return len(jobs)
+
+def update_progress(job, stage, progress):
+    """Record how far along a job is (committed right away so readers see it)"""
+
+    job.stage = stage
+    job.progress = progress
+    db.session.commit()
+
+def run_job(job):
+    """Run a claimed job, re-queueing it on failure until it runs out of attempts"""
+
+    handler, on_failure = HANDLERS.get(job.kind, (None, None))
+
+    try:
+        if handler is None:
+            raise ValueError(f'No handler for job kind {job.kind}')
+
+        handler(job)
+
+        job.status = 'done'
+        job.progress = 100
+        db.session.commit()
+
+    except Exception as e:
+        db.session.rollback()
+        traceback.print_exc()
+
+        job.error = str(e)
+        job.status = 'failed' if job.attempts >= JOB_MAX_ATTEMPTS else 'queued'
+        db.session.commit()
+
+        if job.status == 'failed' and on_failure is not None:
+            on_failure(job)
+
+    return job
+
+def work(burst=False, interval=1.0):
+    """
+    Process jobs until stopped
+    burst=True stops once the queue is empty (handy for tests + cron)
+
+    """
+
+    processed = 0
+
+    while True:
+        fail_stale_jobs()
+        job = claim_job()
+
+        if job is None:
+            if burst:
+                return processed
+            time.sleep(interval)
+            continue
+
+        run_job(job)
+        processed += 1
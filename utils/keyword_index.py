@@ -0,0 +1,146 @@
+import os
+from datetime import timedelta
+from sqlalchemy import select, func, literal, text
+from sqlalchemy.dialects.postgresql import insert
+from models import db, PostKeyword, KeywordSong, Song, FavoritedSong
+
+# a favorite counts as much as this many posts when ranking a keyword's songs
+FAVORITE_WEIGHT = float(os.getenv("INDEX_FAVORITE_WEIGHT", 2))
+
+
+def normalize_keyword(keyword):
+    """Lowercased with single spaces, the form keywords are indexed under"""
+
+    return ' '.join(keyword.lower().split())
+
+def record_post_keywords(post_id, keywords):
+    """Save the keywords a post's songs were found with (part of the caller's transaction)"""
+
+    rows = [{'post_id': post_id, 'keyword': keyword}
+            for keyword in {normalize_keyword(keyword) for keyword in keywords or []} if keyword]
+
+    if rows:
+        db.session.execute(insert(PostKeyword.__table__)
+                           .values(rows)
+                           .on_conflict_do_nothing(index_elements=['post_id', 'keyword']))
+
+def index_post_songs(post_id, song_ids):
+    """Count newly linked songs under every keyword of the post"""
+
+    song_ids = list(song_ids)
+    if not song_ids:
+        return
+
+    pairs = (select([PostKeyword.keyword, Song.id, literal(1)])
+             .where(PostKeyword.post_id == post_id)
+             .where(Song.id.in_(song_ids)))
+
+    stmt = insert(KeywordSong.__table__).from_select(['keyword', 'song_id', 'post_count'], pairs)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['keyword', 'song_id'],
+        set_={'post_count': KeywordSong.__table__.c.post_count + 1}
+    )
+    db.session.execute(stmt)
+
+def unindex_post(post_id):
+    """
+    Take a post out of the index before it is deleted
+    Safe to call twice : the post's keywords are removed as well
+
+    """
+
+    db.session.execute(text('''
+        UPDATE keyword_songs ks
+        SET post_count = ks.post_count - 1
+        FROM post_keywords pk, postsongs ps
+        WHERE pk.post_id = :post_id AND ps.post_id = :post_id
+          AND ks.keyword = pk.keyword AND ks.song_id = ps.song_id
+    '''), {'post_id': post_id})
+
+    KeywordSong.query.filter(KeywordSong.post_count <= 0).delete(synchronize_session=False)
+    PostKeyword.query.filter_by(post_id=post_id).delete(synchronize_session=False)
+
+def rebuild_index():
+    """Recount the whole index from post_keywords + postsongs, returns # of entries"""
+
+    KeywordSong.query.delete()
+
+    result = db.session.execute(text('''
+        INSERT INTO keyword_songs (keyword, song_id, post_count)
+        SELECT pk.keyword, ps.song_id, count(*)
+        FROM post_keywords pk
+        JOIN postsongs ps ON ps.post_id = pk.post_id
+        GROUP BY pk.keyword, ps.song_id
+    '''))
+    db.session.commit()
+
+    return result.rowcount
+
+def mark_keywords_refreshed(keywords):
+    """Record that Spotify was just searched for these keywords, their entries answer lookups again"""
+
+    keywords = {normalize_keyword(keyword) for keyword in keywords}
+    if not keywords:
+        return
+
+    # own connection, like the lookups
+    db.engine.execute(KeywordSong.__table__.update()
+                      .where(KeywordSong.keyword.in_(keywords))
+                      .values(refreshed_at=func.now()))
+
+def lookup_keyword_songs(keywords, limit=3, min_songs=None, max_age=None):
+    """
+    Best indexed songs for each keyword, ranked by post_count + favorites
+    Returns {normalized keyword: [song dicts]} only for keywords with at least min_songs candidates
+    With max_age (seconds), entries not refreshed for longer don't count
+
+    """
+
+    keywords = {normalize_keyword(keyword) for keyword in keywords}
+    min_songs = limit if min_songs is None else min_songs
+    if not keywords:
+        return {}
+
+    # favorites of the candidate songs only, not the whole table
+    candidates = select([KeywordSong.song_id]).where(KeywordSong.keyword.in_(keywords))
+    favorites = (select([FavoritedSong.song_id, func.count().label('favorites')])
+                 .where(FavoritedSong.song_id.in_(candidates))
+                 .group_by(FavoritedSong.song_id)
+                 .alias('favorites'))
+    weight = KeywordSong.post_count + FAVORITE_WEIGHT * func.coalesce(favorites.c.favorites, 0)
+
+    ranked = (select([KeywordSong.keyword,
+                      Song.title, Song.artist, Song.image_url, Song.spotify_url, Song.spotify_id, Song.preview_url,
+                      func.row_number().over(partition_by=KeywordSong.keyword,
+                                             order_by=(weight.desc(), Song.id)).label('rank'),
+                      func.count().over(partition_by=KeywordSong.keyword).label('candidates')])
+              .select_from(KeywordSong.__table__
+                           .join(Song.__table__, Song.id == KeywordSong.song_id)
+                           .outerjoin(favorites, favorites.c.song_id == KeywordSong.song_id))
+              .where(KeywordSong.keyword.in_(keywords)))
+
+    if max_age is not None:
+        ranked = ranked.where(KeywordSong.refreshed_at > func.now() - timedelta(seconds=max_age))
+    ranked = ranked.alias('ranked')
+
+    # own connection so the lookup never touches the caller's transaction
+    rows = db.engine.execute(
+        select([ranked])
+        .where(ranked.c.rank <= limit)
+        .where(ranked.c.candidates >= min_songs)
+        .order_by(ranked.c.keyword, ranked.c.rank)
+    ).fetchall()
+
+    found = {}
+    for row in rows:
+        found.setdefault(row.keyword, []).append({
+            'title': row.title,
+            'artist': row.artist,
+            'album': None,
+            'image_url': row.image_url,
+            'spotify_url': row.spotify_url,
+            'spotify_id': row.spotify_id,
+            'preview_url': row.preview_url
+        })
+
+    return found
@@ -0,0 +1,117 @@
+import os
+import re
+from sqlalchemy import text
+from models import db
+
+# plain SQL files applied in name order (0001_..., 0002_...), each once per database
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+# can't run inside a transaction
+CONCURRENT_STATEMENT = re.compile(r'^(CREATE|DROP)\s+(UNIQUE\s+)?INDEX\s+CONCURRENTLY\b', re.IGNORECASE)
+
+SCHEMA_MIGRATIONS = '''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        name TEXT PRIMARY KEY,
+        applied_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+'''
+
+
+def migration_files(directory=MIGRATIONS_DIR):
+    return sorted(name for name in os.listdir(directory) if name.endswith('.sql'))
+
+def split_statements(sql):
+    """
+    The statements of a migration, one per ';'
+    (comment lines dropped, so migrations can't hold function bodies : those go in models.py)
+
+    """
+
+    lines = [line for line in sql.splitlines() if not line.strip().startswith('--')]
+
+    return [statement.strip() for statement in '\n'.join(lines).split(';') if statement.strip()]
+
+def statement_groups(statements):
+    """
+    A migration's statements as (in_transaction, statements) groups, in order :
+    each run of plain statements is one transaction, a CONCURRENTLY statement runs on its own
+
+    """
+
+    groups = []
+    for statement in statements:
+        if CONCURRENT_STATEMENT.match(statement):
+            groups.append((False, [statement]))
+        elif groups and groups[-1][0]:
+            groups[-1][1].append(statement)
+        else:
+            groups.append((True, [statement]))
+
+    return groups
+
+def run_group(conn, in_transaction, statements):
+    """Run a group of statements on an autocommit connection, all or nothing when `in_transaction`"""
+
+    if not in_transaction:
+        for statement in statements:
+            conn.execute(statement)
+        return
+
+    conn.execute(text('BEGIN'))
+    try:
+        for statement in statements:
+            conn.execute(statement)
+    except Exception:
+        conn.execute(text('ROLLBACK'))
+        raise
+    conn.execute(text('COMMIT'))
+
+def applied_migrations():
+    db.session.execute(text(SCHEMA_MIGRATIONS))
+    db.session.commit()
+
+    return {name for name, in db.session.execute(text('SELECT name FROM schema_migrations'))}
+
+def pending_migrations(directory=MIGRATIONS_DIR):
+    applied = applied_migrations()
+    return [name for name in migration_files(directory) if name not in applied]
+
+def apply_migrations(directory=MIGRATIONS_DIR, report=print):
+    """
+    Apply the migrations not applied yet, returns their names
+    Tables the models have but the database doesn't are created first (db.create_all(), which also
+    installs the triggers), the migrations then bring the tables that already existed up to date
+    A migration's statements run in one transaction on one connection (a failing one rolls them all back),
+    except CREATE/DROP INDEX CONCURRENTLY, which can't run in a transaction : those run on their own in
+    autocommit, after the statements before them committed. A migration is only recorded once all of them worked
+
+    """
+
+    db.create_all()
+
+    applied = []
+
+    for name in pending_migrations(directory):
+        with open(os.path.join(directory, name)) as f:
+            statements = split_statements(f.read())
+
+        report(f'Applying {name} ({len(statements)} statement(s))')
+
+        groups = [(in_transaction, [text(statement) for statement in group])
+                  for in_transaction, group in statement_groups(statements)]
+        # recorded with the migration's last transaction (or on its own after a CONCURRENTLY statement)
+        record = text('INSERT INTO schema_migrations (name) VALUES (:name)').bindparams(name=name)
+        if groups and groups[-1][0]:
+            groups[-1][1].append(record)
+        else:
+            groups.append((True, [record]))
+
+        with db.engine.connect() as conn:
+            # BEGIN/COMMIT are sent by run_group, so CONCURRENTLY statements can go in between
+            conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+            for in_transaction, group in groups:
+                run_group(conn, in_transaction, group)
+
+        applied.append(name)
+
+    return applied
@@ -0,0 +1,88 @@
+import base64
+import json
+from collections import namedtuple
+from datetime import datetime
+from flask import request, url_for
+from sqlalchemy import tuple_
+
+# one page of a list + the cursor of the page after it (None on the last page)
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+def encode_cursor(values):
+    """Opaque, URL-safe cursor for the keyset of the last item on a page (timestamps as ISO strings)"""
+
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """The keyset stored in a cursor, None when missing or malformed (= start from the first page)"""
+
+    if not cursor:
+        return None
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+
+        if not isinstance(values, list) or not all(type(value) in (int, str) for value in values):
+            return None
+
+        return tuple(datetime.fromisoformat(value) if isinstance(value, str) else value for value in values)
+    except ValueError:
+        return None
+
+def cursor_keyset(cursor, columns):
+    """
+    The keyset in `cursor` if it fits `columns`, else None
+    A cursor from another list (or edited by hand) starts from the top rather than comparing the wrong types
+
+    """
+
+    keyset = decode_cursor(cursor)
+
+    if keyset is None or len(keyset) != len(columns):
+        return None
+
+    if not all(isinstance(value, column.type.python_type) for value, column in zip(keyset, columns)):
+        return None
+
+    return keyset
+
+def paginate(query, columns, cursor=None, per_page=15, descending=True, key=None):
+    """
+    One page of `query`, ordered by the keyset `columns` (e.g. Post.timestamp, Post.id), after `cursor`
+
+    Seeks past the cursor with a row comparison instead of skipping rows with OFFSET, so with an
+    index on the columns page 500 costs the same as page 1, and rows added meanwhile don't shift pages
+    The last column has to be unique (an id) so ties on the others are never skipped or repeated
+    `key` gets the keyset values from a result row, by default the columns' attributes
+
+    """
+
+    keyset = cursor_keyset(cursor, columns)
+
+    if keyset is not None:
+        row = tuple_(*columns)
+        query = query.filter(row < tuple_(*keyset) if descending else row > tuple_(*keyset))
+
+    order = [column.desc() if descending else column.asc() for column in columns]
+
+    # one row more than a page tells whether there is a next page, without a count
+    rows = query.order_by(*order).limit(per_page + 1).all()
+    items = rows[:per_page]
+
+    next_cursor = None
+    if len(rows) > per_page:
+        last = items[-1]
+        next_cursor = encode_cursor(key(last) if key else [getattr(last, column.key) for column in columns])
+
+    return Page(items, next_cursor)
+
+def next_page_url(page, **params):
+    """URL of the page after `page` on the current route (None on the last page)"""
+
+    if page.next_cursor is None:
+        return None
+
+    return url_for(request.endpoint, **request.view_args, cursor=page.next_cursor, **params)
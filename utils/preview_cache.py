@@ -0,0 +1,112 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from flask import has_app_context
+from sqlalchemy import func, literal, select
+from sqlalchemy.dialects.postgresql import insert
+from models import db, CachedPreview, Song
+
+# how long found / not found previews are trusted (seconds)
+PREVIEW_CACHE_TTL = int(os.getenv("PREVIEW_CACHE_TTL", 7 * 24 * 3600))
+PREVIEW_CACHE_NEGATIVE_TTL = int(os.getenv("PREVIEW_CACHE_NEGATIVE_TTL", 24 * 3600))
+
+# per-process hit / miss counters
+_stats = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'stores': 0}
+_stats_lock = threading.Lock()
+
+
+def preview_cache_key(query):
+    """Normalize a "title artist" query into its cache key : lowercased with single spaces"""
+
+    return ' '.join(query.lower().split())
+
+def cache_enabled():
+    """The cache lives in the DB so it is only used inside an app context"""
+
+    return has_app_context()
+
+def get_cached_previews(keys):
+    """
+    Look up many keys at once
+    Returns {key: preview_url} for unexpired entries only (preview_url is None for negative entries)
+
+    """
+
+    keys = set(keys)
+    if not keys:
+        return {}
+
+    # cache reads + writes use their own connection so they never touch the caller's transaction
+    rows = db.engine.execute(
+        select([CachedPreview.key, CachedPreview.preview_url])
+        .where(CachedPreview.key.in_(keys))
+        .where(CachedPreview.expires_at > datetime.utcnow())
+    ).fetchall()
+
+    cached = {key: preview_url for key, preview_url in rows}
+
+    with _stats_lock:
+        _stats['hits'] += sum(1 for url in cached.values() if url)
+        _stats['negative_hits'] += sum(1 for url in cached.values() if not url)
+        _stats['misses'] += len(keys) - len(cached)
+
+    return cached
+
+def cache_previews(previews):
+    """Store {key: preview_url} results, negative results get the shorter TTL"""
+
+    if not previews:
+        return
+
+    now = datetime.utcnow()
+    rows = [{
+        'key': key,
+        'preview_url': url,
+        'expires_at': now + timedelta(seconds=PREVIEW_CACHE_TTL if url else PREVIEW_CACHE_NEGATIVE_TTL)
+    } for key, url in previews.items()]
+
+    stmt = insert(CachedPreview.__table__).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['key'],
+        set_={'preview_url': stmt.excluded.preview_url, 'expires_at': stmt.excluded.expires_at}
+    )
+    db.engine.execute(stmt)
+
+    with _stats_lock:
+        _stats['stores'] += len(rows)
+
+def seed_preview_cache():
+    """Seed the cache with the preview URLs already saved on songs, returns # of new entries"""
+
+    key = func.lower(func.regexp_replace(func.trim(Song.title + ' ' + Song.artist), r'\s+', ' ', 'g'))
+    expires_at = literal(datetime.utcnow() + timedelta(seconds=PREVIEW_CACHE_TTL))
+
+    songs = select([key, Song.preview_url, expires_at]).where(Song.preview_url.isnot(None))
+
+    stmt = (insert(CachedPreview.__table__)
+            .from_select(['key', 'preview_url', 'expires_at'], songs)
+            .on_conflict_do_nothing(index_elements=['key']))
+
+    result = db.session.execute(stmt)
+    db.session.commit()
+
+    return result.rowcount
+
+def purge_expired_previews():
+    """Delete expired entries, returns # deleted"""
+
+    deleted = CachedPreview.query.filter(CachedPreview.expires_at <= datetime.utcnow()).delete()
+    db.session.commit()
+
+    return deleted
+
+def preview_cache_stats():
+    """Hit / miss counters for this process"""
+
+    with _stats_lock:
+        stats = dict(_stats)
+
+    lookups = stats['hits'] + stats['negative_hits'] + stats['misses']
+    stats['hit_rate'] = (stats['hits'] + stats['negative_hits']) / lookups if lookups else 0.0
+
+    return stats
@@ -0,0 +1,227 @@
+import itertools
+import json
+import subprocess
+import threading
+from concurrent.futures import Future, wait
+
+
+class PreviewWorkerError(Exception):
+    """Raised when a preview worker crashes or answers with an error"""
+
+
+def _settle(future, result=None, error=None):
+    """Complete a lookup future unless the caller already cancelled it"""
+
+    if future.done():
+        return
+
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except Exception:
+        pass  # cancelled in between the check and the set
+
+
+class PreviewWorker:
+    """
+    One long-running `node get_preview.js --server` process
+    Requests and answers are JSON lines matched up by id
+
+    """
+
+    def __init__(self, command, timeout=10):
+        self.command = command
+        self.timeout = timeout
+        self.process = None
+        self.exited = False  # set by the reader thread when stdout closes
+        self.pending = {}  # request id -> (future, timer)
+        self.restarts = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def alive(self):
+        return self.process is not None and not self.exited and self.process.poll() is None
+
+    def start(self):
+        """Start (or restart after a crash) the worker process"""
+
+        if self.process is not None:
+            self.restarts += 1
+            if self.process.poll() is None:
+                self.process.kill()
+
+        self.exited = False
+        self.process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            bufsize=1  # line buffered
+        )
+
+        # read answers on a background thread so many queries can be in flight
+        reader = threading.Thread(target=self._read_answers, args=(self.process,), daemon=True)
+        reader.start()
+
+    def submit(self, query):
+        """Send a query to the worker, returns a Future for the preview URL"""
+
+        future = Future()
+
+        with self._lock:
+            if not self.alive:
+                try:
+                    self.start()
+                except OSError as e:
+                    future.set_exception(PreviewWorkerError(f'Preview worker failed to start: {e}'))
+                    return future
+
+            request_id = next(self._ids)
+            timer = threading.Timer(self.timeout, self._expire, args=(request_id,))
+            timer.daemon = True
+            self.pending[request_id] = (future, timer)
+
+            try:
+                self.process.stdin.write(json.dumps({'id': request_id, 'query': query}) + '\n')
+                self.process.stdin.flush()
+            except (BrokenPipeError, OSError, ValueError) as e:
+                # worker died between the alive check and the write
+                self.pending.pop(request_id, None)
+                future.set_exception(PreviewWorkerError(f'Preview worker unavailable: {e}'))
+                return future
+
+            timer.start()
+
+        # a cancelled lookup no longer needs an answer from the worker
+        future.add_done_callback(lambda f: f.cancelled() and self._discard(request_id))
+
+        return future
+
+    def close(self):
+        """Stop the worker process + fail anything still waiting"""
+
+        with self._lock:
+            process = self.process
+            self.process = None
+            pending = self._take_pending()
+
+        if process is not None and process.poll() is None:
+            try:
+                process.stdin.close()
+                process.wait(timeout=2)
+            except Exception:
+                process.kill()
+
+        self._fail(pending, 'Preview worker closed')
+
+    def _read_answers(self, process):
+        """Resolve pending futures as answers come back on stdout"""
+
+        for line in process.stdout:
+            try:
+                answer = json.loads(line)
+            except ValueError:
+                continue
+
+            with self._lock:
+                entry = self.pending.pop(answer.get('id'), None)
+
+            if entry is None:
+                continue  # answer arrived after the request timed out
+
+            future, timer = entry
+            timer.cancel()
+
+            if answer.get('error'):
+                _settle(future, error=PreviewWorkerError(answer['error']))
+            else:
+                urls = answer.get('previewUrls') or []
+                _settle(future, result=urls[0] if urls else None)
+
+        # stdout closed -> the worker exited, it will be restarted on the next submit
+        with self._lock:
+            pending = {}
+            if self.process is process:
+                self.exited = True
+                pending = self._take_pending()
+
+        self._fail(pending, 'Preview worker exited')
+
+    def _expire(self, request_id):
+        """Fail a request that took longer than the per-request timeout"""
+
+        with self._lock:
+            entry = self.pending.pop(request_id, None)
+
+        if entry is not None:
+            future, _ = entry
+            _settle(future, error=TimeoutError(f'Preview lookup timed out after {self.timeout}s'))
+
+    def _discard(self, request_id):
+        with self._lock:
+            entry = self.pending.pop(request_id, None)
+
+        if entry is not None:
+            entry[1].cancel()
+
+    def _take_pending(self):
+        pending, self.pending = self.pending, {}
+        return pending
+
+    def _fail(self, pending, message):
+        # futures are failed outside the lock so their callbacks can submit again
+        for future, timer in pending.values():
+            timer.cancel()
+            _settle(future, error=PreviewWorkerError(message))
+
+
+class PreviewResolverPool:
+    """
+    Pool of long-running preview workers
+    Queries are spread over the workers with the fewest requests in flight
+
+    """
+
+    def __init__(self, command, size=2, timeout=10):
+        self.workers = [PreviewWorker(command, timeout=timeout) for _ in range(size)]
+        self._lock = threading.Lock()
+
+    def submit(self, query):
+        """Queue one query, returns a Future for its preview URL"""
+
+        with self._lock:
+            worker = min(self.workers, key=lambda w: len(w.pending))
+
+        return worker.submit(query)
+
+    def resolve_many(self, queries):
+        """
+        Resolve many queries at once
+        Returns preview URLs in the same order as queries (None when not found)
+
+        """
+
+        futures = [self.submit(query) for query in queries]
+        wait(futures)
+
+        urls = []
+        for query, future in zip(queries, futures):
+            try:
+                urls.append(future.result())
+            except Exception as e:
+                print(f"Error getting preview for {query}:", e)
+                urls.append(None)
+
+        return urls
+
+    @property
+    def restarts(self):
+        return sum(worker.restarts for worker in self.workers)
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
@@ -0,0 +1,163 @@
+import os
+import time
+from sqlalchemy import text
+from models import db, Post, Song, PostSong, PostKeyword, NO_PREVIEW
+from api_helpers import (image_to_keywords, iter_keywords_to_songs, find_preview_url,
+                         MAX_SONGS, PIPELINE_BUDGET, PREVIEW_TIMEOUT, LAZY_PREVIEWS)
+from utils.jobs import job_handler, enqueue, update_progress
+from utils.resilience import Deadline
+from utils.keyword_index import record_post_keywords, index_post_songs
+from utils.song_catalog import upsert_songs, link_post_songs
+
+RECOMMEND_SONGS = 'recommend_songs'
+
+# how long a play waits on another request's preview lookup of the same song (then the claim
+# is taken over) + how often it checks for the answer (seconds)
+PREVIEW_CLAIM_TTL = float(os.getenv("PREVIEW_CLAIM_TTL", 2 * PREVIEW_TIMEOUT))
+PREVIEW_POLL_INTERVAL = 0.1
+
+
+def queue_recommendations(post, image_url=None, image_file=None):
+    """Queue the keyword + song pipeline for a freshly saved (pending) post"""
+
+    payload = {'post_id': post.id, 'image_url': image_url, 'image_file': image_file}
+
+    return enqueue(RECOMMEND_SONGS, payload, post_id=post.id)
+
+def reuse_recommendations(post, source_post):
+    """
+    Give a post the keywords + songs of an earlier post of the same photo (no API calls)
+    Part of the caller's transaction, the post is ready right away
+
+    """
+
+    keywords = [row.keyword for row in PostKeyword.query.filter_by(post_id=source_post.id)]
+    record_post_keywords(post.id, keywords)
+
+    song_ids = [link.song_id for link in PostSong.query.filter_by(post_id=source_post.id).order_by(PostSong.id)]
+
+    index_post_songs(post.id, link_post_songs(post.id, song_ids))
+    post.status = 'ready'
+
+def save_post_songs(post, songs):
+    """
+    Add songs to the DB (reusing existing ones) + link them to the post
+    A constant number of statements whatever the number of songs (see utils/song_catalog.py)
+    New links are counted in the keyword index under the post's recorded keywords
+
+    """
+
+    new_ids = link_post_songs(post.id, upsert_songs(songs))
+
+    index_post_songs(post.id, new_ids)
+
+def claim_song_preview(song_id):
+    """
+    Claim a song's preview lookup (committed right away), True if this caller should ask Node
+    A claim older than PREVIEW_CLAIM_TTL is taken over : the lookup that made it died
+
+    """
+
+    claimed = db.session.execute(text('''
+        UPDATE songs SET preview_claimed_at = now()
+        WHERE id = :song_id AND preview_url IS NULL
+          AND (preview_claimed_at IS NULL OR preview_claimed_at < now() - make_interval(secs => :ttl))
+        RETURNING id
+    '''), {'song_id': song_id, 'ttl': PREVIEW_CLAIM_TTL}).first()
+    db.session.commit()
+
+    return claimed is not None
+
+def resolve_song_preview(song_id):
+    """
+    Preview URL of a saved song, looked up (+ stored in songs.preview_url) the first time it is asked for
+    Single-flight : the first request claims the song (no lock or transaction is held during the
+    lookup), concurrent ones (in any process) poll for its answer instead of asking Node again
+    A song without a preview is stored as NO_PREVIEW, a failed lookup isn't stored (the next play retries)
+    Returns (song, preview_url), song is None if it doesn't exist
+
+    """
+
+    waiting = Deadline(PREVIEW_CLAIM_TTL)
+
+    while True:
+        song = Song.query.get(song_id)
+        db.session.commit()
+
+        if song is None or song.preview_url is not None:
+            return song, (song.preview_url or None) if song else None
+
+        if claim_song_preview(song_id):
+            break
+
+        if waiting.expired:
+            return song, None # the lookup that claimed it is still running
+
+        time.sleep(PREVIEW_POLL_INTERVAL)
+
+    try:
+        # cache first, then Node
+        preview_url = find_preview_url(f"{song.title} {song.artist}")
+    except Exception as e:
+        print("Error resolving preview:", e)
+        song.preview_claimed_at = None # let the next play try again
+        db.session.commit()
+        return song, None
+
+    song.preview_url = preview_url or NO_PREVIEW
+    db.session.commit()
+
+    return song, preview_url
+
+def mark_post_failed(job):
+    """Give up on a post whose job ran out of attempts"""
+
+    post = Post.query.get(job.payload['post_id'])
+
+    if post:
+        post.status = 'failed'
+        db.session.commit()
+
+@job_handler(RECOMMEND_SONGS, on_failure=mark_post_failed)
+def recommend_songs(job):
+    """Background job : image -> keywords -> songs -> DB"""
+
+    post = Post.query.get(job.payload['post_id'])
+
+    if post is None:
+        return # post was deleted before the job ran
+
+    # one time budget for the whole image -> keywords -> songs -> previews chain
+    deadline = Deadline(PIPELINE_BUDGET)
+
+    update_progress(job, 'Analyzing image', 10)
+    scored = image_to_keywords(image_url=job.payload.get('image_url'),
+                               local_image_file=job.payload.get('image_file'),
+                               deadline=deadline, with_scores=True)
+
+    if scored:
+        keywords = [k['keyword'] for k in scored]
+        record_post_keywords(post.id, keywords)
+        update_progress(job, 'Finding songs', 40)
+
+        # songs come best first, ranked on the keywords' scores
+        # with LAZY_PREVIEWS songs come without waiting on Node (see resolve_song_preview)
+        songs = iter_keywords_to_songs(keywords, deadline=deadline, scores=[k['score'] for k in scored],
+                                       resolve_previews=not LAZY_PREVIEWS)
+
+        if LAZY_PREVIEWS:
+            # nothing to wait on : every song is saved with one upsert + one link
+            # (songs linked by an earlier attempt are skipped)
+            songs = list(songs)
+            save_post_songs(post, songs)
+            update_progress(job, 'Finding songs', 40 + 55 * len(songs) // MAX_SONGS)
+        else:
+            # save each song as soon as its preview resolves so /posts/<id>/stream can push it right away
+            for count, song in enumerate(songs, start=1):
+                save_post_songs(post, [song])
+                update_progress(job, 'Finding songs', 40 + 55 * count // MAX_SONGS)
+    else:
+        update_progress(job, 'No keywords found', 95)
+
+    post.status = 'ready'
+    db.session.commit()
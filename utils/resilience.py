@@ -0,0 +1,144 @@
+import threading
+import time
+
+
+class DeadlineExceeded(Exception):
+    """The time budget ran out before the work finished"""
+
+
+class CircuitOpen(Exception):
+    """Call skipped because the upstream's circuit breaker is open"""
+
+
+class Deadline:
+    """
+    Time budget shared by every stage of a pipeline
+    stage(share) hands a stage its share of the total, never past the overall end
+
+    """
+
+    def __init__(self, seconds):
+        self.total = seconds
+        self.ends_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.ends_at - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def stage(self, share):
+        return Deadline(min(self.total * share, self.remaining()))
+
+    def check(self, what='pipeline'):
+        if self.expired:
+            raise DeadlineExceeded(f'{what} ran out of time ({self.total:.1f}s budget)')
+
+
+class CircuitBreaker:
+    """
+    Stop calling an upstream after `failure_threshold` failures in a row
+    Once `reset_timeout` seconds pass one trial call is let through (half open),
+    it closes the circuit again on success or re-opens it on failure
+
+    Usable as `with breaker:` or by calling allow() / record_success() / record_failure()
+
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self.failures = 0 # consecutive
+        self.trips = 0
+        self.rejected = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may go through right now"""
+
+        with self.lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.trial_running = False
+
+            if self.state == self.CLOSED:
+                return True
+
+            if self.state == self.HALF_OPEN and not self.trial_running:
+                self.trial_running = True
+                return True
+
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                print(f"Circuit {self.name} closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                    print(f"Circuit {self.name} opened after {self.failures} failure(s) (trip #{self.trips})")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """Give back a trial call that never reported an outcome (e.g. it was cancelled)"""
+
+        with self.lock:
+            self.trial_running = False
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'trips': self.trips,
+                'rejected': self.rejected,
+            }
+
+    def __enter__(self):
+        if not self.allow():
+            raise CircuitOpen(f'Circuit {self.name} is open')
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.record_success()
+        else:
+            self.record_failure()
+        return False
+
+
+BREAKERS = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name, failure_threshold=5, reset_timeout=30):
+    """Process-wide breaker for an upstream, created on first use"""
+
+    with _breakers_lock:
+        if name not in BREAKERS:
+            BREAKERS[name] = CircuitBreaker(name, failure_threshold, reset_timeout)
+        return BREAKERS[name]
+
+def breaker_states():
+    """{name: state + counters} for every breaker in this process"""
+
+    return {name: breaker.snapshot() for name, breaker in BREAKERS.items()}
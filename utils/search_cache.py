@@ -0,0 +1,157 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # shared layer is optional
+    redis = None
+
+
+class LRUCache:
+    """In-process cache with least-recently-used eviction + a TTL per entry"""
+
+    def __init__(self, maxsize=512, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value or None when missing / expired"""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SearchCache:
+    """
+    Two-level cache for Spotify search results
+    In-process LRU first, then an optional Redis layer shared by all gunicorn workers
+
+    """
+
+    def __init__(self, maxsize=512, ttl=3600, redis_url=None, prefix='imagime:search:'):
+        self.local = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.shared = None
+        self.stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+        # searches run in a thread pool, += on the counters isn't atomic
+        self._stats_lock = threading.Lock()
+
+        if redis_url and redis is not None:
+            self.shared = redis.Redis.from_url(redis_url, socket_timeout=0.5)
+
+    def _count(self, stat):
+        with self._stats_lock:
+            self.stats[stat] += 1
+
+    def _shared_key(self, key):
+        return self.prefix + json.dumps(key)
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self._count('local_hits')
+            return value
+
+        if self.shared is not None:
+            try:
+                raw = self.shared.get(self._shared_key(key))
+            except redis.RedisError as e:
+                print("Error reading shared search cache:", e)
+                raw = None
+
+            if raw is not None:
+                value = json.loads(raw)
+                self.local.set(key, value)
+                self._count('shared_hits')
+                return value
+
+        self._count('misses')
+        return None
+
+    def set(self, key, value):
+        self.local.set(key, value)
+
+        if self.shared is not None:
+            try:
+                self.shared.setex(self._shared_key(key), self.ttl, json.dumps(value))
+            except redis.RedisError as e:
+                print("Error writing shared search cache:", e)
+
+    def clear(self):
+        self.local.clear()
+
+
+class CachedSpotify:
+    """
+    Wraps a spotipy client so track searches are served from a SearchCache
+    Cache misses go through the optional circuit breaker, so cached searches keep
+    working while Spotify is down
+    Everything other than track searches goes straight to the client
+    Without a client, client_factory() builds one on first use
+
+    """
+
+    def __init__(self, client, cache, breaker=None, client_factory=None):
+        self._client = client
+        self._client_factory = client_factory
+        self._client_lock = threading.Lock()
+        self.cache = cache
+        self.breaker = breaker
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._client_factory()
+        return self._client
+
+    def search(self, q, limit=10, offset=0, type='track', market=None):
+        if type != 'track' or offset:
+            return self.client.search(q=q, limit=limit, offset=offset, type=type, market=market)
+
+        key = (q.strip().lower(), limit, market)
+
+        result = self.cache.get(key)
+        if result is None:
+            if self.breaker is None:
+                result = self.client.search(q=q, limit=limit, type=type, market=market)
+            else:
+                with self.breaker:
+                    result = self.client.search(q=q, limit=limit, type=type, market=market)
+            self.cache.set(key, result)
+
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
@@ -0,0 +1,69 @@
+from sqlalchemy.dialects.postgresql import insert
+from models import db, Song, PostSong, NO_PREVIEW, spotify_track_id
+
+
+def song_row(song):
+    """Columns of a songs row for a recommended song dict (spotify_id from the URL if missing)"""
+
+    return {
+        'spotify_id': song.get('spotify_id') or spotify_track_id(song['spotify_url']),
+        'title': song['title'],
+        'artist': song['artist'],
+        'spotify_url': song['spotify_url'],
+        'image_url': song.get('image_url'),
+        'preview_url': song.get('preview_url')
+    }
+
+def upsert_songs(songs):
+    """
+    Add songs to the catalog, reusing the saved ones, in one statement (part of the caller's transaction)
+    A saved song without a preview (not looked up, or none found) gets the batch's one
+    Returns the song ids in the order of `songs` (a song given twice gets the same id)
+
+    """
+
+    rows = {}
+    keys = []
+    for song in songs:
+        row = song_row(song)
+        keys.append(row['spotify_id'])
+        # a row can only be upserted once per statement
+        saved = rows.setdefault(row['spotify_id'], row)
+        saved['preview_url'] = saved['preview_url'] or row['preview_url']
+
+    if not rows:
+        return []
+
+    table = Song.__table__
+    stmt = insert(table).values(list(rows.values()))
+    # DO UPDATE (not NOTHING) so saved songs come back in RETURNING too
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['spotify_id'],
+        set_={'preview_url': db.func.coalesce(db.func.nullif(table.c.preview_url, NO_PREVIEW),
+                                              stmt.excluded.preview_url, table.c.preview_url)}
+    ).returning(table.c.id, table.c.spotify_id)
+
+    ids = {spotify_id: song_id for song_id, spotify_id in db.session.execute(stmt)}
+
+    return [ids[spotify_id] for spotify_id in keys]
+
+def link_post_songs(post_id, song_ids):
+    """
+    Link songs to a post in one statement, in order, skipping the ones it already has
+    Returns the ids of the songs newly linked
+
+    """
+
+    song_ids = list(dict.fromkeys(song_ids))
+    if not song_ids:
+        return []
+
+    table = PostSong.__table__
+    stmt = (insert(table)
+            .values([{'post_id': post_id, 'song_id': song_id} for song_id in song_ids])
+            .on_conflict_do_nothing(index_elements=['post_id', 'song_id'])
+            .returning(table.c.song_id))
+
+    linked = {song_id for song_id, in db.session.execute(stmt)}
+
+    return [song_id for song_id in song_ids if song_id in linked]
@@ -0,0 +1,91 @@
+"""
+Relevance ranking of song candidates
+Every song a keyword's search (or the keyword index) returned is a candidate, scored on
+    relevance  : the weights (Everypixel confidence) of the keywords that found it,
+                 discounted by its position in each keyword's results
+    popularity : Spotify popularity (0-100)
+    cross hits : how many different keywords found it
+The whole candidate x keyword matrix is scored at once with NumPy
+
+"""
+
+import os
+import numpy as np
+
+RELEVANCE_WEIGHT = float(os.getenv("RANK_RELEVANCE_WEIGHT", 1.0))
+POPULARITY_WEIGHT = float(os.getenv("RANK_POPULARITY_WEIGHT", 0.3))
+CROSS_HIT_WEIGHT = float(os.getenv("RANK_CROSS_HIT_WEIGHT", 0.5))
+
+# a keyword's 2nd result counts 1 / 1.5 of its 1st, the 3rd 1 / 2 ...
+POSITION_DECAY = 0.5
+
+# songs from the keyword index don't carry a Spotify popularity, they count as average
+DEFAULT_POPULARITY = 50
+
+
+def keyword_weights(scores):
+    """Weights of keywords in order, a missing score falls back to a decay on the keyword's rank"""
+
+    return np.array([score if score is not None else max(0.1, 1 - 0.05 * rank)
+                     for rank, score in enumerate(scores)], dtype=float)
+
+def candidate_matrix(results):
+    """
+    Unique candidates across every keyword's results (by title + artist, first copy kept)
+    Returns (candidates, hits, popularity) where hits[i, j] is candidate i's position weight
+    in keyword j's results (0 when keyword j didn't find it)
+
+    """
+
+    candidates = []
+    index = {}
+    rows, cols, values = [], [], []
+
+    for col, songs in enumerate(results):
+        for position, song in enumerate(songs):
+            key = (song['title'], song['artist'])
+            if key not in index:
+                index[key] = len(candidates)
+                candidates.append(song)
+
+            rows.append(index[key])
+            cols.append(col)
+            values.append(1 / (1 + POSITION_DECAY * position))
+
+    hits = np.zeros((len(candidates), len(results)))
+    # a song listed twice by one keyword counts once, at its best position
+    np.maximum.at(hits, (np.array(rows, dtype=int), np.array(cols, dtype=int)), values)
+
+    popularity = np.array([song.get('popularity') if song.get('popularity') is not None else DEFAULT_POPULARITY
+                           for song in candidates], dtype=float)
+
+    return candidates, hits, popularity
+
+def score_candidates(hits, weights, popularity):
+    """Score of every candidate (row of hits), higher is better"""
+
+    relevance = hits @ weights
+    if relevance.size and relevance.max() > 0:
+        relevance = relevance / relevance.max()
+
+    cross_hits = (np.count_nonzero(hits, axis=1) - 1) / max(1, hits.shape[1] - 1)
+
+    return (RELEVANCE_WEIGHT * relevance
+            + POPULARITY_WEIGHT * popularity / 100
+            + CROSS_HIT_WEIGHT * cross_hits)
+
+def rank_songs(results, scores, k):
+    """
+    The k best songs (best first) from every keyword's results
+    results + scores are in keyword order, ties keep the order songs were found in
+
+    """
+
+    candidates, hits, popularity = candidate_matrix(results)
+    if not candidates:
+        return []
+
+    total = score_candidates(hits, keyword_weights(scores), popularity)
+    best = np.argsort(-total, kind='stable')[:k]
+
+    return [candidates[i] for i in best]
@@ -0,0 +1,138 @@
+"""
+Spotify access token shared by every process on the host
+Each gunicorn worker used to fetch (+ refresh) its own client credentials token, so every
+restart or scale-out cost an auth round trip per worker. The token now lives in one JSON file,
+a worker that finds it about to expire takes an exclusive file lock, checks again and only then
+asks Spotify, so one refresh serves every worker
+
+"""
+
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+import requests
+from spotipy.cache_handler import CacheHandler
+from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOauthError
+
+# refresh this many seconds before the token expires (spotipy's own margin is 60)
+REFRESH_MARGIN = int(os.getenv("SPOTIFY_TOKEN_REFRESH_MARGIN", 300))
+
+
+def token_fresh(token_info, margin=REFRESH_MARGIN):
+    return bool(token_info) and token_info.get('expires_at', 0) - time.time() > margin
+
+
+class SharedTokenCache(CacheHandler):
+    """
+    spotipy cache handler keeping the token in a JSON file every process reads
+    Writes go to a temp file that is renamed over the cache, so readers never see half a token
+    The last token read is kept in memory, the file is only read again once it is due a refresh
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self._token = None
+
+    def get_cached_token(self):
+        if token_fresh(self._token):
+            return self._token
+
+        try:
+            with open(self.path) as file:
+                self._token = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print("Error reading Spotify token cache:", e)
+            return None
+
+        return self._token
+
+    def save_token_to_cache(self, token_info):
+        self._token = token_info
+
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', suffix='.tmp')
+            with os.fdopen(fd, 'w') as file:
+                json.dump(token_info, file)
+            os.chmod(tmp_path, 0o600) # it's a bearer token
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print("Error writing Spotify token cache:", e)
+
+    def refresh_lock(self):
+        """Exclusive lock (across processes) held while one of them refreshes the token"""
+
+        return FileLock(self.lock_path)
+
+
+class FileLock:
+    """flock on a lock file, released when the block exits"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+class SharedClientCredentials(SpotifyClientCredentials):
+    """
+    Client credentials flow where only one process (+ one thread) refreshes the token
+    The others wait on the lock, then pick up the token it saved
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._refresh_lock = threading.Lock()
+
+    def get_access_token(self, as_dict=True, check_cache=True):
+        token_info = self.cache_handler.get_cached_token()
+        if check_cache and token_fresh(token_info):
+            return token_info if as_dict else token_info['access_token']
+
+        with self._refresh_lock, self._process_lock():
+            # someone may have refreshed it while we waited
+            token_info = self.cache_handler.get_cached_token()
+            if not check_cache or not token_fresh(token_info):
+                try:
+                    new_token = self._request_access_token()
+                except (SpotifyOauthError, requests.RequestException):
+                    # an early refresh failed, keep using the old token while it still works
+                    if not token_fresh(token_info, margin=60):
+                        raise
+                    print("Spotify token refresh failed, using the current token until it expires")
+                else:
+                    token_info = self._add_custom_values_to_token_info(new_token)
+                    self.cache_handler.save_token_to_cache(token_info)
+
+        return token_info if as_dict else token_info['access_token']
+
+    def _process_lock(self):
+        if isinstance(self.cache_handler, SharedTokenCache):
+            return self.cache_handler.refresh_lock()
+        return NoLock()
+
+
+class NoLock:
+    """Stand-in for the file lock when the token isn't shared (e.g. spotipy's MemoryCacheHandler)"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
@@ -0,0 +1,82 @@
+from sqlalchemy import text, func
+from sqlalchemy.dialects.postgresql import insert
+from models import (db, User, TimelineEntry, TimelineSetting, TIMELINE_TRIGGERS, TIMELINE_LENGTH, FANOUT_MAX_FOLLOWERS,
+                    FAN_OUT_JOB, BACKFILL_AUTHOR_JOB)
+from utils.jobs import job_handler, enqueue
+
+
+def install_timeline_triggers():
+    """(Re)create the fan-out triggers (they read their settings from timeline_settings)"""
+
+    db.session.execute(text(TIMELINE_TRIGGERS))
+    db.session.commit()
+
+@job_handler(FAN_OUT_JOB)
+def fan_out_post(job):
+    """Background job : a new post -> its author's followers' timelines"""
+
+    db.session.execute(text('SELECT fan_out_to_followers(:post_id)'), {'post_id': job.payload['post_id']})
+
+@job_handler(BACKFILL_AUTHOR_JOB)
+def backfill_author(job):
+    """Background job : an author back under the fan-out cap -> their latest posts on their followers' timelines"""
+
+    db.session.execute(text('SELECT backfill_author(:author_id)'), {'author_id': job.payload['author_id']})
+
+def sync_timeline_settings():
+    """
+    Bring timeline_settings (read by the triggers + the home feed) in step with TIMELINE_LENGTH
+    + FANOUT_MAX_FOLLOWERS, run by `flask worker` on startup + `flask timeline sync`
+    A raised fan-out cap queues a backfill job for each author it brings back under it
+    Returns {setting: (saved, new)} for the settings that changed
+
+    """
+
+    saved = dict(db.session.query(TimelineSetting.name, TimelineSetting.value))
+    wanted = {'length': TIMELINE_LENGTH, 'fanout_max_followers': FANOUT_MAX_FOLLOWERS}
+    changed = {name: (saved.get(name), value) for name, value in wanted.items() if saved.get(name) != value}
+
+    if not changed:
+        return {}
+
+    stmt = insert(TimelineSetting.__table__).values([{'name': name, 'value': value} for name, value in wanted.items()])
+    db.session.execute(stmt.on_conflict_do_update(index_elements=['name'], set_={'value': stmt.excluded.value}))
+
+    old_cap = saved.get('fanout_max_followers')
+    if old_cap is not None and FANOUT_MAX_FOLLOWERS > old_cap:
+        # read at query time until now
+        authors = (db.session.query(User.id)
+                   .filter(User.follower_count > old_cap, User.follower_count <= FANOUT_MAX_FOLLOWERS)
+                   .order_by(User.id))
+        for author_id, in authors:
+            enqueue(BACKFILL_AUTHOR_JOB, {'author_id': author_id})
+
+    db.session.commit()
+
+    return changed
+
+def rebuild_timelines(batch_size=200):
+    """
+    Refill every user's timeline from posts + follows, committing every batch_size users
+    For timelines filled before the triggers existed
+    Returns how many timelines were rebuilt
+
+    """
+
+    user_ids = [user_id for user_id, in db.session.query(User.id).order_by(User.id)]
+
+    for start in range(0, len(user_ids), batch_size):
+        for user_id in user_ids[start:start + batch_size]:
+            db.session.execute(text('SELECT rebuild_timeline(:user_id)'), {'user_id': user_id})
+        db.session.commit()
+
+    return len(user_ids)
+
+def timeline_stats():
+    """Entries stored, users with a timeline + users whose timeline has been trimmed"""
+
+    return {
+        'entries': TimelineEntry.query.count(),
+        'timelines': db.session.query(func.count(TimelineEntry.user_id.distinct())).scalar(),
+        'trimmed': User.query.filter(User.timeline_horizon.isnot(None)).count(),
+    }
@@ -0,0 +1,64 @@
+from sqlalchemy import text
+from models import db, COUNTER_TRIGGERS
+
+COUNTERS = ('post_count', 'favorite_count', 'following_count', 'follower_count')
+
+# what every counter should be, counted from the source tables
+ACTUAL_COUNTS = '''
+    SELECT u.id,
+           (SELECT count(*) FROM posts p WHERE p.user_id = u.id) AS post_count,
+           (SELECT count(*) FROM favorited_songs f WHERE f.user_id = u.id) AS favorite_count,
+           (SELECT count(*) FROM follows f WHERE f.follower_id = u.id) AS following_count,
+           (SELECT count(*) FROM follows f WHERE f.followed_id = u.id) AS follower_count
+    FROM users u
+'''
+
+DRIFTED = '''
+    (u.post_count, u.favorite_count, u.following_count, u.follower_count)
+    IS DISTINCT FROM (a.post_count, a.favorite_count, a.following_count, a.follower_count)
+'''
+
+
+def install_counter_triggers():
+    """(Re)create the counter triggers, e.g. on a database created before they existed"""
+
+    db.session.execute(text(COUNTER_TRIGGERS))
+    db.session.commit()
+
+def drifted_counters():
+    """{user_id: {counter: (stored, actual)}} for every user whose counters are off"""
+
+    rows = db.session.execute(text(f'''
+        SELECT u.id, {', '.join(f'u.{c}, a.{c}' for c in COUNTERS)}
+        FROM users u JOIN ({ACTUAL_COUNTS}) a ON a.id = u.id
+        WHERE {DRIFTED}
+    ''')).fetchall()
+
+    drift = {}
+    for row in rows:
+        values = list(row[1:])
+        drift[row[0]] = {counter: (values[2 * i], values[2 * i + 1])
+                         for i, counter in enumerate(COUNTERS) if values[2 * i] != values[2 * i + 1]}
+
+    return drift
+
+def reconcile_counters():
+    """
+    Recount the counters of users that drifted (one UPDATE)
+    Returns the drift that was repaired, see drifted_counters()
+
+    """
+
+    drift = drifted_counters()
+
+    if drift:
+        db.session.execute(text(f'''
+            UPDATE users u
+            SET {', '.join(f'{c} = a.{c}' for c in COUNTERS)}
+            FROM ({ACTUAL_COUNTS}) a
+            WHERE a.id = u.id AND {DRIFTED}
+        '''))
+
+    db.session.commit()
+
+    return drift